@@ -0,0 +1,12 @@
+"""Data layer for the Beijing Air Quality dashboard.
+
+The Streamlit app in ``main.py`` handles widgets and rendering; the modules in
+this package hold the pandas/NumPy work underneath it so it can be cached and
+reused outside a Streamlit session. ``core`` is the headless entry point and
+``python -m airquality report`` runs it in batch (see ``cli.py``).
+"""
+
+import os
+
+# On-disk cache for converted datasets. Override with AQ_CACHE_DIR.
+CACHE_DIR = os.environ.get("AQ_CACHE_DIR", os.path.join(os.getcwd(), ".aq_cache"))
@@ -0,0 +1,171 @@
+"""Vectorized concentration-to-AQI conversion (US EPA and China HJ 633-2012).
+
+Each pollutant's sub-index is a piecewise-linear function of its
+concentration. The breakpoint tables below are looked up for a whole column
+at once with ``np.searchsorted`` and the overall AQI is the row-wise maximum
+of the sub-indices, so millions of rows take a handful of array passes.
+
+Inputs are hourly readings in µg/m³ (the unit of the UCI Beijing files and
+the OpenWeather API); gases are converted to the unit each table expects at
+25 °C and 1 atm. Hourly values are applied to the tables directly, so PM and
+8-hour ozone results are an hourly approximation of the official averages.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .schema import POLLUTANTS
+
+Standard = namedtuple("Standard", ["label", "tables", "scale", "precision", "categories", "rounding"])
+
+# µg/m³ per ppb at 25 °C is MW / 24.45
+_PPB = {"no2": 24.45 / 46.01, "so2": 24.45 / 64.07, "co": 24.45 / 28.01, "o3": 24.45 / 48.00}
+
+# Category upper bounds shared by both scales: 0–50, 51–100, ..., >300
+_UPPER = np.array([50, 100, 150, 200, 300], dtype="float32")
+AQI_RANGES = ("0–50", "51–100", "101–150", "151–200", "201–300", ">300")
+
+US_EPA = Standard(
+    label="US EPA",
+    # (C_low, C_high, I_low, I_high); PM in µg/m³, NO2/SO2 in ppb, CO/O3 in ppm
+    tables={
+        "pm2.5": ((0.0, 9.0, 0, 50), (9.1, 35.4, 51, 100), (35.5, 55.4, 101, 150),
+                  (55.5, 125.4, 151, 200), (125.5, 225.4, 201, 300), (225.5, 325.4, 301, 500)),
+        "pm10": ((0, 54, 0, 50), (55, 154, 51, 100), (155, 254, 101, 150),
+                 (255, 354, 151, 200), (355, 424, 201, 300), (425, 604, 301, 500)),
+        "o3": ((0.0, 0.054, 0, 50), (0.055, 0.070, 51, 100), (0.071, 0.085, 101, 150),
+               (0.086, 0.105, 151, 200), (0.106, 0.200, 201, 300), (0.201, 0.604, 301, 500)),
+        "co": ((0.0, 4.4, 0, 50), (4.5, 9.4, 51, 100), (9.5, 12.4, 101, 150),
+               (12.5, 15.4, 151, 200), (15.5, 30.4, 201, 300), (30.5, 50.4, 301, 500)),
+        "so2": ((0, 35, 0, 50), (36, 75, 51, 100), (76, 185, 101, 150),
+                (186, 304, 151, 200), (305, 604, 201, 300), (605, 1004, 301, 500)),
+        "no2": ((0, 53, 0, 50), (54, 100, 51, 100), (101, 360, 101, 150),
+                (361, 649, 151, 200), (650, 1249, 201, 300), (1250, 2049, 301, 500)),
+    },
+    scale={"pm2.5": 1.0, "pm10": 1.0, "no2": _PPB["no2"], "so2": _PPB["so2"],
+           "co": _PPB["co"] / 1000, "o3": _PPB["o3"] / 1000},
+    # Concentrations are truncated to the table's precision before lookup
+    precision={"pm2.5": 0.1, "pm10": 1, "o3": 0.001, "co": 0.1, "so2": 1, "no2": 1},
+    categories=(
+        ("Good", "#00e400"), ("Moderate", "#ffff00"), ("Unhealthy for Sensitive Groups", "#ff7e00"),
+        ("Unhealthy", "#ff0000"), ("Very Unhealthy", "#8f3f97"), ("Hazardous", "#7e0023"),
+    ),
+    rounding=np.round,
+)
+
+
+def _contiguous(concentrations, indices=(0, 50, 100, 150, 200, 300, 400, 500)):
+    """Rows for a table whose breakpoints are shared by neighbouring segments."""
+    return tuple(zip(concentrations[:-1], concentrations[1:], indices[:-1], indices[1:]))
+
+
+CHINA_HJ633 = Standard(
+    label="China HJ 633",
+    # Hourly limits; CO in mg/m³, everything else in µg/m³. SO2 has no 1-hour
+    # limit above 800 µg/m³, so the 24-hour upper breakpoints continue the table.
+    tables={
+        "pm2.5": _contiguous((0, 35, 75, 115, 150, 250, 350, 500)),
+        "pm10": _contiguous((0, 50, 150, 250, 350, 420, 500, 600)),
+        "so2": _contiguous((0, 150, 500, 650, 800, 1600, 2100, 2620)),
+        "no2": _contiguous((0, 100, 200, 700, 1200, 2340, 3090, 3840)),
+        "co": _contiguous((0, 5, 10, 35, 60, 90, 120, 150)),
+        "o3": _contiguous((0, 160, 200, 300, 400, 800, 1000, 1200)),
+    },
+    scale={"pm2.5": 1.0, "pm10": 1.0, "no2": 1.0, "so2": 1.0, "co": 1 / 1000, "o3": 1.0},
+    precision={},
+    categories=(
+        ("Excellent", "#00e400"), ("Good", "#ffff00"), ("Lightly Polluted", "#ff7e00"),
+        ("Moderately Polluted", "#ff0000"), ("Heavily Polluted", "#99004c"),
+        ("Severely Polluted", "#7e0023"),
+    ),
+    rounding=np.ceil,
+)
+
+STANDARDS = {"us": US_EPA, "cn": CHINA_HJ633}
+
+
+def _table(std, pollutant):
+    """Lookup arrays for one pollutant: segment lows plus each segment's slope and offset.
+
+    Concentrations are measured in steps of the table's precision, so the
+    truncation and the lookup both work on exact integers.
+    """
+    c_lo, c_hi, i_lo, i_hi = (np.array(col, dtype="float64") for col in zip(*std.tables[pollutant]))
+    step = std.precision.get(pollutant, 1.0)
+    c_lo, c_hi = np.round(c_lo / step), np.round(c_hi / step)
+    slope = (i_hi - i_lo) / (c_hi - c_lo)
+    offset = i_lo - slope * c_lo
+    return c_lo.astype("float32"), slope.astype("float32"), offset.astype("float32"), np.float32(i_hi[-1]), step
+
+
+_TABLES = {key: {p: _table(std, p) for p in std.tables} for key, std in STANDARDS.items()}
+
+
+def sub_index(values, pollutant, standard="us"):
+    """Float32 sub-index of one pollutant for an array of µg/m³ concentrations; NaN stays NaN."""
+    std = STANDARDS[standard]
+    c_lo, slope, offset, top, step = _TABLES[standard][pollutant]
+    c = np.array(values, dtype="float32")
+    c *= np.float32(std.scale[pollutant] / step)
+    np.maximum(c, 0, out=c)
+    if pollutant in std.precision:
+        c += np.float32(1e-3)
+        np.floor(c, out=c)
+    row = np.searchsorted(c_lo, c, side="right")
+    row -= 1
+    np.clip(row, 0, len(c_lo) - 1, out=row)
+    c *= slope[row]
+    c += offset[row]
+    # Readings beyond the top breakpoint are reported at the top of the scale
+    np.minimum(c, top, out=c)
+    return std.rounding(c, out=c)
+
+
+def sub_indices(df, standard="us"):
+    """Frame of float32 sub-indices for every pollutant column present in ``df``."""
+    return pd.DataFrame(
+        {p: sub_index(df[p].to_numpy(dtype="float32", na_value=np.nan), p, standard)
+         for p in POLLUTANTS if p in df.columns},
+        index=df.index,
+    )
+
+
+def compute_aqi(df, standard="us"):
+    """Overall AQI per row: the highest sub-index, NaN where no pollutant was measured."""
+    out = np.full(len(df), np.nan, dtype="float32")
+    for p in POLLUTANTS:
+        if p in df.columns:
+            # fmax skips NaN, so a missing pollutant never hides a measured one
+            np.fmax(out, sub_index(df[p].to_numpy(dtype="float32", na_value=np.nan), p, standard), out=out)
+    return pd.Series(out, index=df.index, name="aqi")
+
+
+def categorize(aqi, standard="us"):
+    """Ordered categorical of category labels for AQI values; NaN maps to a missing value."""
+    labels = [label for label, _ in STANDARDS[standard].categories]
+    values = np.asarray(aqi, dtype="float32")
+    codes = np.searchsorted(_UPPER, values, side="left")
+    codes[np.isnan(values)] = -1
+    return pd.Categorical.from_codes(codes, categories=labels, ordered=True)
+
+
+def category_colors(standard="us"):
+    """``{label: color}`` for a standard's categories, in scale order."""
+    return dict(STANDARDS[standard].categories)
+
+
+def fill_aqi(df, standard="us", keep_reported=True):
+    """Shallow copy of ``df`` with ``aqi`` computed from concentrations and an ``aqi_category`` column.
+
+    Rows without any pollutant reading keep their reported ``aqi`` when
+    ``keep_reported`` is set, i.e. when the sources report on the same scale.
+    """
+    out = df.copy(deep=False)
+    aqi = compute_aqi(df, standard)
+    if keep_reported and "aqi" in df.columns:
+        aqi = aqi.fillna(pd.to_numeric(df["aqi"], errors="coerce").astype("float32"))
+    out["aqi"] = aqi
+    out["aqi_category"] = categorize(aqi, standard)
+    return out
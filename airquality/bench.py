@@ -0,0 +1,249 @@
+"""Benchmark harness for the ingestion-to-chart pipeline.
+
+Every case runs the same stages the dashboard runs, one at a time:
+ingestion (cold conversion and warm memory-mapped load), merge, station view,
+UTC normalization and AQI, the timezone view with its calendar fields (cold,
+then again from the calendar cache), rollups, correlation statistics, the
+hourly grid with linear gap filling, the date filter, the computation behind
+each of charts 1-9 (including the exceedance episodes, the event impact
+bootstrap and the trend test), the summary table, a gzip CSV export, and
+training and one 72-hour inference of the PM2.5 forecast model. Each stage
+records wall time, peak traced memory (``tracemalloc`` sees NumPy and pandas
+buffers) and rows in/out.
+
+Cases are the bundled ``data/*.csv`` files (the realistic baseline) and
+synthetic multi-station hourly data at a requested row count. Results are
+written as JSON. Comparing against an earlier file flags every stage that
+got slower than the threshold allows.
+
+    python -m airquality bench --sizes bundled,10k,1m --save bench.json
+    python -m airquality bench --sizes 1m --compare bench.json --threshold 0.25
+"""
+
+import gc
+import glob
+import os
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+from .core import NUMERIC_COLUMNS, Dataset, load_csv_file, merge_sources, station_frame
+from .correlation import CorrelationStore
+from .downsample import DEFAULT_POINTS, downsample
+from .episodes import detect
+from .events import DEFAULT_EVENTS, event_impact, event_table
+from .export import write_export
+from .forecast import ForecastModel
+from .gaps import HourlyGrid
+from .profiler import Profiler
+from .query import RollupQueries
+from .render import binned_density
+from .rollups import RollupStore
+from .stations import CITY_WIDE
+from .timeindex import date_slice
+from .trends import rollup_means, series_trends
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000, "50m": 50_000_000}
+HOURS_PER_STATION = 5 * 8760
+# Stages faster than this are too noisy to flag as regressions
+MIN_SECONDS = 0.05
+
+
+def synthetic_frame(n_rows, seed=0, start="2013-03-01"):
+    """Hourly readings for enough stations to reach ``n_rows``, in the UCI multi-station layout.
+
+    Each station covers a contiguous block of hours; blocks are concatenated
+    station by station, as when the per-station files are stacked.
+    """
+    rng = np.random.default_rng(seed)
+    n_stations = int(np.clip(round(n_rows / HOURS_PER_STATION), 1, 1000))
+    hours = -(-n_rows // n_stations)
+    offsets = np.tile(np.arange(hours, dtype="int64"), n_stations)[:n_rows]
+    station = np.repeat(np.arange(n_stations), hours)[:n_rows]
+    times = np.datetime64(start, "h") + offsets
+
+    # Winter and night peaks with log-normal noise, loosely like Beijing PM2.5
+    day_of_year = (offsets // 24) % 365
+    seasonal = 1.0 + 0.6 * np.cos(2 * np.pi * day_of_year / 365)
+    diurnal = 1.0 + 0.2 * np.cos(2 * np.pi * ((offsets % 24) - 22) / 24)
+    pm25 = (60 * seasonal * diurnal * rng.lognormal(0, 0.6, n_rows)).astype("float32")
+
+    def noise(scale):
+        return rng.lognormal(0, scale, n_rows).astype("float32")
+
+    frame = pd.DataFrame({
+        "year": times.astype("datetime64[Y]").astype("int64") + 1970,
+        "month": times.astype("datetime64[M]").astype("int64") % 12 + 1,
+        "day": (times.astype("datetime64[D]") - times.astype("datetime64[M]")).astype("int64") + 1,
+        "hour": offsets % 24,
+        "PM2.5": pm25,
+        "PM10": pm25 * 1.3 * noise(0.2),
+        "SO2": pm25 * 0.15 * noise(0.5),
+        "NO2": pm25 * 0.6 * noise(0.3),
+        "CO": pm25 * 14 * noise(0.3),
+        "O3": (120 / seasonal) * noise(0.5),
+        "TEMP": (12 - 14 * np.cos(2 * np.pi * day_of_year / 365) + rng.normal(0, 3, n_rows)).astype("float32"),
+        "PRES": rng.normal(1012, 8, n_rows).astype("float32"),
+        "station": pd.Categorical.from_codes(station, [f"S{i:03d}" for i in range(n_stations)]),
+    })
+    for col in ("PM2.5", "PM10", "SO2", "NO2", "CO", "O3"):
+        frame.loc[rng.random(n_rows) < 0.03, col] = np.nan
+    return frame
+
+
+def write_csv(frame, path):
+    """Write a frame as CSV with pyarrow (much faster than ``to_csv`` at tens of millions of rows)."""
+    pacsv.write_csv(pa.Table.from_pandas(frame, preserve_index=False), path)
+    return path
+
+
+def _rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    if isinstance(value, tuple) and value and hasattr(value[0], "__len__"):
+        return len(value[0])
+    return None
+
+
+class Recorder:
+    """Runs stages in profiler spans (with memory tracing) and keeps their measurements."""
+
+    def __init__(self):
+        self.profiler = Profiler(memory=True)
+        self.stages = {}
+
+    def run(self, name, fn, rows_in=None):
+        gc.collect()
+        with self.profiler.span(name, rows_in) as span:
+            result = fn()
+            self.profiler.note(rows_out=_rows(result))
+        self.stages[name] = {"seconds": round(span.seconds, 4), "peak_bytes": int(span.peak_bytes),
+                             "rows_in": rows_in, "rows_out": span.rows_out}
+        return result
+
+
+def run_pipeline(csv_path, tz="Asia/Shanghai", standard="us", ingest=True):
+    """Measure every stage for one CSV file; returns ``{stage: measurements}``."""
+    rec = Recorder()
+    with tempfile.TemporaryDirectory() as cache:
+        if ingest:
+            rec.run("ingest_cold", lambda: load_csv_file(csv_path, cache_dir=cache))
+        else:
+            load_csv_file(csv_path, cache_dir=cache)
+        raw = rec.run("ingest_warm", lambda: load_csv_file(csv_path, cache_dir=cache))
+    n = len(raw)
+    store = rec.run("merge", lambda: merge_sources([raw], "City"), n)
+    raw = None
+    df = rec.run("station_view", lambda: station_frame(store, CITY_WIDE), len(store))
+    dataset = rec.run("aqi", lambda: Dataset.prepare(df, standard), len(df))
+    df = rec.run("timezone", lambda: dataset.view(tz), len(df))
+    # A timezone seen before only re-attaches cached calendar fields
+    df = rec.run("timezone_warm", lambda: dataset.view(tz), len(df))
+    wall = dataset.calendar.wall(tz)
+    rollups = rec.run("rollups", lambda: RollupStore.from_frame(df, NUMERIC_COLUMNS, wall), len(df))
+    correlations = rec.run("correlations", lambda: CorrelationStore.from_frame(df, NUMERIC_COLUMNS, wall), len(df))
+    rec.run("regularize", lambda: HourlyGrid.from_frame(df, NUMERIC_COLUMNS, method="linear", limit=24), len(df))
+    queries = RollupQueries(rollups, df)
+    columns = [c for c in NUMERIC_COLUMNS if c in df.columns]
+
+    # The middle half of the span, as a user narrowing the date filter would
+    first, last = df["datetime"].iloc[0], df["datetime"].iloc[-1]
+    lo = (first + (last - first) / 4).tz_localize(None).normalize()
+    hi = (last - (last - first) / 4).tz_localize(None).normalize()
+    part = rec.run("filter", lambda: date_slice(df, lo.date(), hi.date()), len(df))
+    start, end = lo, hi + pd.Timedelta(days=1)
+    m = len(part)
+
+    rec.run("chart1_timeline", lambda: downsample(part["datetime"], part["pm2.5"], DEFAULT_POINTS), m)
+    rec.run("chart1_episodes", lambda: detect(df, columns, "cn")[0], len(df))
+    y2 = "pm10" if "pm10" in part.columns else "pm2.5"
+    rec.run("chart2_comparison", lambda: downsample(part["datetime"], part[y2], DEFAULT_POINTS, method="lttb"), m)
+    rec.run("chart3_aqi", lambda: part["aqi_category"].value_counts(), m)
+    rec.run("chart4_monthly", lambda: queries.grouped_means("pm2.5", ["month"], start, end), m)
+    rec.run("chart5_heatmap", lambda: queries.grouped_means("pm2.5", ["weekday", "hour"], start, end), m)
+    rec.run("chart6_correlation", lambda: correlations.pearson(start, end), m)
+    rec.run("chart7_scatter", lambda: (correlations.linregress("pm2.5", y2, start, end) if y2 != "pm2.5" else None,
+                                       binned_density(part["pm2.5"], part[y2])), m)
+    rec.run("chart8_year_over_year", lambda: (queries.grouped_means("pm2.5", ["year", "month"], start, end),
+                                              queries.grouped_means("pm2.5", ["year"], start, end)), m)
+    periods, means = rollup_means(rollups, columns)
+    rec.run("chart8_trend", lambda: series_trends(means, periods), len(df))
+    rec.run("chart9_events", lambda: event_table(rollups, DEFAULT_EVENTS), len(df))
+    rec.run("chart9_impact", lambda: event_impact(rollups, DEFAULT_EVENTS, columns), len(df))
+    rec.run("summary", lambda: queries.describe(columns, start, end), m)
+    with tempfile.TemporaryFile() as fh:
+        rec.run("export_csv_gz", lambda: write_export(df, "csv.gz", fh, start=start, end=end), m)
+    model = rec.run("forecast_train", lambda: ForecastModel.fit(df), len(df))
+    rec.run("forecast_predict", lambda: model.predict(df)[0], len(df))
+    return {"rows": n, "stages": rec.stages}
+
+
+def _best_of(path, tz, ingest, repeat):
+    """Run the pipeline ``repeat`` times; keep each stage's fastest time and largest peak."""
+    best = run_pipeline(path, tz, ingest=ingest)
+    for _ in range(repeat - 1):
+        for stage, m in run_pipeline(path, tz, ingest=ingest)["stages"].items():
+            kept = best["stages"][stage]
+            kept["seconds"] = min(kept["seconds"], m["seconds"])
+            kept["peak_bytes"] = max(kept["peak_bytes"], m["peak_bytes"])
+    return best
+
+
+def run(sizes, data_dir="data", seed=0, ingest=True, tz="Asia/Shanghai", repeat=1):
+    """Run every requested case; ``sizes`` holds "bundled" and/or keys of ``SIZES``."""
+    tracemalloc.start()
+    cases = {}
+    try:
+        for size in sizes:
+            if size == "bundled":
+                for path in sorted(glob.glob(os.path.join(data_dir, "*.csv"))):
+                    cases[f"bundled:{os.path.basename(path)}"] = _best_of(path, tz, ingest, repeat)
+                continue
+            with tempfile.TemporaryDirectory() as tmp:
+                path = write_csv(synthetic_frame(SIZES[size], seed), os.path.join(tmp, f"synthetic_{size}.csv"))
+                cases[f"synthetic:{size}"] = _best_of(path, tz, ingest, repeat)
+    finally:
+        tracemalloc.stop()
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "repeat": repeat,
+        },
+        "cases": cases,
+    }
+
+
+def compare(current, baseline, threshold=0.2, min_seconds=MIN_SECONDS):
+    """Stages slower than ``baseline`` by more than ``threshold`` (a fraction): list of dicts."""
+    regressions = []
+    for case, result in current["cases"].items():
+        before = baseline.get("cases", {}).get(case, {}).get("stages", {})
+        for stage, now in result["stages"].items():
+            old = before.get(stage)
+            if not old or max(now["seconds"], old["seconds"]) < min_seconds:
+                continue
+            change = now["seconds"] / max(old["seconds"], 1e-9) - 1
+            if change > threshold:
+                regressions.append({"case": case, "stage": stage, "before": old["seconds"],
+                                    "after": now["seconds"], "change": round(change, 3)})
+    return regressions
+
+
+def format_results(results):
+    lines = []
+    for case, result in results["cases"].items():
+        lines.append(f"{case} ({result['rows']:,} rows)")
+        for stage, m in result["stages"].items():
+            lines.append(f"  {stage:<22} {m['seconds']:>9.3f}s  {m['peak_bytes'] / 2**20:>9.1f} MiB peak")
+    return "\n".join(lines)
@@ -0,0 +1,256 @@
+"""Command-line report generation and benchmarks.
+
+    python -m airquality report data/*.csv --out reports --by-station --jobs 4
+    python -m airquality bench --sizes bundled,1m --save bench.json
+    python -m airquality export data/beijing.csv --format parquet --start 2015-01-01
+    python -m airquality trends data/*.csv --freq month --jobs 4 --out trends.csv
+    python -m airquality train data/beijing_historical.csv --backtest
+
+Each input file is one city dataset. With ``--by-station`` every station in
+it is reported separately next to the city-wide mean; a single-station file
+is reported once, under its station's name. Jobs run in a process
+pool; each worker reloads its file from the columnar cache (memory-mapped,
+so cheap) and writes its artifacts as CSV under
+``OUT/<file>/<station>/``. ``export`` streams one station view to a single
+file in chunks (see ``export.py``); ``trends`` tests every station of every
+file for a long-term trend (see ``trends.py``); ``train`` fits and saves
+the PM2.5 forecast model the dashboard serves (see ``forecast.py``);
+``bench`` is described in ``bench.py``.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from . import bench
+from .bench import SIZES
+from .core import NUMERIC_COLUMNS, Analysis, Dataset, load_csv_file, merge_sources, report, station_frame
+from .events import DEFAULT_EVENTS, read_events
+from .export import FORMATS, export_columns, file_name, write_export
+from .forecast import ALPHA, HORIZON, MODEL_PATH, ForecastModel, backtest
+from .stations import CITY_WIDE
+from .timeindex import time_slice
+from .trends import PERIODS, trend_table
+
+
+def _slug(text):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", text).strip("_") or "data"
+
+
+def _bounds(args):
+    start = pd.Timestamp(args.start) if args.start else None
+    end = pd.Timestamp(args.end) + pd.Timedelta(days=1) if args.end else None
+    return start, end
+
+
+def run_job(path, station, args):
+    """Build one station view of one file and write its report; returns (label, files, seconds)."""
+    started = time.perf_counter()
+    store = merge_sources([load_csv_file(path)], args.city)
+    analysis = Analysis.build(station_frame(store, station), args.tz, args.standard)
+    events = None if args.no_events else _load_events(args.events)
+    artifacts = report(analysis, *_bounds(args), events=events)
+
+    dest = os.path.join(args.out, _slug(os.path.splitext(os.path.basename(path))[0]), _slug(station))
+    os.makedirs(dest, exist_ok=True)
+    written = []
+    for name, table in artifacts.items():
+        target = os.path.join(dest, f"{name}.csv")
+        table.to_csv(target, index=name in ("summary", "monthly", "correlation"))
+        written.append(target)
+    return f"{os.path.basename(path)} / {station}", written, time.perf_counter() - started
+
+
+def _load_events(path):
+    if not path:
+        return DEFAULT_EVENTS
+    with open(path, "r", encoding="utf-8") as fh:
+        return read_events(fh, path)
+
+
+def _jobs(args):
+    jobs = []
+    for path in args.files:
+        # Loading here also converts the file into the cache before workers read it
+        store = merge_sources([load_csv_file(path)], args.city)
+        views = list(store.views()) if args.by_station else [store.default_view]
+        jobs.extend((path, station) for station in views)
+    return jobs
+
+
+def cmd_report(args):
+    jobs = _jobs(args)
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {pool.submit(run_job, path, station, args): (path, station) for path, station in jobs}
+        for future in as_completed(futures):
+            try:
+                label, written, seconds = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"FAILED {futures[future][0]} / {futures[future][1]}: {e}", file=sys.stderr)
+                continue
+            print(f"{label}: {len(written)} artifacts in {seconds:.2f}s")
+    return 1 if failures else 0
+
+
+def cmd_export(args):
+    store = merge_sources([load_csv_file(args.file)], args.city)
+    df = Dataset.prepare(station_frame(store, args.station), args.standard).view(args.tz)
+    columns = [c.strip() for c in args.columns.split(",") if c.strip()] if args.columns else None
+    unknown = [c for c in columns or [] if c not in df.columns]
+    if unknown:
+        print(f"Unknown columns: {', '.join(unknown)} (available: {', '.join(export_columns(df))})", file=sys.stderr)
+        return 2
+    out = args.out or file_name(_slug(os.path.splitext(os.path.basename(args.file))[0]), args.format)
+    started = time.perf_counter()
+    rows = write_export(df, args.format, out, columns, *_bounds(args))
+    print(f"{out}: {rows:,} rows in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+def cmd_trends(args):
+    tables = []
+    for path in args.files:
+        store = merge_sources([load_csv_file(path)], args.city)
+        frames = store.views()
+        columns = [c for c in NUMERIC_COLUMNS if c != "aqi"]
+        started = time.perf_counter()
+        table = trend_table(frames, columns, args.freq, args.tz, jobs=args.jobs)
+        print(f"{os.path.basename(path)}: {len(frames)} series sets in {time.perf_counter() - started:.2f}s",
+              file=sys.stderr)
+        table.insert(0, "File", os.path.basename(path))
+        tables.append(table)
+    result = pd.concat(tables, ignore_index=True)
+    if args.out:
+        result.to_csv(args.out, index=False)
+    else:
+        print(result.to_string(index=False))
+    return 0
+
+
+def cmd_train(args):
+    store = merge_sources([load_csv_file(args.file)], args.city)
+    df = time_slice(Dataset.prepare(station_frame(store, args.station), args.standard).view(args.tz), *_bounds(args))
+    if "pm2.5" not in df.columns or df["pm2.5"].isna().all():
+        print(f"{args.file}: no PM2.5 readings to train on", file=sys.stderr)
+        return 2
+    if args.backtest:
+        started = time.perf_counter()
+        table, timings = backtest(df, args.horizon, args.alpha, args.folds, args.test_days)
+        if table.empty:
+            print("Not enough history for a backtest (a year before the first fold is needed)", file=sys.stderr)
+        else:
+            print(table.round(3).to_string(index=False))
+            print(timings.to_string(index=False))
+            print(f"backtest: {len(timings)} folds in {time.perf_counter() - started:.2f}s")
+    model = ForecastModel.fit(df, args.horizon, args.alpha)
+    path = model.save(args.out)
+    print(f"{path}: {len(model.names)} features, {model.meta['rows']:,} hours, trained in {model.meta['seconds']:.2f}s")
+    return 0
+
+
+def cmd_bench(args):
+    sizes = [s.strip().lower() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s != "bundled" and s not in SIZES]
+    if unknown:
+        print(f"Unknown sizes: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    results = bench.run(sizes, args.data_dir, args.seed, ingest=not args.skip_ingest, tz=args.tz,
+                        repeat=max(args.repeat, 1))
+    print(bench.format_results(results))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as fh:
+            regressions = bench.compare(results, json.load(fh), args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['case']} / {r['stage']}: {r['before']:.3f}s -> {r['after']:.3f}s "
+                  f"(+{r['change']:.0%})", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m airquality", description="Beijing air quality analytics")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rep = sub.add_parser("report",
+                         help="write summary, quality, monthly, correlation, gap, trend, episode and event tables")
+    rep.add_argument("files", nargs="+", help="CSV files, one dataset each")
+    rep.add_argument("--out", default="reports", help="output directory (default: reports)")
+    rep.add_argument("--tz", default="Asia/Shanghai", help="display timezone (default: Asia/Shanghai)")
+    rep.add_argument("--standard", choices=["us", "cn"], default="us", help="AQI standard (default: us)")
+    rep.add_argument("--city", default="Beijing", help="station name for rows without one")
+    rep.add_argument("--by-station", action="store_true", help="also report every station separately")
+    rep.add_argument("--start", help="first local date to include (YYYY-MM-DD)")
+    rep.add_argument("--end", help="last local date to include (YYYY-MM-DD)")
+    rep.add_argument("--events", help="JSON or CSV file of events (default: the dashboard's built-in list)")
+    rep.add_argument("--no-events", action="store_true", help="skip the event table")
+    rep.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    rep.set_defaults(func=cmd_report)
+
+    exp = sub.add_parser("export", help="write one station view as CSV, gzip CSV, Parquet or Arrow IPC")
+    exp.add_argument("file", help="CSV file to export")
+    exp.add_argument("--format", choices=list(FORMATS), default="csv.gz", help="output format (default: csv.gz)")
+    exp.add_argument("--out", help="output file (default: named after the input, in the current directory)")
+    exp.add_argument("--columns", help="comma-separated columns to keep (default: all but local_* fields)")
+    exp.add_argument("--station", default=CITY_WIDE, help="station to export (default: the city-wide mean)")
+    exp.add_argument("--tz", default="Asia/Shanghai", help="timezone of the timestamps (default: Asia/Shanghai)")
+    exp.add_argument("--standard", choices=["us", "cn"], default="us", help="AQI standard (default: us)")
+    exp.add_argument("--city", default="Beijing", help="station name for rows without one")
+    exp.add_argument("--start", help="first local date to include (YYYY-MM-DD)")
+    exp.add_argument("--end", help="last local date to include (YYYY-MM-DD)")
+    exp.set_defaults(func=cmd_export)
+
+    trd = sub.add_parser("trends", help="Theil-Sen slopes and Mann-Kendall tests per station and pollutant")
+    trd.add_argument("files", nargs="+", help="CSV files, one dataset each")
+    trd.add_argument("--freq", choices=list(PERIODS), default="month", help="aggregate to test (default: month)")
+    trd.add_argument("--tz", default="Asia/Shanghai", help="timezone of the calendar periods (default: Asia/Shanghai)")
+    trd.add_argument("--city", default="Beijing", help="station name for rows without one")
+    trd.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes across stations")
+    trd.add_argument("--out", help="write the table to this CSV file instead of printing it")
+    trd.set_defaults(func=cmd_trends)
+
+    trn = sub.add_parser("train", help="fit and save the PM2.5 forecast model, optionally backtesting it first")
+    trn.add_argument("file", help="CSV file to train on")
+    trn.add_argument("--out", default=MODEL_PATH, help=f"model file (default: {MODEL_PATH})")
+    trn.add_argument("--station", default=CITY_WIDE, help="station to train on (default: the city-wide mean)")
+    trn.add_argument("--tz", default="Asia/Shanghai", help="timezone of the calendar features (default: Asia/Shanghai)")
+    trn.add_argument("--standard", choices=["us", "cn"], default="us", help="AQI standard (default: us)")
+    trn.add_argument("--city", default="Beijing", help="station name for rows without one")
+    trn.add_argument("--start", help="first local date to train on (YYYY-MM-DD)")
+    trn.add_argument("--end", help="last local date to train on (YYYY-MM-DD)")
+    trn.add_argument("--horizon", type=int, default=HORIZON, help=f"hours ahead to forecast (default: {HORIZON})")
+    trn.add_argument("--alpha", type=float, default=ALPHA, help=f"ridge penalty (default: {ALPHA})")
+    trn.add_argument("--backtest", action="store_true", help="report rolling-origin accuracy and training time")
+    trn.add_argument("--folds", type=int, default=4, help="backtest folds (default: 4)")
+    trn.add_argument("--test-days", type=int, default=60, help="days forecast per backtest fold (default: 60)")
+    trn.set_defaults(func=cmd_train)
+
+    bench = sub.add_parser("bench", help="time and memory-profile every pipeline stage")
+    bench.add_argument("--sizes", default="bundled,10k,1m",
+                       help=f"comma-separated cases: bundled and/or {', '.join(SIZES)} (default: bundled,10k,1m)")
+    bench.add_argument("--data-dir", default="data", help="directory of bundled CSVs (default: data)")
+    bench.add_argument("--tz", default="Asia/Shanghai", help="display timezone (default: Asia/Shanghai)")
+    bench.add_argument("--seed", type=int, default=0, help="seed for synthetic data")
+    bench.add_argument("--repeat", type=int, default=3, help="runs per case; the fastest time counts (default: 3)")
+    bench.add_argument("--skip-ingest", action="store_true", help="skip the cold CSV conversion stage")
+    bench.add_argument("--save", help="write results to this JSON file")
+    bench.add_argument("--compare", help="earlier results JSON to check for regressions")
+    bench.add_argument("--threshold", type=float, default=0.2,
+                       help="slowdown fraction that counts as a regression (default: 0.2)")
+    bench.set_defaults(func=cmd_bench)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,190 @@
+"""Headless analysis pipeline: what the dashboard computes, without Streamlit.
+
+``load_csv_file`` and ``merge_sources`` produce a station store. From that
+store, ``Analysis.build`` runs the same steps the app runs for one station
+view, timezone and AQI standard: compact, convert, AQI, calendar, rollups,
+correlations. ``report`` turns an analysis into the tables the dashboard
+shows, plus the before/after impact of each event, the missing hours of
+every pollutant, its long-term trend and its episodes above the WHO and
+Chinese limits.
+
+The steps split at the timezone. ``Dataset.prepare`` does the
+timezone-independent work once (UTC timestamps, AQI) and keeps a
+``LocalCalendar``; ``Dataset.analysis`` builds one timezone's view from it,
+so switching timezones never repeats the AQI or a full conversion.
+
+Nothing here imports Streamlit. Worker processes (see ``cli.py``) and the app
+share this code, and the app only adds caching and widgets on top.
+"""
+
+import os
+
+import pandas as pd
+
+from .aqi import fill_aqi
+from .correlation import CorrelationStore
+from .episodes import THRESHOLDS, episode_tables
+from .events import event_impact, event_table
+from .features import LocalCalendar, add_calendar
+from .gaps import HourlyGrid
+from .profiler import Profiler
+from .ingest import load_cached_csv
+from .query import ParquetQueries, RollupQueries, parquet_path, write_parquet
+from .rollups import RollupStore, mean as rollup_mean, merge_stats
+from .schema import compact
+from .stations import CITY_WIDE, StationStore
+from .timeindex import time_slice
+from .trends import trend_table
+
+NUMERIC_COLUMNS = ["pm2.5", "pm10", "no2", "so2", "o3", "co", "aqi"]
+
+
+def load_csv_file(path, cache_dir=None):
+    """Load a CSV through the columnar cache, tagged with its source name."""
+    with open(path, "rb") as fh:
+        df = load_cached_csv(fh, cache_dir)
+    df["source"] = f"CSV: {os.path.basename(path)}"
+    return df
+
+
+def merge_sources(frames, default_station):
+    """Merge source frames into per-station partitions; later frames win on duplicate hours."""
+    return StationStore.from_frames([f for f in frames if f is not None and not f.empty], default_station)
+
+
+def station_frame(store, station=CITY_WIDE):
+    """Compact frame for one station, or the city-wide mean."""
+    return compact(store.city_frame() if station == CITY_WIDE else store.frame(station))
+
+
+class Dataset:
+    """A station view in UTC with its AQI, from which per-timezone analyses are built."""
+
+    def __init__(self, df, calendar, source_tz=None):
+        self.df = df
+        self.calendar = calendar
+        self.source_tz = source_tz
+
+    @classmethod
+    def prepare(cls, df, standard="us", profiler=None):
+        """Normalize a time-sorted frame to UTC (naive values are UTC) and derive its AQI."""
+        profiler = profiler or Profiler(enabled=False)
+        times = df["datetime"]
+        source_tz = times.dt.tz
+        with profiler.span("utc", len(df)):
+            df = df.copy(deep=False)
+            df["datetime"] = times.dt.tz_convert("UTC") if source_tz is not None else times.dt.tz_localize("UTC")
+            calendar = LocalCalendar.from_times(df["datetime"])
+        with profiler.span("aqi", len(df)):
+            # Only the WAQI and AirVisual readings are reported on the US EPA scale
+            df = fill_aqi(df, standard, keep_reported=standard == "us")
+        return cls(df, calendar, source_tz)
+
+    def view(self, tz=None):
+        """The frame in ``tz`` (default: the source's timezone, else UTC) with ``local_*`` columns.
+
+        Only the timestamps' timezone changes; calendar fields come from the
+        shared ``LocalCalendar``.
+        """
+        tz = tz or self.source_tz or "UTC"
+        out = self.df.copy(deep=False)
+        out["datetime"] = self.df["datetime"].dt.tz_convert(tz)
+        return add_calendar(out, self.calendar)
+
+    def analysis(self, tz=None, profiler=None):
+        """Build the view and aggregate stores for ``tz``."""
+        profiler = profiler or Profiler(enabled=False)
+        with profiler.span("timezone", len(self.df)):
+            df = self.view(tz)
+        wall = self.calendar.wall(df["datetime"].dt.tz)
+        with profiler.span("rollups", len(df)):
+            rollups = RollupStore.from_frame(df, NUMERIC_COLUMNS, wall)
+            profiler.note(rows_out=len(rollups.levels["hour"]))
+        with profiler.span("correlations", len(df)):
+            correlations = CorrelationStore.from_frame(df, NUMERIC_COLUMNS, wall)
+            profiler.note(rows_out=len(correlations.periods))
+        return Analysis(df, rollups, correlations, tz=df["datetime"].dt.tz)
+
+
+class Analysis:
+    """A station view in the display timezone with its derived columns and aggregate stores."""
+
+    def __init__(self, df, rollups, correlations, tz=None):
+        self.df = df
+        self.rollups = rollups
+        self.correlations = correlations
+        self.tz = tz
+        self.queries = RollupQueries(rollups, df)
+
+    @classmethod
+    def build(cls, df, tz=None, standard="us", profiler=None):
+        """Run the pipeline on a time-sorted frame; ``tz=None`` keeps the frame's timezone.
+
+        Each step is timed as a span of ``profiler`` when one is given.
+        """
+        return Dataset.prepare(df, standard, profiler).analysis(tz, profiler)
+
+    @property
+    def columns(self):
+        return [c for c in NUMERIC_COLUMNS if c in self.df.columns]
+
+    def open_queries(self, engine="pandas", key=None):
+        """Aggregation backend: the in-memory rollups, or DuckDB/Polars over a Parquet copy."""
+        if engine == "pandas":
+            return self.queries
+        return ParquetQueries(write_parquet(self.df, parquet_path(key)), self.tz, engine)
+
+
+def summary_table(range_stats):
+    """The dashboard's "Overall Statistics" table from ``describe`` output."""
+    summary = range_stats[["mean", "std", "min", "25%", "50%", "75%", "max"]]
+    summary.columns = ["Mean", "Std Dev", "Min", "25th %ile", "Median", "75th %ile", "Max"]
+    return summary.round(2)
+
+
+def quality_table(range_stats):
+    """The dashboard's "Data Quality Report" table from ``describe`` output."""
+    rows = []
+    for col in range_stats.index:
+        total = int(range_stats.loc[col, "rows"])
+        present = int(range_stats.loc[col, "count"])
+        rows.append({
+            "Pollutant": col.upper(),
+            "Records": present,
+            "Missing": total - present,
+            "Completeness": f"{present / total * 100:.1f}%",
+        })
+    return pd.DataFrame(rows)
+
+
+def monthly_table(analysis, start=None, end=None):
+    """Mean of every pollutant per local (year, month) over ``[start, end)``."""
+    rows = analysis.rollups.select(start, end, coarsest="month")
+    rows = rows[rows["rows"]["all"] > 0]
+    keys = [rows.index.year.rename("year"), rows.index.month.rename("month")]
+    return rollup_mean(merge_stats(rows, keys))
+
+
+def report(analysis, start=None, end=None, events=None, queries=None):
+    """Report artifacts for ``[start, end)`` as ``{name: DataFrame}``."""
+    queries = queries or analysis.queries
+    range_stats = queries.describe(analysis.columns, start, end)
+    artifacts = {
+        "summary": summary_table(range_stats),
+        "quality": quality_table(range_stats),
+        "monthly": monthly_table(analysis, start, end),
+        "correlation": analysis.correlations.pearson(start, end).loc[analysis.columns, analysis.columns],
+        "gaps": HourlyGrid.from_frame(time_slice(analysis.df, start, end), analysis.columns).summary(),
+        "trends": trend_table({CITY_WIDE: time_slice(analysis.df, start, end)},
+                              [c for c in analysis.columns if c != "aqi"], "month", analysis.tz, cache_dir=False),
+    }
+    found = [episode_tables({CITY_WIDE: time_slice(analysis.df, start, end)}, analysis.columns, standard)
+             for standard in THRESHOLDS]
+    # The report is for one view already, so its tables need no station column
+    artifacts["trends"] = artifacts["trends"].drop(columns="Station")
+    artifacts["episodes"] = pd.concat([episodes for episodes, _ in found], ignore_index=True).drop(columns="Station")
+    artifacts["exceedance_hours"] = pd.concat([years for _, years in found], ignore_index=True).drop(columns="Station")
+    if events:
+        artifacts["events"] = event_table(analysis.rollups, events, start=start, end=end)
+        artifacts["event_impact"] = event_impact(analysis.rollups, events, analysis.columns, start=start, end=end)
+    return artifacts
@@ -0,0 +1,113 @@
+"""Mergeable correlation and regression statistics.
+
+For every local calendar day and every pollutant pair the store keeps the
+pairwise-complete sufficient statistics n, Σx, Σx², Σxy (Σy and Σy² are the
+transposes). Summing days gives the statistics of any date range, so the
+Pearson matrix and OLS trendline for a filter come from a few thousand small
+additions instead of a pass over the rows, and new data is folded in with
+``update`` without touching history.
+
+Pairwise deletion matches ``DataFrame.corr()``: a row counts towards a pair
+when both of its values are present.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+DAY_NS = 86_400_000_000_000
+
+
+def _day_stats(df, columns, wall=None):
+    """Per-day (n, Σx, Σx², Σxy) arrays of shape (days, k, k) for a time-sorted frame."""
+    if wall is None:
+        times = df["datetime"]
+        if times.dt.tz is not None:
+            times = times.dt.tz_localize(None)
+        days = times.dt.floor("D").to_numpy()
+    else:
+        days = (wall // DAY_NS * DAY_NS).view("datetime64[ns]")
+    values = df[columns].apply(pd.to_numeric, errors="coerce").to_numpy(dtype="float64")
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    weight = present.astype("float64")
+
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]) if len(days) else np.array([], dtype="int64")
+    k = len(columns)
+    shape = (len(starts), k, k)
+    n, sx, sxx, sxy = (np.zeros(shape) for _ in range(4))
+    if len(starts):
+        for i in range(k):
+            n[:, i, :] = np.add.reduceat(weight[:, i:i + 1] * weight, starts, axis=0)
+            sx[:, i, :] = np.add.reduceat(filled[:, i:i + 1] * weight, starts, axis=0)
+            sxx[:, i, :] = np.add.reduceat(filled[:, i:i + 1] ** 2 * weight, starts, axis=0)
+            sxy[:, i, :] = np.add.reduceat(filled[:, i:i + 1] * filled, starts, axis=0)
+    return pd.DatetimeIndex(days[starts]), n, sx, sxx, sxy
+
+
+class CorrelationStore:
+    """Per-day pairwise sufficient statistics for a fixed set of columns."""
+
+    def __init__(self, columns, periods, n, sx, sxx, sxy):
+        self.columns = list(columns)
+        self.periods = periods
+        self.n, self.sx, self.sxx, self.sxy = n, sx, sxx, sxy
+
+    @classmethod
+    def from_frame(cls, df, columns, wall=None):
+        """Build from a time-sorted frame; days follow the frame's (local) wall clock.
+
+        ``wall`` optionally gives that wall clock as int64 nanoseconds.
+        """
+        columns = [c for c in columns if c in df.columns]
+        return cls(columns, *_day_stats(df, columns, wall))
+
+    def update(self, df):
+        """Fold new time-sorted rows in; days already present are added to, not recomputed."""
+        periods, *stats = _day_stats(df, self.columns)
+        merged = self.periods.union(periods)
+        old_pos = merged.get_indexer(self.periods)
+        new_pos = merged.get_indexer(periods)
+        combined = []
+        for old, new in zip((self.n, self.sx, self.sxx, self.sxy), stats):
+            out = np.zeros((len(merged),) + old.shape[1:])
+            out[old_pos] += old
+            np.add.at(out, new_pos, new)
+            combined.append(out)
+        self.periods = merged
+        self.n, self.sx, self.sxx, self.sxy = combined
+        return self
+
+    def totals(self, start=None, end=None):
+        """Summed (n, Σx, Σx², Σxy) over days in ``[start, end)`` (naive local bounds)."""
+        lo = 0 if start is None else self.periods.searchsorted(pd.Timestamp(start))
+        hi = len(self.periods) if end is None else self.periods.searchsorted(pd.Timestamp(end))
+        return tuple(a[lo:hi].sum(axis=0) for a in (self.n, self.sx, self.sxx, self.sxy))
+
+    def pearson(self, start=None, end=None, min_periods=2):
+        """Pairwise Pearson correlation matrix over ``[start, end)``."""
+        n, sx, sxx, sxy = self.totals(start, end)
+        sy, syy = sx.T, sxx.T
+        cov = n * sxy - sx * sy
+        var_x = n * sxx - sx ** 2
+        var_y = n * syy - sy ** 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = cov / np.sqrt(var_x * var_y)
+        r[(n < min_periods) | (var_x <= 0) | (var_y <= 0)] = np.nan
+        r = np.clip(r, -1.0, 1.0)
+        return pd.DataFrame(r, index=self.columns, columns=self.columns)
+
+    def linregress(self, x, y, start=None, end=None):
+        """OLS fit of ``y`` on ``x`` over ``[start, end)``: (slope, intercept, r, n)."""
+        i, j = self.columns.index(x), self.columns.index(y)
+        n, sx, sxx, sxy = self.totals(start, end)
+        n, sy, syy = n[i, j], sx[j, i], sxx[j, i]
+        sx, sxx, sxy = sx[i, j], sxx[i, j], sxy[i, j]
+        denom = n * sxx - sx ** 2
+        if n < 2 or denom <= 0:
+            return np.nan, np.nan, np.nan, int(n)
+        slope = (n * sxy - sx * sy) / denom
+        intercept = (sy - slope * sx) / n
+        var_y = n * syy - sy ** 2
+        r = (n * sxy - sx * sy) / np.sqrt(denom * var_y) if var_y > 0 else np.nan
+        return slope, intercept, r, int(n)
@@ -0,0 +1,73 @@
+"""Batch decoding of API payloads into one normalized frame layout.
+
+Every API source produces the same columns: naive-UTC ``datetime``,
+float32 ``aqi`` and pollutant concentrations, and a categorical ``source``.
+Each column is pulled out of the response in a single typed pass instead of
+building one Python dict per hourly entry.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .schema import POLLUTANTS
+
+API_COLUMNS = ("datetime", "aqi") + POLLUTANTS + ("source",)
+
+# OpenWeather ``components`` keys for each canonical pollutant column
+OPENWEATHER_COMPONENTS = {
+    "pm2.5": "pm2_5", "pm10": "pm10", "no2": "no2", "so2": "so2", "co": "co", "o3": "o3",
+}
+
+
+def _number(value):
+    return np.nan if value is None else value
+
+
+def api_frame(epoch_seconds, values, source):
+    """Build a normalized frame from epoch seconds and per-column value sequences.
+
+    Columns missing from ``values`` are filled with NaN so every source lines
+    up when concatenated.
+    """
+    n = len(epoch_seconds)
+    seconds = np.asarray(epoch_seconds, dtype="int64")
+    frame = {"datetime": seconds.astype("datetime64[s]").astype("datetime64[ns]")}
+    for col in ("aqi",) + POLLUTANTS:
+        if col in values:
+            frame[col] = np.asarray(values[col], dtype="float32")
+        else:
+            frame[col] = np.full(n, np.nan, dtype="float32")
+    frame["source"] = pd.Categorical.from_codes(np.zeros(n, dtype="int8"), categories=[source])
+    return pd.DataFrame(frame, columns=list(API_COLUMNS))
+
+
+def decode_openweather(entries, source="OpenWeather API"):
+    """Decode an OpenWeather history ``list`` into a normalized frame."""
+    n = len(entries)
+    epochs = np.fromiter((e["dt"] for e in entries), dtype="int64", count=n)
+    values = {"aqi": np.fromiter((_number(e["main"].get("aqi")) for e in entries), dtype="float32", count=n)}
+    for col, key in OPENWEATHER_COMPONENTS.items():
+        values[col] = np.fromiter(
+            (_number(e["components"].get(key)) for e in entries), dtype="float32", count=n
+        )
+    return api_frame(epochs, values, source)
+
+
+def decode_waqi(data, epoch, source="WAQI API"):
+    """Decode a WAQI ``feed`` response's ``data`` object (current reading only)."""
+    iaqi = data.get("iaqi", {})
+    aqi = data.get("aqi")
+    values = {"aqi": [_number(aqi if isinstance(aqi, (int, float)) else None)]}
+    for col in POLLUTANTS:
+        values[col] = [_number(iaqi.get(col.replace(".", ""), {}).get("v"))]
+    return api_frame([epoch], values, source)
+
+
+def decode_airvisual(pollution, epoch, source="AirVisual API"):
+    """Decode an AirVisual ``current.pollution`` object (US AQI, PM only)."""
+    values = {
+        "aqi": [_number(pollution.get("aqius"))],
+        "pm2.5": [_number(pollution.get("p2", {}).get("conc"))],
+        "pm10": [_number(pollution.get("p1", {}).get("conc"))],
+    }
+    return api_frame([epoch], values, source)
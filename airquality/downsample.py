@@ -0,0 +1,88 @@
+"""Server-side downsampling for long time-series traces.
+
+Two reducers, both returning positions into the original arrays so callers
+can pick matching timestamps, labels or hover data:
+
+* ``minmax_indices`` keeps the lowest and highest point of every bucket, so
+  peaks and troughs (e.g. the January 2013 "Airpocalypse") always survive.
+* ``lttb_indices`` is Largest-Triangle-Three-Buckets, which keeps the visual
+  shape of a line with one point per bucket.
+"""
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_POINTS = 4000
+
+
+def points_for_width(width_px, per_px=2, floor=1000, cap=10000):
+    """Point budget for a trace drawn ``width_px`` pixels wide."""
+    return int(min(max(width_px * per_px, floor), cap))
+
+
+def minmax_indices(y, n_out):
+    """Positions of each bucket's min and max (plus both endpoints), sorted."""
+    y = np.asarray(y, dtype="float64")
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    size = -(-n // max(n_out // 2, 1))
+    n_buckets = -(-n // size)
+    padded = np.full(n_buckets * size, -np.inf)
+    padded[:n] = y
+    grid = padded.reshape(n_buckets, size)
+    offsets = np.arange(n_buckets) * size
+    highs = offsets + grid.argmax(axis=1)
+    padded[n:] = np.inf
+    lows = offsets + grid.argmin(axis=1)
+    return np.unique(np.concatenate([highs, lows, [0, n - 1]]))
+
+
+def lttb_indices(x, y, n_out):
+    """Positions chosen by Largest-Triangle-Three-Buckets, sorted."""
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    # n_out - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, n_out - 1).astype("int64")
+    edges[-1] = n - 1
+    starts, stops = edges[:-1], edges[1:]
+    # Average of the following bucket for each bucket; the last one looks at the final point
+    sizes = np.maximum(stops - starts, 1)
+    avg_x = np.append((np.add.reduceat(x[:-1], starts) / sizes)[1:], x[-1])
+    avg_y = np.append((np.add.reduceat(y[:-1], starts) / sizes)[1:], y[-1])
+
+    out = np.empty(n_out, dtype="int64")
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i, (lo, hi) in enumerate(zip(starts, stops)):
+        bx, by = x[lo:hi], y[lo:hi]
+        area = np.abs((x[a] - avg_x[i]) * (by - y[a]) - (x[a] - bx) * (avg_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def downsample(x, y, n_out=DEFAULT_POINTS, method="minmax"):
+    """Positions to plot for series ``(x, y)``; NaN values of ``y`` are never chosen.
+
+    ``x`` may be datetimes (tz-aware or not); it is only used by LTTB, as
+    epoch nanoseconds.
+    """
+    y = np.asarray(y, dtype="float64")
+    missing = np.isnan(y)
+    valid = np.flatnonzero(~missing) if missing.any() else None
+    yv = y if valid is None else y[valid]
+    if len(yv) <= n_out:
+        return np.arange(len(y)) if valid is None else valid
+    if method == "lttb":
+        if pd.api.types.is_datetime64_any_dtype(x):
+            x = pd.DatetimeIndex(x).as_unit("ns").asi8
+        xv = np.asarray(x) if valid is None else np.asarray(x)[valid]
+        picked = lttb_indices(xv, yv, n_out)
+    else:
+        picked = minmax_indices(yv, n_out)
+    return picked if valid is None else valid[picked]
@@ -0,0 +1,136 @@
+"""Pollution episodes: contiguous periods above WHO or Chinese air quality limits.
+
+Limits are defined on averages (24 hours, 8 for ozone), so each pollutant is
+put on a complete hourly grid and compared through its trailing mean over
+that window; ``averaged=False`` compares the hourly readings instead. An
+hour without enough readings for its mean counts as not exceeding, so a long
+outage ends an episode.
+
+Episodes are found by run-length encoding the boolean exceedance array: the
+differences of the padded array mark where runs start and stop, and
+``reduceat`` over the run starts gives each run's peak and sum. Everything is
+a constant number of passes over the hours, whatever the number of
+episodes. Exceedance hours per local year are one ``bincount``.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .features import HOUR_NS, LocalCalendar
+from .gaps import HourlyGrid, trailing_mean
+
+# Limits in µg/m³ (CO too), per standard
+THRESHOLDS = {
+    "who": {"pm2.5": 15, "pm10": 45, "no2": 25, "so2": 40, "o3": 100, "co": 4000},
+    "cn": {"pm2.5": 75, "pm10": 150, "no2": 80, "so2": 150, "o3": 160, "co": 4000},
+}
+LABELS = {"who": "WHO 2021 guideline", "cn": "China GB 3095-2012 Grade II"}
+# Hours each limit is averaged over
+AVERAGING = {"o3": 8}
+DEFAULT_AVERAGING = 24
+EPISODE_COLUMNS = ["Station", "Pollutant", "Standard", "Start", "End", "Hours", "Peak", "Peak time", "Mean"]
+YEAR_COLUMNS = ["Station", "Pollutant", "Standard", "Year", "Hours measured", "Exceedance hours", "Share %",
+                "Episodes"]
+
+
+def runs(mask):
+    """``(starts, stops)`` of the runs of True in a boolean array; ``stops`` are exclusive."""
+    edges = np.diff(np.concatenate([[0], mask.view(np.int8), [0]]))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def find_episodes(values, threshold, min_hours=1):
+    """Runs of ``values > threshold`` lasting at least ``min_hours`` grid hours.
+
+    Returns a dict of arrays: ``start``, ``stop`` (positions, exclusive),
+    ``peak``, ``peak_at`` (position of the first peak hour) and ``mean``.
+    """
+    values = np.asarray(values, dtype="float64")
+    above = values > threshold
+    starts, stops = runs(above)
+    keep = stops - starts >= min_hours
+    starts, stops = starts[keep], stops[keep]
+    if not len(starts):
+        empty = np.zeros(0, dtype="int64")
+        return {"start": empty, "stop": empty, "peak": np.zeros(0), "peak_at": empty, "mean": np.zeros(0)}
+    # Run number of every hour, -1 outside the kept runs
+    marks = np.zeros(len(values) + 1, dtype="int64")
+    marks[starts] += 1
+    marks[stops] -= 1
+    inside = np.cumsum(marks[:-1]) > 0
+    first_hours = np.zeros(len(values), dtype="int64")
+    first_hours[starts] = 1
+    run = np.where(inside, np.cumsum(first_hours) - 1, -1)
+    # reduceat segments run from one start to the next; hours between runs must not count
+    peak = np.maximum.reduceat(np.where(inside, values, -np.inf), starts)
+    mean = np.add.reduceat(np.where(inside, values, 0.0), starts) / (stops - starts)
+    hits = np.flatnonzero(inside & (values == peak[run]))
+    first = np.concatenate([[True], np.diff(run[hits]) > 0])
+    return {"start": starts, "stop": stops, "peak": peak, "peak_at": hits[first], "mean": mean}
+
+
+def exceedance_series(grid, column, averaged=True):
+    """The series compared against the limit for ``column``: its trailing mean, or the hourly readings."""
+    values = grid.frame[column].to_numpy(dtype="float64")
+    if not averaged:
+        return values
+    return trailing_mean(values, AVERAGING.get(column, DEFAULT_AVERAGING))
+
+
+def detect(df, columns, standard="who", averaged=True, min_hours=1, station=None):
+    """Episodes and exceedance hours per local year for every column of one station's frame."""
+    limits = THRESHOLDS[standard]
+    columns = [c for c in columns if c in limits and c in df.columns]
+    episodes, years = [], []
+    if not columns or df.empty:
+        return pd.DataFrame(columns=EPISODE_COLUMNS), pd.DataFrame(columns=YEAR_COLUMNS)
+    grid = HourlyGrid.from_frame(df, columns, by=())
+    times = grid.frame["datetime"]
+    tz = times.dt.tz or "UTC"
+    year = LocalCalendar.from_times(times).field(tz, "year").astype("int64")
+    first_year = int(year.min()) if len(year) else 0
+    year_code = year - first_year
+    n_years = int(year_code.max()) + 1 if len(year_code) else 0
+
+    for column in columns:
+        values = exceedance_series(grid, column, averaged)
+        found = find_episodes(values, limits[column], min_hours)
+        episodes.append(pd.DataFrame({
+            "Station": station,
+            "Pollutant": column.upper(),
+            "Standard": standard,
+            "Start": times.iloc[found["start"]].reset_index(drop=True),
+            "End": times.iloc[found["stop"] - 1].reset_index(drop=True) + pd.Timedelta(HOUR_NS, unit="ns"),
+            "Hours": found["stop"] - found["start"],
+            "Peak": found["peak"],
+            "Peak time": times.iloc[found["peak_at"]].reset_index(drop=True),
+            "Mean": found["mean"],
+        }))
+        measured = ~np.isnan(values)
+        above = values > limits[column]
+        hours = np.bincount(year_code[measured], minlength=n_years)
+        exceeded = np.bincount(year_code[above], minlength=n_years)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            share = exceeded / hours * 100
+        years.append(pd.DataFrame({
+            "Station": station,
+            "Pollutant": column.upper(),
+            "Standard": standard,
+            "Year": np.arange(first_year, first_year + n_years),
+            "Hours measured": hours,
+            "Exceedance hours": exceeded,
+            "Share %": share,
+            "Episodes": np.bincount(year_code[found["start"]], minlength=n_years),
+        }))
+    episodes = pd.concat(episodes, ignore_index=True)
+    years = pd.concat(years, ignore_index=True)
+    return episodes, years[years["Hours measured"] > 0].reset_index(drop=True)
+
+
+def episode_tables(frames, columns, standard="who", averaged=True, min_hours=1):
+    """``detect`` over ``{station: frame}``, concatenated: ``(episodes, exceedance hours per year)``."""
+    parts = [detect(df, columns, standard, averaged, min_hours, station) for station, df in frames.items()]
+    if not parts:
+        return pd.DataFrame(columns=EPISODE_COLUMNS), pd.DataFrame(columns=YEAR_COLUMNS)
+    return (pd.concat([p[0] for p in parts], ignore_index=True),
+            pd.concat([p[1] for p in parts], ignore_index=True))
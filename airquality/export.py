@@ -0,0 +1,143 @@
+"""Chunked export of a station view to CSV, gzip CSV, Parquet or Arrow IPC.
+
+``to_csv`` on the whole filtered frame builds the entire file as one Python
+string, and the dashboard used to do that on every rerun. Here rows are
+taken from the time-sorted frame in fixed-size slices (views, not copies),
+each slice becomes one Arrow record batch, and that batch goes straight to a
+streaming writer. Peak memory is one chunk plus the writer's buffers,
+whatever the row count.
+
+CSV timestamps are written as ``YYYY-MM-DD HH:MM:SS+HH:MM`` in the frame's
+timezone. Formatting them through the timezone database is slow, so the
+local wall-clock text and the UTC offset are built separately and joined.
+"""
+
+import gzip
+import io
+import tempfile
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from .timeindex import time_slice
+
+# name: (label, file extension, MIME type)
+FORMATS = {
+    "csv": ("CSV", ".csv", "text/csv"),
+    "csv.gz": ("CSV (gzip)", ".csv.gz", "application/gzip"),
+    "parquet": ("Parquet", ".parquet", "application/vnd.apache.parquet"),
+    "arrow": ("Arrow IPC", ".arrow", "application/vnd.apache.arrow.file"),
+}
+CHUNK_ROWS = 100_000
+# Level 1 is several times faster than the default 9 and only slightly larger on this data
+GZIP_LEVEL = 1
+
+
+def export_columns(df):
+    """Columns offered for export: everything but the derived ``local_*`` calendar fields."""
+    return [c for c in df.columns if not c.startswith("local_")]
+
+
+def _offset_labels(minutes):
+    """``+HH:MM`` text for integer UTC offsets in minutes, as an Arrow string array."""
+    lo = int(minutes.min())
+    labels = [f"{'-' if m < 0 else '+'}{abs(m) // 60:02d}:{abs(m) % 60:02d}"
+              for m in range(lo, int(minutes.max()) + 1)]
+    codes = pa.array((minutes - lo).astype("int32"))
+    return pa.DictionaryArray.from_arrays(codes, pa.array(labels)).cast(pa.string())
+
+
+def _iso_strings(times):
+    """ISO timestamps with UTC offset for a datetime Series (naive values get no offset)."""
+    if times.dt.tz is None:
+        return pa.array(times.to_numpy().astype("datetime64[s]")).cast(pa.string())
+    wall = times.dt.tz_localize(None).to_numpy().astype("datetime64[s]")
+    utc = times.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy().astype("datetime64[s]")
+    text = pa.array(wall).cast(pa.string())
+    if not len(times):
+        return text
+    minutes = (wall - utc).astype("int64") // 60
+    return pc.binary_join_element_wise(text, _offset_labels(minutes), "")
+
+
+class _Borrowed(io.RawIOBase):
+    """Writes through to a file object that stays open when Arrow closes its stream."""
+
+    def __init__(self, fh):
+        super().__init__()
+        self._fh = fh
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self._fh.write(data)
+
+
+def _csv_batch(chunk, schema):
+    arrays = [_iso_strings(chunk[name]) if name == "datetime" else
+              pa.Array.from_pandas(chunk[name]) for name in schema.names]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def batches(df, columns=None, start=None, end=None, chunk_rows=CHUNK_ROWS):
+    """Slices of ``df[columns]`` with ``start <= datetime < end``, ``chunk_rows`` rows at a time."""
+    part = time_slice(df, start, end)
+    columns = list(columns or export_columns(df))
+    for lo in range(0, len(part), chunk_rows):
+        yield part.iloc[lo:lo + chunk_rows][columns]
+
+
+def write_export(df, fmt, sink, columns=None, start=None, end=None, chunk_rows=CHUNK_ROWS):
+    """Write the selected rows and columns of a time-sorted frame to ``sink`` in ``fmt``.
+
+    ``sink`` is a path or a binary file object. Returns the number of rows
+    written.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'")
+    columns = list(columns or export_columns(df))
+    if not isinstance(sink, str):
+        sink = _Borrowed(sink)
+    schema = pa.Schema.from_pandas(df.iloc[:0][columns], preserve_index=False)
+    rows = 0
+
+    if fmt in ("csv", "csv.gz"):
+        if "datetime" in columns:
+            schema = schema.set(schema.get_field_index("datetime"), pa.field("datetime", pa.string()))
+        # Categories are written as their labels
+        schema = pa.schema([pa.field(f.name, f.type.value_type) if pa.types.is_dictionary(f.type) else f
+                            for f in schema])
+        if fmt == "csv.gz":
+            sink = gzip.GzipFile(sink if isinstance(sink, str) else None, "wb", GZIP_LEVEL,
+                                 fileobj=None if isinstance(sink, str) else sink)
+        stream = pa.output_stream(sink)
+        with stream, pacsv.CSVWriter(stream, schema, write_options=pacsv.WriteOptions(quoting_style="needed")) as writer:
+            for chunk in batches(df, columns, start, end, chunk_rows):
+                writer.write_batch(_csv_batch(chunk, schema))
+                rows += len(chunk)
+        return rows
+
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+    with writer:
+        for chunk in batches(df, columns, start, end, chunk_rows):
+            writer.write_batch(pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False))
+            rows += len(chunk)
+    return rows
+
+
+def export_file(df, fmt, columns=None, start=None, end=None, chunk_rows=CHUNK_ROWS):
+    """Export to an anonymous temporary file, rewound for reading."""
+    fh = tempfile.TemporaryFile()
+    write_export(df, fmt, fh, columns, start, end, chunk_rows)
+    fh.seek(0)
+    return fh
+
+
+def file_name(stem, fmt):
+    return f"{stem}{FORMATS[fmt][1]}"
@@ -0,0 +1,113 @@
+"""Derived calendar fields, computed once per dataset and timezone.
+
+Charts group by local year, month, hour and weekday. Adding those as small
+integer/categorical columns up front means no chart has to copy the frame or
+call ``dt.strftime``/``dt.day_name`` on every rerun.
+
+``LocalCalendar`` keeps the instants once, as UTC int64 nanoseconds, and
+derives each timezone's wall clock and fields with integer arithmetic the
+first time that timezone asks for them. Switching the display timezone back
+and forth only ever computes what is missing.
+"""
+
+import numpy as np
+import pandas as pd
+
+MONTH_NAMES = [
+    'January', 'February', 'March', 'April', 'May', 'June',
+    'July', 'August', 'September', 'October', 'November', 'December'
+]
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+CALENDAR_COLUMNS = ('local_year', 'local_month', 'local_month_name', 'local_hour', 'local_weekday')
+
+HOUR_NS = 3_600_000_000_000
+DAY_NS = 24 * HOUR_NS
+
+
+def utc_nanos(times):
+    """UTC epoch nanoseconds of a datetime Series; naive values are taken as UTC."""
+    if times.dt.tz is not None:
+        times = times.dt.tz_convert('UTC').dt.tz_localize(None)
+    return times.to_numpy(dtype='datetime64[ns]').view('int64')
+
+
+class LocalCalendar:
+    """Calendar fields of fixed UTC instants, per timezone, computed on first use and kept."""
+
+    def __init__(self, utc_ns):
+        self.utc_ns = utc_ns
+        self._cache = {}
+
+    @classmethod
+    def from_times(cls, times):
+        return cls(utc_nanos(times))
+
+    def _cached(self, tz, name, compute):
+        key = (str(tz), name)
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def timezones(self):
+        return sorted({tz for tz, _ in self._cache})
+
+    def wall(self, tz):
+        """Local wall-clock time in ``tz`` as int64 nanoseconds."""
+        if str(tz) == 'UTC':
+            return self.utc_ns
+
+        def compute():
+            index = pd.DatetimeIndex(self.utc_ns.view('datetime64[ns]'), tz='UTC')
+            return index.tz_convert(tz).tz_localize(None).asi8
+        return self._cached(tz, 'wall', compute)
+
+    def field(self, tz, name):
+        """Local ``year``, ``month`` (1-12), ``hour`` or ``weekday`` (0 = Monday) in ``tz``."""
+        def compute():
+            wall = self.wall(tz)
+            if name == 'hour':
+                return (wall // HOUR_NS % 24).astype('int8')
+            if name == 'weekday':
+                # 1970-01-01 was a Thursday
+                return ((wall // DAY_NS + 3) % 7).astype('int8')
+            months = wall.view('datetime64[ns]').astype('datetime64[M]').astype('int64')
+            if name == 'month':
+                return (months % 12 + 1).astype('int8')
+            if name == 'year':
+                return (months // 12 + 1970).astype('int16')
+            raise ValueError(f"Unknown calendar field: {name}")
+        return self._cached(tz, name, compute)
+
+    def columns(self, tz):
+        """The ``local_*`` calendar columns for ``tz``."""
+        month = self.field(tz, 'month')
+        month_name = self._cached(
+            tz, 'month_name', lambda: pd.Categorical.from_codes(month - 1, MONTH_NAMES, ordered=True)
+        )
+        return {
+            'local_year': self.field(tz, 'year'),
+            'local_month': month,
+            'local_month_name': month_name,
+            'local_hour': self.field(tz, 'hour'),
+            'local_weekday': self.field(tz, 'weekday'),
+        }
+
+
+def add_calendar(df, calendar=None):
+    """Return ``df`` plus ``local_*`` calendar columns for its (already converted) timestamps.
+
+    ``calendar`` is a ``LocalCalendar`` over the same rows whose fields are
+    reused; without one they are computed for this call. Existing columns are
+    shared with ``df``, not copied.
+    """
+    calendar = calendar or LocalCalendar.from_times(df['datetime'])
+    out = df.copy(deep=False)
+    for name, values in calendar.columns(df['datetime'].dt.tz or 'UTC').items():
+        out[name] = values
+    return out
+
+
+def weekday_names(weekdays):
+    """Map weekday numbers (0 = Monday) to names."""
+    return np.asarray(DAY_NAMES)[np.asarray(weekdays, dtype='int64')]
@@ -0,0 +1,320 @@
+"""Short-horizon PM2.5 forecasts from lagged readings and meteorology.
+
+The model is a direct multi-horizon ridge regression: one linear model per
+lead time ``h = 1..horizon`` hours, all sharing the same features taken at
+the forecast origin. Training solves one small ``p x p`` system per horizon
+(``p`` is a few dozen features), so a 15-year hourly history trains in about
+a second, and a forecast is one matrix product.
+
+Features are built for every hour of a regular grid at once (see
+``gaps.HourlyGrid``); a lag is a shifted array, a trailing mean is a
+difference of cumulative sums. For an origin ``t``:
+
+* PM2.5 at ``t`` and at the lags in ``LAGS``, and its trailing means over
+  ``WINDOWS`` hours, all on ``log1p`` scale;
+* each weather reading present in the data (dew point, temperature,
+  pressure, wind speed, precipitation) at ``t`` and its change over 24
+  hours, plus the wind direction one-hot encoded;
+* local hour of day and day of year as sine/cosine pairs.
+
+Targets are ``log1p`` PM2.5 at ``t + h``; only measured hours are targets,
+while features may carry a reading forward for up to ``FILL_LIMIT`` hours.
+Each horizon keeps the 10th and 90th percentiles of its training residuals
+as a forecast interval.
+
+Models are saved as ``.npz`` (arrays plus a JSON header, no pickle) and
+trained offline with ``python -m airquality train``; ``backtest`` measures
+accuracy and training time on rolling origins.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from . import CACHE_DIR
+from .features import DAY_NS, HOUR_NS, LocalCalendar, utc_nanos
+from .gaps import HourlyGrid, trailing_mean
+from .timeindex import time_slice
+
+TARGET = "pm2.5"
+LAGS = (1, 2, 3, 6, 12, 24, 48)
+WINDOWS = (24, 72)
+WEATHER = ("dewp", "temperature", "pres", "iws", "is", "ir", "wspm", "rain")
+WIND = ("cbwd", "wd")
+WEATHER_CHANGE = 24
+FILL_LIMIT = 3
+HORIZON = 72
+ALPHA = 0.01
+QUANTILES = (0.1, 0.9)
+# Hours of history the features of one origin look back over
+LOOKBACK = max(max(LAGS), max(WINDOWS), WEATHER_CHANGE) + FILL_LIMIT + 1
+# Trailing means need at least this share of their window measured
+MIN_COVERAGE = 0.5
+MODEL_PATH = os.environ.get("AQ_FORECAST_MODEL", os.path.join(CACHE_DIR, "models", "pm25_forecast.npz"))
+
+
+def _shift(values, k):
+    out = np.full(len(values), np.nan)
+    if k < len(values):
+        out[k:] = values[:len(values) - k]
+    return out
+
+
+def feature_spec(df):
+    """Which inputs a model for ``df`` uses: weather columns and wind categories present in it."""
+    weather = [c for c in WEATHER if c in df.columns and df[c].notna().any()]
+    wind = {}
+    for name in WIND:
+        if name in df.columns and isinstance(df[name].dtype, pd.CategoricalDtype):
+            used = df[name].cat.remove_unused_categories().cat.categories
+            if len(used):
+                wind[name] = [str(c) for c in used]
+    return {"weather": weather, "wind": wind}
+
+
+def _grid(df, spec):
+    """``df`` on an hourly grid with the target, weather and one-hot wind columns, short gaps filled."""
+    columns = [TARGET] + spec["weather"]
+    frame = df[["datetime"] + [c for c in columns if c in df.columns]].copy(deep=False)
+    for name, categories in spec["wind"].items():
+        codes = (pd.Categorical(df[name], categories=categories).codes if name in df.columns
+                 else np.full(len(df), -1))
+        for k, category in enumerate(categories):
+            frame[f"{name}={category}"] = np.where(codes < 0, np.nan, codes == k)
+            columns.append(f"{name}={category}")
+    for name in columns:
+        if name not in frame.columns:
+            frame[name] = np.nan
+    return HourlyGrid.from_frame(frame, columns, by=(), method="ffill", limit=FILL_LIMIT)
+
+
+def design(grid, spec):
+    """Feature matrix (one row per grid hour), feature names and the measured target per hour."""
+    frame = grid.frame
+    filled = np.log1p(frame[TARGET].to_numpy(dtype="float64"))
+    target = np.where(grid.missing(TARGET), np.nan, filled)
+    names = ["pm2.5 t"]
+    columns = [filled]
+    for k in LAGS:
+        names.append(f"pm2.5 t-{k}h")
+        columns.append(_shift(filled, k))
+    for window in WINDOWS:
+        names.append(f"pm2.5 mean {window}h")
+        columns.append(trailing_mean(target, window, MIN_COVERAGE))
+    for name in spec["weather"]:
+        values = frame[name].to_numpy(dtype="float64")
+        names += [name, f"{name} change {WEATHER_CHANGE}h"]
+        columns += [values, values - _shift(values, WEATHER_CHANGE)]
+    for name, categories in spec["wind"].items():
+        for category in categories:
+            names.append(f"{name}={category}")
+            columns.append(frame[f"{name}={category}"].to_numpy(dtype="float64"))
+
+    calendar = LocalCalendar.from_times(frame["datetime"])
+    tz = frame["datetime"].dt.tz or "UTC"
+    hour = 2 * np.pi * calendar.field(tz, "hour") / 24
+    wall = calendar.wall(tz).view("datetime64[ns]")
+    day = 2 * np.pi * (wall - wall.astype("datetime64[Y]")).astype("int64") / (365.25 * DAY_NS)
+    names += ["hour sin", "hour cos", "day sin", "day cos"]
+    columns += [np.sin(hour), np.cos(hour), np.sin(day), np.cos(day)]
+    return np.column_stack(columns), names, target
+
+
+def targets(target, horizon):
+    """``(rows, horizon)`` matrix of the target ``1..horizon`` hours after each row."""
+    padded = np.concatenate([target, np.full(horizon, np.nan)])
+    return np.lib.stride_tricks.sliding_window_view(padded[1:], horizon)[:len(target)]
+
+
+def fit_arrays(X, Y, alpha=ALPHA):
+    """Ridge coefficients per horizon (column of ``Y``) on standardized features.
+
+    Rows with any missing feature are dropped; each horizon uses the rows
+    whose target is measured. Returns a dict of model arrays.
+    """
+    rows = ~np.isnan(X).any(axis=1)
+    X, Y = X[rows], Y[rows]
+    mean = X.mean(axis=0)
+    scale = X.std(axis=0)
+    scale[scale == 0] = 1.0
+    Xs = (X - mean) / scale
+    p, horizon = X.shape[1], Y.shape[1]
+    coef = np.zeros((p, horizon))
+    intercept = np.full(horizon, np.nan)
+    bands = np.full((len(QUANTILES), horizon), np.nan)
+    for h in range(horizon):
+        mask = ~np.isnan(Y[:, h])
+        n = int(mask.sum())
+        if n <= p:
+            continue
+        x, y = Xs[mask], Y[mask, h]
+        x_mean, y_mean = x.mean(axis=0), y.mean()
+        xc = x - x_mean
+        # Penalty scaled by n so alpha means the same for any history length
+        coef[:, h] = np.linalg.solve(xc.T @ xc + alpha * n * np.eye(p), xc.T @ (y - y_mean))
+        intercept[h] = y_mean - x_mean @ coef[:, h]
+        bands[:, h] = np.quantile(y - x @ coef[:, h] - intercept[h], QUANTILES)
+    return {"mean": mean, "scale": scale, "coef": coef, "intercept": intercept, "bands": bands}
+
+
+class ForecastModel:
+    """A trained direct multi-horizon ridge model with its feature spec."""
+
+    def __init__(self, spec, names, arrays, meta):
+        self.spec = spec
+        self.names = names
+        self.arrays = arrays
+        self.meta = meta
+
+    @property
+    def horizon(self):
+        return self.arrays["coef"].shape[1]
+
+    @classmethod
+    def fit(cls, df, horizon=HORIZON, alpha=ALPHA):
+        """Train on a time-sorted frame with a PM2.5 column and whatever weather it has."""
+        if TARGET not in df.columns:
+            raise ValueError(f"Forecasting needs a '{TARGET}' column")
+        started = time.perf_counter()
+        spec = feature_spec(df)
+        grid = _grid(df, spec)
+        X, names, target = design(grid, spec)
+        arrays = fit_arrays(X, targets(target, horizon), alpha)
+        meta = {
+            "target": TARGET, "horizon": horizon, "alpha": alpha, "rows": int(np.isfinite(target).sum()),
+            "first": str(grid.frame["datetime"].iloc[0]) if len(grid) else None,
+            "last": str(grid.frame["datetime"].iloc[-1]) if len(grid) else None,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        return cls(spec, names, arrays, meta)
+
+    def missing_inputs(self, df):
+        """Weather columns the model uses that ``df`` does not have."""
+        return [c for c in self.spec["weather"] + list(self.spec["wind"]) if c not in df.columns]
+
+    def predict_arrays(self, X):
+        """``log1p`` forecasts, one row per row of ``X`` and one column per horizon.
+
+        A missing feature is replaced by its training mean.
+        """
+        Xs = (X - self.arrays["mean"]) / self.arrays["scale"]
+        return np.nan_to_num(Xs) @ self.arrays["coef"] + self.arrays["intercept"]
+
+    def predict(self, df, origin=None):
+        """Forecast from the hour ``origin`` (default: the last PM2.5 reading in ``df``).
+
+        Only the last ``LOOKBACK`` hours before the origin are read. Returns a
+        frame with ``datetime``, ``forecast``, ``low`` and ``high`` (µg/m³),
+        and the names of the features that had to be filled with their mean.
+        """
+        times = df["datetime"]
+        if origin is None:
+            measured = df[TARGET].notna().to_numpy()
+            if not measured.any():
+                raise ValueError("No PM2.5 readings to forecast from")
+            origin = times.iloc[np.flatnonzero(measured)[-1]]
+        origin = pd.Timestamp(origin).floor("h")
+        recent = time_slice(df, origin - pd.Timedelta(hours=LOOKBACK), origin + pd.Timedelta(hours=1))
+        grid = _grid(recent, self.spec)
+        X, _, _ = design(grid, self.spec)
+        at = np.flatnonzero(utc_nanos(grid.frame["datetime"]) == utc_nanos(pd.Series([origin])).item())
+        if not len(at):
+            raise ValueError(f"No data at the forecast origin {origin}")
+        x = X[at[-1]][None, :]
+        filled = [name for name, value in zip(self.names, x[0]) if np.isnan(value)]
+        log = self.predict_arrays(x)[0]
+        low, high = log + self.arrays["bands"]
+        steps = pd.to_timedelta(np.arange(1, self.horizon + 1), unit="h")
+        out = pd.DataFrame({
+            "datetime": grid.frame["datetime"].iloc[at[-1]] + steps,
+            "forecast": np.expm1(log),
+            "low": np.expm1(low),
+            "high": np.expm1(high),
+        })
+        return out, filled
+
+    def coefficients(self, hours=(1, 24, 72)):
+        """Standardized coefficients for a few horizons, as a frame indexed by feature."""
+        hours = [h for h in hours if h <= self.horizon]
+        return pd.DataFrame(self.arrays["coef"][:, [h - 1 for h in hours]], index=self.names,
+                            columns=[f"+{h}h" for h in hours])
+
+    def save(self, path=None):
+        """Write the model as ``.npz`` (atomically); returns the path."""
+        path = path or MODEL_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        header = json.dumps({"spec": self.spec, "names": self.names, "meta": self.meta})
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, header=np.array(header), **self.arrays)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path=None):
+        with np.load(path or MODEL_PATH, allow_pickle=False) as data:
+            header = json.loads(str(data["header"]))
+            arrays = {name: data[name] for name in data.files if name != "header"}
+        return cls(header["spec"], header["names"], arrays, header["meta"])
+
+
+def _errors(model, X, Y, origins, persistence):
+    """Absolute and squared errors (µg/m³) of the model and of persistence at ``origins``."""
+    actual = np.expm1(Y[origins])
+    predicted = np.expm1(model.predict_arrays(X[origins]))
+    naive = np.expm1(persistence[origins])[:, None]
+    return actual - predicted, actual - naive
+
+
+def backtest(df, horizon=HORIZON, alpha=ALPHA, folds=4, test_days=60):
+    """Rolling-origin evaluation over the last ``folds`` blocks of ``test_days`` days.
+
+    Each fold trains on the hours before its block and forecasts from every
+    hour in the block that has a PM2.5 reading. Returns ``(table, timings)``:
+    MAE and RMSE by lead time band for the model and for persistence (the
+    last reading), and training/inference seconds per fold.
+    """
+    spec = feature_spec(df)
+    grid = _grid(df, spec)
+    X, _, target = design(grid, spec)
+    Y = targets(target, horizon)
+    hours = utc_nanos(grid.frame["datetime"]) // HOUR_NS
+    block = test_days * 24
+    bands = [(lo, min(lo + 23, horizon)) for lo in range(1, horizon + 1, 24)]
+    model_err, naive_err, timings = [], [], []
+
+    for k in range(folds, 0, -1):
+        cutoff = hours[-1] + 1 - k * block
+        if cutoff - hours[0] < 365 * 24:
+            continue
+        train = hours < cutoff
+        started = time.perf_counter()
+        Y_train = Y[train].copy()
+        Y_train[hours[train][:, None] + np.arange(1, horizon + 1) >= cutoff] = np.nan
+        arrays = fit_arrays(X[train], Y_train, alpha)
+        model = ForecastModel(spec, [], arrays, {})
+        fitted = time.perf_counter() - started
+
+        origins = np.flatnonzero((hours >= cutoff) & (hours < cutoff + block) & ~np.isnan(target))
+        started = time.perf_counter()
+        err, naive = _errors(model, X, Y, origins, target)
+        timings.append({"fold": len(timings) + 1, "train_rows": int(train.sum()), "origins": len(origins),
+                        "train_seconds": round(fitted, 3),
+                        "predict_ms_per_origin": round((time.perf_counter() - started) * 1000 / max(len(origins), 1), 4)})
+        model_err.append(err)
+        naive_err.append(naive)
+
+    if not model_err:
+        return pd.DataFrame(), pd.DataFrame(timings)
+    err, naive = np.concatenate(model_err), np.concatenate(naive_err)
+    rows = []
+    for lo, hi in bands:
+        e, n = err[:, lo - 1:hi], naive[:, lo - 1:hi]
+        e, n = e[~np.isnan(e)], n[~np.isnan(n)]
+        mae, naive_mae = np.abs(e).mean(), np.abs(n).mean()
+        rows.append({"Lead time": f"{lo}-{hi}h", "Forecasts": len(e), "MAE": mae, "RMSE": np.sqrt((e ** 2).mean()),
+                     "Persistence MAE": naive_mae, "Persistence RMSE": np.sqrt((n ** 2).mean()),
+                     "Skill": 1 - mae / naive_mae})
+    return pd.DataFrame(rows), pd.DataFrame(timings)
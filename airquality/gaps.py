@@ -0,0 +1,232 @@
+"""Regular hourly grids with explicit gaps, and vectorized imputation.
+
+Sources have holes: the historical file starts with empty PM2.5 readings,
+API chunks can fail, stations go offline. Anything that assumes "one row per
+hour" (a 24-row rolling window, a lag feature, a run of exceedances) is
+wrong across those holes. ``HourlyGrid`` puts every station and source on a
+complete hourly grid from its first to its last reading, in one pass over
+all groups at once: each group gets a contiguous block of hours, and every
+reading is scattered into its block by integer arithmetic on UTC hours.
+
+Which hours had no reading is kept as a bitmask column (``gaps``, one bit
+per pollutant), so imputed values can always be told from measured ones.
+Imputation never crosses a group boundary:
+
+* ``ffill`` carries the last reading forward for at most ``limit`` hours;
+* ``linear`` interpolates across interior gaps of at most ``limit`` hours;
+* ``seasonal`` fills each missing hour with its group's mean for that local
+  month and hour of day.
+
+``limit=None`` means no limit. Gaps that stay unfilled remain NaN.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .features import HOUR_NS, LocalCalendar, utc_nanos
+
+METHODS = ("none", "ffill", "linear", "seasonal")
+GROUP_COLUMNS = ("station", "source")
+
+
+def _mask_dtype(n_columns):
+    for dtype in ("uint8", "uint16", "uint32", "uint64"):
+        if n_columns <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError(f"At most 64 columns fit in a gap mask, got {n_columns}")
+
+
+def _ffill(values, valid, group_start, limit):
+    n = len(values)
+    last = np.maximum.accumulate(np.where(valid, np.arange(n), -1))
+    fill = ~valid & (last >= group_start)
+    if limit is not None:
+        fill &= np.arange(n) - last <= limit
+    values[fill] = values[last[fill]]
+
+
+def _linear(values, valid, group_start, group_stop, limit):
+    n = len(values)
+    positions = np.arange(n)
+    last = np.maximum.accumulate(np.where(valid, positions, -1))
+    following = np.minimum.accumulate(np.where(valid, positions, n)[::-1])[::-1]
+    fill = ~valid & (last >= group_start) & (following < group_stop)
+    if limit is not None:
+        fill &= following - last - 1 <= limit
+    lo, hi = last[fill], following[fill]
+    weight = (positions[fill] - lo) / (hi - lo)
+    values[fill] = values[lo] + weight * (values[hi] - values[lo])
+
+
+def _seasonal(values, valid, season):
+    size = int(season.max()) + 1 if len(season) else 0
+    sums = np.bincount(season[valid], values[valid], minlength=size)
+    counts = np.bincount(season[valid], minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    fill = ~valid & (counts[season] > 0)
+    values[fill] = means[season[fill]]
+
+
+class HourlyGrid:
+    """Readings on a complete hourly grid per station and source, with a bitmask of missing hours.
+
+    ``frame`` is sorted by group, then time; ``offsets[g]:offsets[g + 1]``
+    are the rows of group ``g``, whose labels are ``keys.iloc[g]``.
+    """
+
+    def __init__(self, frame, columns, offsets, keys, method="none", limit=None):
+        self.frame = frame
+        self.columns = list(columns)
+        self.offsets = offsets
+        self.keys = keys
+        self.method = method
+        self.limit = limit
+
+    @classmethod
+    def from_frame(cls, df, columns, by=GROUP_COLUMNS, method="none", limit=None):
+        """Regularize ``df`` (any order, one row per group and hour) and impute with ``method``."""
+        if method not in METHODS:
+            raise ValueError(f"Unknown imputation method '{method}'")
+        columns = [c for c in columns if c in df.columns]
+        by = [c for c in by if c in df.columns]
+        tz = df["datetime"].dt.tz
+        df = df[df["datetime"].notna()]
+        hours = utc_nanos(df["datetime"]) // HOUR_NS
+
+        if by:
+            grouped = df.groupby(by, observed=True, sort=True, dropna=False)
+            group = grouped.ngroup().to_numpy()
+            keys = grouped.size().index.to_frame(index=False)
+        else:
+            group = np.zeros(len(df), dtype="int64")
+            keys = pd.DataFrame(index=range(1 if len(df) else 0))
+        n_groups = len(keys)
+        span = pd.Series(hours).groupby(group).agg(["min", "max"])
+        first, last = span["min"].to_numpy(), span["max"].to_numpy()
+        lengths = last - first + 1
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype("int64")
+        n = int(offsets[-1])
+
+        grid_group = np.repeat(np.arange(n_groups), lengths)
+        group_start = offsets[:-1][grid_group]
+        grid_hours = np.arange(n) - group_start + first[grid_group]
+        # Where each reading lands on the grid
+        slot = offsets[:-1][group] + hours - first[group]
+
+        out = {"datetime": pd.Series(pd.DatetimeIndex((grid_hours * HOUR_NS).view("datetime64[ns]"), tz="UTC"))}
+        if tz is not None:
+            out["datetime"] = out["datetime"].dt.tz_convert(tz)
+        for name in by:
+            codes, labels = pd.factorize(keys[name])
+            out[name] = pd.Categorical.from_codes(codes[grid_group], labels)
+
+        season = None
+        if method == "seasonal":
+            calendar = LocalCalendar(grid_hours * HOUR_NS)
+            local = tz or "UTC"
+            season = ((grid_group * 12 + calendar.field(local, "month") - 1) * 24
+                      + calendar.field(local, "hour")).astype("int64")
+
+        gaps = np.zeros(n, dtype=_mask_dtype(len(columns)))
+        for bit, name in enumerate(columns):
+            source = pd.to_numeric(df[name], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+            values = np.full(n, np.nan)
+            values[slot] = source
+            valid = ~np.isnan(values)
+            gaps |= (~valid).astype(gaps.dtype) << gaps.dtype.type(bit)
+            if method == "ffill":
+                _ffill(values, valid, group_start, limit)
+            elif method == "linear":
+                _linear(values, valid, group_start, offsets[1:][grid_group], limit)
+            elif method == "seasonal":
+                _seasonal(values, valid, season)
+            dtype = df[name].dtype if df[name].dtype.kind == "f" else "float64"
+            out[name] = values.astype(dtype)
+        out["gaps"] = gaps
+        return cls(pd.DataFrame(out), columns, offsets, keys, method, limit)
+
+    def __len__(self):
+        return len(self.frame)
+
+    def groups(self):
+        """``(labels, rows)`` per station/source; ``rows`` is a time-sorted view of ``frame``."""
+        for g in range(len(self.keys)):
+            yield self.keys.iloc[g].to_dict(), self.frame.iloc[self.offsets[g]:self.offsets[g + 1]]
+
+    def missing(self, column, rows=None):
+        """Boolean mask of the hours that had no ``column`` reading (in ``rows``, default all)."""
+        rows = self.frame if rows is None else rows
+        bit = self.columns.index(column)
+        return (rows["gaps"].to_numpy() >> bit) & 1 == 1
+
+    def imputed(self, column, rows=None):
+        """Hours that had no reading but hold an imputed value."""
+        rows = self.frame if rows is None else rows
+        return self.missing(column, rows) & rows[column].notna().to_numpy()
+
+    def summary(self):
+        """Hours, missing hours, imputed hours and longest gap per group and column."""
+        group = np.repeat(np.arange(len(self.keys)), np.diff(self.offsets))
+        starts = np.zeros(len(self.frame), dtype=bool)
+        starts[self.offsets[:-1][np.diff(self.offsets) > 0]] = True
+        rows = []
+        for column in self.columns:
+            missing = self.missing(column)
+            # A run of missing hours starts where the previous hour was present or in another group
+            run_start = missing & (starts | ~np.roll(missing, 1))
+            run = np.cumsum(run_start) - 1
+            lengths = np.bincount(run[missing], minlength=int(run_start.sum()))
+            longest = np.zeros(len(self.keys), dtype="int64")
+            np.maximum.at(longest, group[run_start], lengths)
+            frame = self.keys.copy()
+            frame["column"] = column
+            frame["hours"] = np.diff(self.offsets)
+            frame["missing"] = np.bincount(group[missing], minlength=len(self.keys))
+            frame["imputed"] = np.bincount(group[self.imputed(column)], minlength=len(self.keys))
+            frame["longest_gap"] = longest
+            rows.append(frame)
+        if not rows:
+            return pd.DataFrame()
+        return pd.concat(rows, ignore_index=True)
+
+
+def trailing_mean(values, window, min_coverage=0.5):
+    """Mean of the last ``window`` grid hours at each hour, NaN where under ``min_coverage`` of them have values."""
+    valid = ~np.isnan(values)
+    sums = np.concatenate([[0.0], np.cumsum(np.where(valid, values, 0.0))])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    lo = np.maximum(np.arange(1, len(values) + 1) - window, 0)
+    n = counts[1:] - counts[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = (sums[1:] - sums[lo]) / n
+    out[n < min_coverage * window] = np.nan
+    return out
+
+
+def break_points(times, max_gap):
+    """Positions ``i`` with ``times[i + 1] - times[i] > max_gap``: where a plotted line should break."""
+    values = pd.Series(times).to_numpy(dtype="datetime64[ns]")
+    if len(values) < 2:
+        return np.zeros(0, dtype="int64")
+    return np.flatnonzero(np.diff(values) > np.timedelta64(pd.Timedelta(max_gap)))
+
+
+def with_breaks(frame, positions, breaks):
+    """Rows ``positions`` of ``frame`` with an empty row after each position in ``breaks``.
+
+    ``positions`` is a sorted selection (e.g. from a downsampler) that should
+    include both sides of every break; plotly stops a line at the empty rows.
+    """
+    positions = np.union1d(positions, np.concatenate([breaks, breaks + 1])) if len(breaks) else positions
+    out = frame.iloc[positions].reset_index(drop=True)
+    after = np.flatnonzero(np.isin(positions, breaks))
+    if not len(after):
+        return out
+    # The empty rows keep their time and labels (so a trace stays one trace) and lose their values
+    blank = out.iloc[after].copy()
+    for name in blank.columns:
+        if blank[name].dtype.kind == "f":
+            blank[name] = np.nan
+    blank.index = after + 0.5
+    return pd.concat([out, blank]).sort_index().reset_index(drop=True)
@@ -0,0 +1,281 @@
+"""CSV ingestion with a columnar, content-addressed cache.
+
+A CSV is parsed once, in chunks, into a typed Arrow IPC file sorted by
+``datetime``. Later loads of the same bytes memory-map that file and skip
+``read_csv``, column normalization and datetime parsing entirely. Pollutant
+and weather readings are stored as float32; other numeric columns (row
+numbers, ids, calendar fields) keep exact values as int64, or float64 when
+they are not integers, and the loaded frame is compacted to the canonical
+schema (see ``schema.py``).
+
+Column types are not fixed by the first chunk: each column takes the widest
+kind any chunk needs (empty < integer < decimal < text), as a single
+``read_csv`` of the whole file would. When a later chunk widens a column,
+the batches written so far are cast into a new file; that happens at most
+a few times per column, so conversion stays one pass in practice.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from . import CACHE_DIR
+from .schema import CANONICAL, compact
+
+# Bump when the cached file layout changes so stale conversions are ignored
+FORMAT_VERSION = 4
+
+CHUNK_ROWS = 250_000
+HASH_BLOCK = 1 << 20
+
+
+def normalize_columns(df):
+    """Standardizes column name variations."""
+    rename_map = {
+        "pm25": "pm2.5", "pm_25": "pm2.5", "pm2_5": "pm2.5", "PM2.5": "pm2.5",
+        "pm_10": "pm10", "PM10": "pm10", "NO2": "no2", "SO2": "so2", "CO": "co", "O3": "o3",
+        "aqi_value": "aqi", "AQI": "aqi", "temp": "temperature", "TEMP": "temperature"
+    }
+    df.columns = df.columns.str.strip().str.lower()
+    return df.rename(columns=rename_map)
+
+
+def _calendar_to_datetime(df, parts):
+    """Build datetimes from year/month/day[/hour] columns with integer arithmetic.
+
+    Avoids the per-row dict-of-columns path of ``pd.to_datetime``; rows with a
+    missing component become NaT.
+    """
+    cols = {p: pd.to_numeric(df[p], errors="coerce").to_numpy(dtype="float64") for p in parts}
+    valid = np.logical_and.reduce([np.isfinite(v) for v in cols.values()])
+    filled = {p: np.where(valid, v, 0).astype("int64") for p, v in cols.items()}
+    months = (filled["year"] - 1970) * 12 + filled["month"] - 1
+    stamps = months.astype("datetime64[M]").astype("datetime64[ns]")
+    stamps = stamps + (filled["day"] - 1).astype("timedelta64[D]")
+    if "hour" in filled:
+        stamps = stamps + filled["hour"].astype("timedelta64[h]")
+    stamps[~valid] = np.datetime64("NaT")
+    return pd.Series(stamps, index=df.index)
+
+
+def parse_datetime_column(df):
+    """Intelligently parse various datetime formats."""
+    df = df.copy()
+
+    # Try standard datetime column
+    if "datetime" in df.columns:
+        df["datetime"] = pd.to_datetime(df["datetime"], errors="coerce")
+    elif "date" in df.columns:
+        df["datetime"] = pd.to_datetime(df["date"], errors="coerce")
+    elif "timestamp" in df.columns:
+        df["datetime"] = pd.to_datetime(df["timestamp"], errors="coerce")
+    # Try combining year/month/day/hour columns
+    elif all(col in df.columns for col in ['year', 'month', 'day', 'hour']):
+        df['datetime'] = _calendar_to_datetime(df, ['year', 'month', 'day', 'hour'])
+    elif all(col in df.columns for col in ['year', 'month', 'day']):
+        df['datetime'] = _calendar_to_datetime(df, ['year', 'month', 'day'])
+
+    return df
+
+
+def file_digest(fileobj):
+    """SHA-256 of a file-like object's bytes, read in blocks; rewinds when done."""
+    h = hashlib.sha256()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(HASH_BLOCK), b""):
+        h.update(block)
+    fileobj.seek(0)
+    return h.hexdigest()
+
+
+# Column kinds in widening order
+KINDS = ("null", "int", "float", "string")
+ARROW_TYPES = {"null": pa.float64(), "int": pa.int64(), "float": pa.float64(), "string": pa.string()}
+
+
+def _is_measurement(col):
+    return CANONICAL.get(col) == "float32"
+
+
+def _typed_chunk(chunk):
+    """Normalize one raw CSV chunk into the cached column types."""
+    chunk = parse_datetime_column(normalize_columns(chunk))
+    for col in chunk.columns:
+        if col == "datetime":
+            continue
+        if pd.api.types.is_numeric_dtype(chunk[col]):
+            if _is_measurement(col):
+                chunk[col] = chunk[col].astype("float32")
+            elif not pd.api.types.is_integer_dtype(chunk[col]):
+                chunk[col] = chunk[col].astype("float64")
+        else:
+            chunk[col] = chunk[col].astype("string")
+    return chunk
+
+
+def _integral(values):
+    values = values.dropna().to_numpy(dtype="float64")
+    return bool(np.all(values == np.round(values)) and np.all(np.abs(values) < 2 ** 63))
+
+
+def _widen_kinds(kinds, chunk):
+    """Update ``{column: kind}`` with the kinds ``chunk`` needs; returns ``kinds``."""
+    for col in chunk.columns:
+        values = chunk[col]
+        if col == "datetime":
+            kind = "datetime"
+        elif _is_measurement(col):
+            # Readings are numeric by definition; stray text becomes NaN, as in compact()
+            kind = "float"
+        elif not pd.api.types.is_numeric_dtype(values):
+            kind = "string"
+        elif values.isna().all():
+            kind = "null"
+        elif pd.api.types.is_integer_dtype(values):
+            kind = "int"
+        else:
+            kind = "float"
+        old = kinds.get(col, "null")
+        if kind == "datetime" or old == "datetime":
+            kinds[col] = kind
+            continue
+        if old == "int" and kind == "float" and _integral(values):
+            # read_csv gives an integer column with gaps as float; its values still fit
+            kind = "int"
+        kinds[col] = max(old, kind, key=KINDS.index)
+    return kinds
+
+
+def _arrow_schema(kinds):
+    fields = []
+    for col, kind in kinds.items():
+        if kind == "datetime":
+            fields.append(pa.field(col, pa.timestamp("ns")))
+        elif kind == "float" and _is_measurement(col):
+            fields.append(pa.field(col, pa.float32()))
+        else:
+            fields.append(pa.field(col, ARROW_TYPES[kind]))
+    return pa.schema(fields)
+
+
+def _conform(chunk, schema):
+    """Coerce a chunk to ``schema``, which is at least as wide as the chunk's own types."""
+    for field in schema:
+        if field.name not in chunk.columns:
+            chunk[field.name] = None if pa.types.is_string(field.type) else np.nan
+        if pa.types.is_integer(field.type):
+            # Nullable, so an integer column may have gaps in some chunks
+            chunk[field.name] = pd.to_numeric(chunk[field.name]).astype("Int64")
+        elif pa.types.is_floating(field.type):
+            dtype = "float32" if pa.types.is_float32(field.type) else "float64"
+            chunk[field.name] = pd.to_numeric(chunk[field.name], errors="coerce").astype(dtype)
+        elif pa.types.is_string(field.type):
+            chunk[field.name] = chunk[field.name].astype("string")
+    return chunk[schema.names]
+
+
+def _copy_widened(src, writer, schema):
+    """Append the batches of the Arrow file ``src`` to ``writer``, cast to the wider ``schema``."""
+    with pa.memory_map(src, "r") as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            columns = [batch.column(f.name).cast(f.type, safe=False) if f.name in batch.schema.names
+                       else pa.nulls(len(batch), f.type) for f in schema]
+            writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+
+
+def cache_path(digest, cache_dir=None):
+    return os.path.join(cache_dir or CACHE_DIR, "ingest", f"{digest}.v{FORMAT_VERSION}.arrow")
+
+
+def convert_csv(fileobj, dest, chunksize=CHUNK_ROWS):
+    """Stream a CSV into an Arrow IPC file at ``dest``, one chunk in memory at a time.
+
+    Chunks are written as record batches. A CSV that is not chronological is
+    sorted afterwards by ``_sort_file``, which keeps only the datetime sort
+    order in memory; an already chronological CSV (the usual case) skips it.
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    # Rewrites (widening, sorting) go to the spare file, then the two names swap
+    spare = tmp + ".swap"
+    kinds, schema = {}, None
+    sink = writer = None
+    in_order = True
+    last = None
+    fileobj.seek(0)
+    try:
+        for raw in pd.read_csv(fileobj, chunksize=chunksize):
+            chunk = _typed_chunk(raw)
+            wider = _arrow_schema(_widen_kinds(kinds, chunk))
+            if schema is None or not wider.equals(schema):
+                if writer is not None:
+                    writer.close()
+                    sink.close()
+                    tmp, spare = spare, tmp
+                sink = pa.OSFile(tmp, "wb")
+                writer = pa.ipc.new_file(sink, wider)
+                if schema is not None:
+                    _copy_widened(spare, writer, wider)
+                    os.remove(spare)
+                schema = wider
+            chunk = _conform(chunk, schema)
+            if "datetime" in chunk.columns and len(chunk):
+                dts = chunk["datetime"]
+                if not dts.is_monotonic_increasing or (last is not None and dts.iloc[0] < last):
+                    in_order = False
+                last = dts.iloc[-1]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        if writer is None:
+            raise ValueError("CSV file contains no rows")
+        writer.close()
+        sink.close()
+        if not in_order and "datetime" in schema.names:
+            _sort_file(tmp, spare, chunksize)
+            tmp, spare = spare, tmp
+        os.replace(tmp, dest)
+    finally:
+        if sink is not None and not sink.closed:
+            sink.close()
+        for leftover in (tmp, spare):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return dest
+
+
+def _sort_file(src, dest, chunksize=CHUNK_ROWS):
+    """Write the rows of the Arrow file ``src`` to ``dest`` in datetime order (stable, missing times last).
+
+    ``src`` is memory-mapped, so its columns are never copied onto the heap:
+    only the sort order of the datetime column (8 bytes a row) and one
+    gathered chunk of rows are held at a time.
+    """
+    with pa.memory_map(src, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+        order = pc.sort_indices(table["datetime"])
+        with pa.OSFile(dest, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            for lo in range(0, len(order), chunksize):
+                writer.write_table(table.take(order[lo:lo + chunksize]))
+
+
+def _read_arrow(path):
+    with pa.memory_map(path, "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def load_cached_csv(fileobj, cache_dir=None):
+    """Load a CSV through the columnar cache, converting it on first sight.
+
+    Returns a normalized, compact frame with a parsed ``datetime`` column,
+    sorted by time.
+    """
+    dest = cache_path(file_digest(fileobj), cache_dir)
+    if not os.path.exists(dest):
+        convert_csv(fileobj, dest)
+    # Integer columns with gaps come back as nullable integers rather than lossy floats
+    return compact(_read_arrow(dest).to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get))
@@ -0,0 +1,311 @@
+"""Incremental OpenWeather air-pollution history fetcher.
+
+History is requested in fixed windows on a grid aligned to the Unix epoch,
+so the same window always has the same key regardless of the date range the
+user asks for. Each completed window is written atomically to a local chunk
+store keyed by (lat, lon, window); later requests only fetch windows that are
+missing, and an interrupted backfill resumes from the first gap.
+
+Missing windows are downloaded concurrently over one pooled session. Shared
+token buckets keep the request rate inside the free-tier quota, so a long
+backfill is bounded by the quota rather than by round-trip latency. The
+daily quota is counted in a call log on disk next to the chunk store, so
+restarts, other session processes and the CLI all draw on the same 1,000
+calls. Windows served from the store cost no calls.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import CACHE_DIR
+
+API_URL = os.environ.get(
+    "OPENWEATHER_API_URL", "https://api.openweathermap.org/data/2.5/air_pollution/history"
+)
+CHUNK_DAYS = 180
+CHUNK_SECONDS = CHUNK_DAYS * 86400
+MAX_WORKERS = 4
+
+FetchResult = namedtuple("FetchResult", ["entries", "failed", "timings"])
+
+
+class OpenWeatherError(Exception):
+    """A window could not be fetched from the API."""
+
+
+class AuthError(OpenWeatherError):
+    """The API rejected the key (HTTP 401)."""
+
+
+class QuotaExhausted(OpenWeatherError):
+    """No request token became available within the allowed wait."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``capacity`` calls per ``period`` seconds.
+
+    ``pause`` holds every caller back for a while, which is how a 429 seen
+    by one worker slows all of them down.
+    """
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, max_wait=None):
+        """Take one token, sleeping as needed; False if that would exceed ``max_wait``."""
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = max(self.blocked_until - now, 0.0)
+                if wait == 0.0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class CallLog:
+    """Sliding-window limit of ``capacity`` calls per ``period`` seconds, shared through a file.
+
+    Call times (Unix seconds) are kept in a JSON file, written atomically
+    like the chunks. The file seeds the log at startup and is re-read before
+    every call, so every process on the machine sees the others' calls. Two
+    processes calling at the same instant may each miss the other's latest
+    call: this is a budget, not a lock. Same interface as ``TokenBucket``.
+    """
+
+    def __init__(self, capacity, period, path):
+        self.capacity = capacity
+        self.period = period
+        self.path = path
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+        self.calls = self._recent(time.time())
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                return [float(t) for t in json.load(fh)]
+        except (OSError, ValueError, TypeError):
+            return []
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(self.calls, fh)
+        os.replace(tmp, self.path)
+
+    def _recent(self, now):
+        calls = set(self._read()) | set(getattr(self, "calls", ()))
+        return sorted(t for t in calls if t > now - self.period)
+
+    def used(self):
+        """Calls made in the last ``period`` seconds, by any process."""
+        with self.lock:
+            self.calls = self._recent(time.time())
+            return len(self.calls)
+
+    def acquire(self, max_wait=None):
+        """Record one call, sleeping as needed; False if that would exceed ``max_wait``."""
+        deadline = None if max_wait is None else time.time() + max_wait
+        while True:
+            with self.lock:
+                now = time.time()
+                self.calls = self._recent(now)
+                wait = max(self.blocked_until - now, 0.0)
+                if wait == 0.0:
+                    if len(self.calls) < self.capacity:
+                        self.calls.append(now)
+                        self._write()
+                        return True
+                    wait = self.calls[0] + self.period - now
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.time() + seconds)
+
+
+# Free tier: 60 calls/minute, shared by every fetch in the process, and 1,000 calls/day,
+# shared by every process using this cache directory
+MINUTE_LIMIT = TokenBucket(60, 60)
+DAILY_LIMIT = CallLog(1000, 86400, os.path.join(CACHE_DIR, "openweather", "calls.json"))
+
+
+def backoff(attempt, base=1.0, cap=30.0):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def make_session(pool_size=MAX_WORKERS):
+    """A keep-alive session whose connection pool fits every worker."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def windows(start_ts, end_ts):
+    """Grid-aligned ``(start, end)`` windows, end exclusive, overlapping ``[start_ts, end_ts]``."""
+    first = (start_ts // CHUNK_SECONDS) * CHUNK_SECONDS
+    return [(ws, ws + CHUNK_SECONDS) for ws in range(first, end_ts + 1, CHUNK_SECONDS)]
+
+
+class ChunkStore:
+    """Completed API windows for one location, one JSON file per window."""
+
+    def __init__(self, lat, lon, root=None):
+        self.root = os.path.join(root or CACHE_DIR, "openweather", f"{lat:.4f}_{lon:.4f}")
+
+    def path(self, window):
+        return os.path.join(self.root, f"{window[0]}_{window[1]}.json")
+
+    def has(self, window):
+        return os.path.exists(self.path(window))
+
+    def load(self, window):
+        with open(self.path(window), "r", encoding="utf-8") as fh:
+            return json.load(fh)
+
+    def save(self, window, entries):
+        """Write a window's entries via a temp file and rename, so readers never see partial chunks."""
+        os.makedirs(self.root, exist_ok=True)
+        dest = self.path(window)
+        tmp = f"{dest}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(entries, fh, separators=(",", ":"))
+        os.replace(tmp, dest)
+
+    def missing(self, wanted):
+        return [w for w in wanted if not self.has(w)]
+
+
+def fetch_window(session, lat, lon, api_key, window, base_url=API_URL, attempts=3,
+                 notify=None, buckets=(MINUTE_LIMIT, DAILY_LIMIT), max_wait=60):
+    """Fetch one window's hourly entries, retrying timeouts and rate limits.
+
+    Returns the entries and the number of attempts it took.
+    """
+    params = {"lat": lat, "lon": lon, "start": window[0], "end": window[1] - 1, "appid": api_key}
+    for attempt in range(attempts):
+        for bucket in buckets:
+            if not bucket.acquire(max_wait):
+                raise QuotaExhausted(f"API quota exhausted before window starting {window[0]}")
+        try:
+            response = session.get(base_url, params=params, timeout=60)
+            response.raise_for_status()
+            entries = response.json().get("list", [])
+            return [e for e in entries if window[0] <= e["dt"] < window[1]], attempt + 1
+        except requests.exceptions.Timeout:
+            if notify:
+                notify(f"Timeout for window starting {window[0]}, retrying ({attempt + 1}/{attempts})")
+            time.sleep(backoff(attempt))
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code
+            if status == 401:
+                raise AuthError("Invalid API key or authentication error.") from e
+            if status != 429:
+                raise OpenWeatherError(f"API Error: {status}") from e
+            if notify:
+                notify("Rate limit exceeded. Waiting before retry...")
+            retry_after = e.response.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else backoff(attempt, base=5.0)
+            for bucket in buckets:
+                bucket.pause(delay)
+        except requests.exceptions.RequestException as e:
+            if notify:
+                notify(f"Connection error: {e}")
+            time.sleep(backoff(attempt))
+    raise OpenWeatherError(f"Failed to fetch window starting {window[0]} after {attempts} attempts")
+
+
+def fetch_history(lat, lon, api_key, start_ts, end_ts, store=None, base_url=API_URL,
+                  session=None, now=None, notify=None, max_workers=MAX_WORKERS,
+                  buckets=(MINUTE_LIMIT, DAILY_LIMIT)):
+    """Hourly entries in ``[start_ts, end_ts]``, fetching only windows not already stored.
+
+    Missing windows are downloaded by a thread pool. Windows that are still
+    open (ending after ``now``) are fetched but not stored, since the API
+    will keep adding hours to them. ``notify`` is only ever called from the
+    calling thread. Returns a ``FetchResult`` of entries, failed windows, and
+    per-window timings.
+    """
+    store = store or ChunkStore(lat, lon)
+    session = session or make_session(max_workers)
+    now = int(time.time()) if now is None else now
+
+    wanted = windows(start_ts, end_ts)
+    chunks, timings, failed, messages = {}, [], [], []
+    # Stored windows never reach fetch_window, so they draw nothing from the buckets
+    for window in wanted:
+        if store.has(window):
+            chunks[window] = store.load(window)
+            timings.append({"window": window, "seconds": 0.0, "attempts": 0,
+                            "entries": len(chunks[window]), "cached": True})
+
+    def download(window):
+        started = time.perf_counter()
+        chunk, attempts = fetch_window(session, lat, lon, api_key, window, base_url,
+                                       notify=messages.append, buckets=buckets)
+        if window[1] <= now:
+            store.save(window, chunk)
+        return chunk, {"window": window, "seconds": time.perf_counter() - started,
+                       "attempts": attempts, "entries": len(chunk), "cached": False}
+
+    pending = [w for w in wanted if w not in chunks]
+    if pending:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(download, w): w for w in pending}
+            try:
+                for future in as_completed(futures):
+                    window = futures[future]
+                    try:
+                        chunks[window], timing = future.result()
+                        timings.append(timing)
+                    except AuthError:
+                        raise
+                    except OpenWeatherError as e:
+                        messages.append(str(e))
+                        failed.append(window)
+                    while notify and messages:
+                        notify(messages.pop(0))
+            except AuthError:
+                for f in futures:
+                    f.cancel()
+                raise
+
+    entries = []
+    for window in wanted:
+        entries.extend(e for e in chunks.get(window, ()) if start_ts <= e["dt"] <= end_ts)
+    timings.sort(key=lambda t: t["window"])
+    return FetchResult(entries, sorted(failed), timings)
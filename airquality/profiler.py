@@ -0,0 +1,147 @@
+"""Named timing spans for one dashboard rerun or one benchmark run.
+
+A span records wall time, peak traced memory, rows in and out, and the bytes
+of any figures shipped while it was open. Spans nest: a cache miss inside a
+pipeline step shows up as children of that step. ``section`` opens a
+top-level span that stays open until the next section starts, so a long
+script can be split into chart blocks without indenting them.
+
+Peak memory comes from ``tracemalloc`` (which sees NumPy and pandas buffers)
+and is only measured while tracing is on, since tracing slows allocation
+down noticeably. A span's peak includes the peaks of its children.
+
+Records export as a table, as JSON lines through ``logging``, or as a Chrome
+trace (``chrome://tracing`` or https://ui.perfetto.dev).
+"""
+
+import json
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ["span", "depth", "seconds", "peak_bytes", "rows_in", "rows_out", "payload_bytes"]
+
+
+class Span:
+    __slots__ = ("name", "depth", "start", "seconds", "peak_bytes", "rows_in", "rows_out",
+                 "payload_bytes", "_base", "_child_peak")
+
+    def __init__(self, name, depth, rows_in=None):
+        self.name = name
+        self.depth = depth
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.payload_bytes = None
+        self.seconds = None
+        self.peak_bytes = None
+        self._child_peak = 0
+
+    def as_dict(self):
+        return {c: getattr(self, "name" if c == "span" else c) for c in COLUMNS}
+
+
+class Profiler:
+    """Collects spans; a disabled profiler records nothing and costs next to nothing."""
+
+    def __init__(self, enabled=True, memory=None):
+        self.enabled = enabled
+        self.memory = enabled and (tracemalloc.is_tracing() if memory is None else memory)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.spans = []
+        self._stack = []
+        self._section = None
+        self._origin = time.perf_counter()
+
+    def _open(self, name, rows_in=None):
+        span = Span(name, len(self._stack), rows_in)
+        self.spans.append(span)
+        self._stack.append(span)
+        if self.memory:
+            tracemalloc.reset_peak()
+            span._base = tracemalloc.get_traced_memory()[0]
+        span.start = time.perf_counter()
+        return span
+
+    def _close(self, span):
+        span.seconds = time.perf_counter() - span.start
+        self._stack.remove(span)
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # Children reset the tracer's peak, so their peaks are carried up explicitly
+            top = max(peak, span._child_peak)
+            span.peak_bytes = max(top - span._base, 0)
+            if self._stack:
+                parent = self._stack[-1]
+                parent._child_peak = max(parent._child_peak, top)
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def span(self, name, rows_in=None):
+        """Time the enclosed block as ``name``."""
+        if not self.enabled:
+            yield None
+            return
+        span = self._open(name, rows_in)
+        try:
+            yield span
+        finally:
+            self._close(span)
+
+    def section(self, name, rows_in=None):
+        """End the open section (if any) and start a new top-level one."""
+        self.end_section()
+        if self.enabled:
+            self._section = self._open(name, rows_in)
+
+    def end_section(self):
+        if self._section is not None:
+            # Spans left open inside the section end with it
+            while self._stack and self._stack[-1] is not self._section:
+                self._close(self._stack[-1])
+            self._close(self._section)
+            self._section = None
+
+    def note(self, rows_out=None, payload_bytes=None):
+        """Set rows out and add figure bytes on the innermost open span."""
+        if not self._stack:
+            return
+        span = self._stack[-1]
+        if rows_out is not None:
+            span.rows_out = int(rows_out)
+        if payload_bytes is not None:
+            span.payload_bytes = (span.payload_bytes or 0) + int(payload_bytes)
+
+    def records(self):
+        """Finished spans in start order, as dicts."""
+        return [s.as_dict() for s in self.spans if s.seconds is not None]
+
+    def table(self):
+        return pd.DataFrame(self.records(), columns=COLUMNS)
+
+    def chrome_trace(self, process="dashboard"):
+        """The spans as Chrome trace events (complete events, microseconds)."""
+        pid = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": process}}]
+        for s in self.spans:
+            if s.seconds is None:
+                continue
+            args = {k: v for k, v in s.as_dict().items() if k not in ("span", "depth", "seconds") and v is not None}
+            events.append({"name": s.name, "ph": "X", "pid": pid, "tid": 0,
+                           "ts": round((s.start - self._origin) * 1e6, 1),
+                           "dur": round(s.seconds * 1e6, 1), "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def json_lines(self, **context):
+        """One JSON object per span, with ``context`` fields (e.g. a rerun id) on each."""
+        return "\n".join(json.dumps({**context, **r}) for r in self.records())
+
+    def log(self, level=logging.INFO, **context):
+        for line in self.json_lines(**context).splitlines():
+            logger.log(level, line)
@@ -0,0 +1,224 @@
+"""Chart aggregations behind one interface, in memory or out of core.
+
+Every chart aggregate the dashboard needs is a grouped mean over local
+calendar fields (month, year, weekday x hour) or a per-column summary
+(moments, quartiles, completeness) for a date range. ``RollupQueries``
+answers them from the in-memory rollups; ``ParquetQueries`` pushes the same
+queries down to DuckDB or Polars over a Parquet file, so only the aggregated
+rows are ever materialized and the dataset itself never has to fit in
+memory.
+
+Parquet files store ``datetime`` in UTC. Range bounds are naive local
+wall-clock times, converted to UTC once so the engines can prune row groups
+by their statistics; calendar fields are derived in the display timezone.
+
+DuckDB and Polars are optional; ``available_engines`` lists the installed
+ones.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from . import CACHE_DIR
+from .rollups import describe as describe_rollups, mean as rollup_mean, merge_stats
+from .timeindex import time_slice
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+ENGINES = ("duckdb", "polars")
+FIELDS = ("year", "month", "weekday", "hour")
+QUARTILES = (0.25, 0.5, 0.75)
+SUMMARY_COLUMNS = ["count", "mean", "std", "min", "25%", "50%", "75%", "max", "rows"]
+
+
+def available_engines():
+    """Installed out-of-core engines, in order of preference."""
+    return [name for name, module in zip(ENGINES, (duckdb, pl)) if module is not None]
+
+
+def parquet_path(key, root=None):
+    digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:24]
+    return os.path.join(root or CACHE_DIR, "parquet", f"{digest}.parquet")
+
+
+def write_parquet(df, dest, row_group_size=1_000_000):
+    """Write a time-sorted frame to Parquet with UTC timestamps (atomic, skipped if present).
+
+    Derived local calendar columns are left out; they depend on the display
+    timezone and the engines compute them per query.
+    """
+    if os.path.exists(dest):
+        return dest
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    times = df["datetime"]
+    times = times.dt.tz_convert("UTC") if times.dt.tz is not None else times.dt.tz_localize("UTC")
+    columns = [c for c in df.columns if c != "datetime" and not c.startswith("local_")]
+    frame = pd.concat([times.rename("datetime"), df[columns]], axis=1)
+    # NaN readings become Parquet nulls, which both engines skip in aggregates
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    pq.write_table(table, tmp, row_group_size=row_group_size)
+    os.replace(tmp, dest)
+    return dest
+
+
+def _utc_bound(value, tz):
+    ts = pd.Timestamp(value)
+    if ts.tz is None:
+        ts = ts.tz_localize(tz or "UTC", ambiguous=True, nonexistent="shift_forward")
+    return ts.tz_convert("UTC")
+
+
+def _summary(stats, quartiles):
+    out = stats.join(quartiles)
+    return out.reindex(columns=SUMMARY_COLUMNS)
+
+
+class RollupQueries:
+    """The in-memory path: rollups for means and moments, the sorted frame for quartiles."""
+
+    engine = "pandas"
+
+    def __init__(self, rollups, df):
+        self.rollups = rollups
+        self.df = df
+
+    def grouped_means(self, column, by, start=None, end=None):
+        """Mean of ``column`` grouped by calendar ``by`` fields over ``[start, end)``."""
+        by = list(by)
+        if set(by) <= {"year", "month"}:
+            rows = self.rollups.select(start, end, coarsest="month")
+            rows = rows[rows["rows"]["all"] > 0]
+            keys = [getattr(rows.index, field).rename(field) for field in by]
+            stats = merge_stats(rows, keys)
+        elif set(by) <= {"weekday", "hour"}:
+            profile = self.rollups.hour_profile(start, end)
+            stats = merge_stats(profile, by) if by != ["weekday", "hour"] else profile
+        else:
+            raise ValueError(f"Unsupported grouping: {by}")
+        return rollup_mean(stats)[column].rename(column)
+
+    def describe(self, columns, start=None, end=None):
+        """Count, moments, quartiles, extremes and row count per column over ``[start, end)``."""
+        stats = describe_rollups(self.rollups.select(start, end)).reindex(columns)
+        quartiles = time_slice(self.df, start, end)[columns].quantile(list(QUARTILES)).T
+        quartiles.columns = ["25%", "50%", "75%"]
+        return _summary(stats, quartiles)
+
+
+class ParquetQueries:
+    """The same aggregates pushed down to DuckDB or Polars over a Parquet file."""
+
+    def __init__(self, path, tz=None, engine="duckdb"):
+        if engine not in available_engines():
+            raise ValueError(f"Query engine '{engine}' is not installed")
+        self.path = path
+        self.tz = str(tz) if tz is not None else "UTC"
+        self.engine = engine
+        if engine == "duckdb":
+            self._con = duckdb.connect()
+
+    def _range(self, start, end):
+        return (None if start is None else _utc_bound(start, self.tz),
+                None if end is None else _utc_bound(end, self.tz))
+
+    # ---- DuckDB ----
+
+    def _sql(self, select, start, end, group=""):
+        lo, hi = self._range(start, end)
+        where = ["TRUE"]
+        params = {"path": self.path, "tz": self.tz}
+        if lo is not None:
+            where.append("datetime >= $lo")
+            params["lo"] = lo.to_pydatetime()
+        if hi is not None:
+            where.append("datetime < $hi")
+            params["hi"] = hi.to_pydatetime()
+        sql = (
+            "WITH src AS (SELECT *, timezone($tz, datetime) AS local "
+            f"FROM read_parquet($path) WHERE {' AND '.join(where)}) "
+            f"SELECT {select} FROM src {group}"
+        )
+        # A cursor per query keeps concurrent reruns off each other's connection state
+        return self._con.cursor().execute(sql, params).df()
+
+    # ---- Polars ----
+
+    def _scan(self, start, end):
+        lo, hi = self._range(start, end)
+        frame = pl.scan_parquet(self.path)
+        if lo is not None:
+            frame = frame.filter(pl.col("datetime") >= lo.to_pydatetime())
+        if hi is not None:
+            frame = frame.filter(pl.col("datetime") < hi.to_pydatetime())
+        local = pl.col("datetime").dt.convert_time_zone(self.tz).dt.replace_time_zone(None)
+        return frame, local
+
+    def grouped_means(self, column, by, start=None, end=None):
+        """Mean of ``column`` grouped by calendar ``by`` fields over ``[start, end)``."""
+        by = list(by)
+        if not set(by) <= set(FIELDS):
+            raise ValueError(f"Unsupported grouping: {by}")
+        if self.engine == "duckdb":
+            fields = {"year": "year(local)", "month": "month(local)",
+                      "weekday": "isodow(local) - 1", "hour": "hour(local)"}
+            keys = ", ".join(f"{fields[f]} AS {f}" for f in by)
+            # Positional keys, since the source may carry its own year/month/hour columns
+            positions = ", ".join(str(i + 1) for i in range(len(by)))
+            result = self._sql(f'{keys}, avg("{column}") AS value', start, end,
+                               f"GROUP BY {positions} ORDER BY {positions}")
+        else:
+            frame, local = self._scan(start, end)
+            fields = {"year": local.dt.year(), "month": local.dt.month(),
+                      "weekday": local.dt.weekday() - 1, "hour": local.dt.hour()}
+            result = (
+                frame.group_by([fields[f].alias(f) for f in by])
+                .agg(pl.col(column).cast(pl.Float64).mean().alias("value"))
+                .sort(by)
+                .collect()
+                .to_pandas()
+            )
+        result[by] = result[by].astype("int64")
+        return result.set_index(by)["value"].astype("float64").rename(column)
+
+    def describe(self, columns, start=None, end=None):
+        """Count, moments, quartiles, extremes and row count per column over ``[start, end)``."""
+        stats = {}
+        if self.engine == "duckdb":
+            parts = ["count(*) AS rows"]
+            for i, c in enumerate(columns):
+                parts += [f'count("{c}") AS n{i}', f'avg("{c}") AS mean{i}', f'stddev_samp("{c}") AS std{i}',
+                          f'min("{c}") AS min{i}', f'max("{c}") AS max{i}',
+                          f'quantile_cont("{c}", {list(QUARTILES)}) AS q{i}']
+            row = self._sql(", ".join(parts), start, end).iloc[0]
+        else:
+            frame, _ = self._scan(start, end)
+            exprs = [pl.len().alias("rows")]
+            for i, c in enumerate(columns):
+                col = pl.col(c).cast(pl.Float64)
+                exprs += [col.count().alias(f"n{i}"), col.mean().alias(f"mean{i}"), col.std().alias(f"std{i}"),
+                          col.min().alias(f"min{i}"), col.max().alias(f"max{i}")]
+                exprs += [col.quantile(q, interpolation="linear").alias(f"q{i}_{j}") for j, q in enumerate(QUARTILES)]
+            row = frame.select(exprs).collect().to_pandas().iloc[0]
+        for i, c in enumerate(columns):
+            if self.engine == "duckdb":
+                quartiles = row[f"q{i}"] if row[f"n{i}"] else [np.nan] * len(QUARTILES)
+            else:
+                quartiles = [row[f"q{i}_{j}"] for j in range(len(QUARTILES))]
+            stats[c] = [row[f"n{i}"], row[f"mean{i}"], row[f"std{i}"], row[f"min{i}"], *quartiles,
+                        row[f"max{i}"], row["rows"]]
+        out = pd.DataFrame.from_dict(stats, orient="index", columns=SUMMARY_COLUMNS)
+        return out.astype("float64")
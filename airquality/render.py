@@ -0,0 +1,46 @@
+"""Rendering backend selection and payload accounting for Plotly charts.
+
+SVG traces stall the browser past a few tens of thousands of points, and
+every point is serialized into the Streamlit message. Above configurable
+thresholds a chart switches to WebGL (``Scattergl``), and point clouds can
+fall back to a density heatmap binned on the server, whose payload depends
+only on the bin count.
+"""
+
+import numpy as np
+
+BACKENDS = ("Auto", "SVG", "WebGL", "Density")
+WEBGL_ABOVE = 20_000
+DENSITY_ABOVE = 200_000
+
+
+def choose_backend(n_points, preference="Auto", webgl_above=WEBGL_ABOVE,
+                   density_above=DENSITY_ABOVE, allow_density=True):
+    """Return ``"svg"``, ``"webgl"`` or ``"density"`` for a chart of ``n_points``."""
+    if preference != "Auto":
+        choice = preference.lower()
+        return "webgl" if choice == "density" and not allow_density else choice
+    if allow_density and n_points > density_above:
+        return "density"
+    if n_points > webgl_above:
+        return "webgl"
+    return "svg"
+
+
+def binned_density(x, y, bins=120):
+    """2-D histogram of a point cloud: bin centers on each axis and counts (NaN where empty).
+
+    Counts are float32 and indexed ``[y_bin, x_bin]`` to match ``go.Heatmap``'s ``z``.
+    """
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    keep = np.isfinite(x) & np.isfinite(y)
+    counts, x_edges, y_edges = np.histogram2d(x[keep], y[keep], bins=bins)
+    counts = counts.T.astype("float32")
+    counts[counts == 0] = np.nan
+    return (x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2, counts
+
+
+def payload_bytes(fig):
+    """Size of the figure JSON that Streamlit ships to the browser."""
+    return len(fig.to_json().encode("utf-8"))
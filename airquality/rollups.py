@@ -0,0 +1,206 @@
+"""Pre-aggregated pollutant rollups.
+
+Hourly records are reduced once per dataset to mergeable statistics
+(sum, count, min, max, sum of squares, and a raw row count) at hour, day,
+month and year granularity, plus a month x weekday x hour profile. A
+date-range query is answered by stitching together the coarsest rows that
+fit inside the range and finer rows at its edges, so charts never rescan
+raw hours after a filter change.
+
+Periods are keyed by local wall-clock time, so the store must be built from
+a frame that is already in the display timezone.
+"""
+
+import numpy as np
+import pandas as pd
+
+LEVELS = ("year", "month", "day", "hour")
+HOUR_NS = 3_600_000_000_000
+PERIOD_FREQ = {"year": "Y", "month": "M", "day": "D", "hour": "h"}
+
+
+def _wall_clock(datetimes):
+    """Naive local timestamps, so periods follow the display timezone."""
+    if datetimes.dt.tz is not None:
+        return datetimes.dt.tz_localize(None)
+    return datetimes
+
+
+def _reduce(grouped_sums, grouped_mins, grouped_maxs):
+    return pd.concat({
+        "sum": grouped_sums["sum"],
+        "count": grouped_sums["count"],
+        "sumsq": grouped_sums["sumsq"],
+        "min": grouped_mins,
+        "max": grouped_maxs,
+        "rows": grouped_sums["rows"],
+    }, axis=1)
+
+
+def merge_stats(stats, by):
+    """Merge rollup rows that share a key into one row per key."""
+    additive = stats[["sum", "count", "sumsq", "rows"]].groupby(by, sort=True).sum()
+    return _reduce(
+        additive,
+        stats["min"].groupby(by, sort=True).min(),
+        stats["max"].groupby(by, sort=True).max(),
+    )
+
+
+def _floor(ts, level):
+    return ts.to_period(PERIOD_FREQ[level]).start_time
+
+
+def _ceil(ts, level):
+    floor = _floor(ts, level)
+    return floor if floor == ts else (ts.to_period(PERIOD_FREQ[level]) + 1).start_time
+
+
+def mean(stats):
+    """Per-pollutant mean of each rollup row (NaN where nothing was measured)."""
+    return stats["sum"] / stats["count"].replace(0, np.nan)
+
+
+def describe(stats, ddof=1):
+    """Collapse rollup rows into one summary row per pollutant."""
+    total = stats[["sum", "count", "sumsq", "rows"]].sum()
+    count = total["count"]
+    mu = total["sum"] / count.replace(0, np.nan)
+    var = (total["sumsq"] - count * mu ** 2) / (count - ddof).where(count > ddof)
+    return pd.DataFrame({
+        "count": count,
+        "mean": mu,
+        "std": np.sqrt(var.clip(lower=0)),
+        "min": stats["min"].min(),
+        "max": stats["max"].max(),
+        "rows": total["rows"].iloc[0] if len(total["rows"]) else 0,
+    })
+
+
+class RollupStore:
+    """Mergeable per-pollutant statistics at several time granularities."""
+
+    def __init__(self, levels, profile, columns, tz=None):
+        self.levels = levels
+        self.profile = profile
+        self.columns = list(columns)
+        self.tz = tz
+
+    @classmethod
+    def from_frame(cls, df, columns, wall=None):
+        """Build every granularity from a frame with a ``datetime`` column.
+
+        ``wall`` optionally gives the rows' local wall-clock times as int64
+        nanoseconds (see ``LocalCalendar.wall``) so they aren't derived again.
+        """
+        columns = [c for c in columns if c in df.columns]
+        if wall is None:
+            hours = _wall_clock(df["datetime"]).dt.floor("h").to_numpy()
+        else:
+            hours = (wall // HOUR_NS * HOUR_NS).view("datetime64[ns]")
+        values = df[columns].apply(pd.to_numeric, errors="coerce").astype("float64")
+        values.index = hours
+        grouped = values.groupby(level=0, sort=True)
+        hourly = pd.concat({
+            "sum": grouped.sum(),
+            "count": grouped.count(),
+            "sumsq": (values ** 2).groupby(level=0, sort=True).sum(),
+            "min": grouped.min(),
+            "max": grouped.max(),
+            "rows": grouped.size().to_frame("all"),
+        }, axis=1)
+        hourly.index = pd.DatetimeIndex(hourly.index, name="period")
+
+        levels = {"hour": hourly}
+        for finer, coarser in (("hour", "day"), ("day", "month"), ("month", "year")):
+            src = levels[finer]
+            key = src.index.to_period(PERIOD_FREQ[coarser]).start_time
+            levels[coarser] = merge_stats(src, pd.Index(key, name="period"))
+
+        idx = hourly.index
+        profile_key = [
+            pd.Index(idx.to_period("M").start_time, name="period"),
+            pd.Index(idx.dayofweek, name="weekday"),
+            pd.Index(idx.hour, name="hour"),
+        ]
+        profile = merge_stats(hourly, profile_key)
+        return cls(levels, profile, columns, tz=df["datetime"].dt.tz)
+
+    def localize(self, index):
+        """Attach the store's timezone to wall-clock period starts for display."""
+        if self.tz is None:
+            return index
+        return index.tz_localize(
+            self.tz, ambiguous=np.ones(len(index), dtype=bool), nonexistent="shift_forward"
+        )
+
+    def _bounds(self, start, end):
+        first = self.levels["hour"].index
+        if len(first) == 0:
+            return None, None
+        start = first[0] if start is None else pd.Timestamp(start)
+        end = first[-1] + pd.Timedelta(hours=1) if end is None else pd.Timestamp(end)
+        return start, end
+
+    def _slice(self, level, start, end):
+        frame = self.levels[level]
+        lo, hi = frame.index.searchsorted([start, end])
+        return frame.iloc[lo:hi]
+
+    def _cover(self, start, end, levels):
+        if start >= end or not levels:
+            return []
+        level, rest = levels[0], levels[1:]
+        lo, hi = _ceil(start, level), _floor(end, level)
+        if lo >= hi:
+            return self._cover(start, end, rest)
+        return self._cover(start, lo, rest) + [self._slice(level, lo, hi)] + self._cover(hi, end, rest)
+
+    def select(self, start=None, end=None, coarsest="year"):
+        """Rollup rows exactly covering ``[start, end)``.
+
+        No returned row is coarser than ``coarsest``, so callers can group the
+        result by any calendar field at or above that granularity.
+        """
+        start, end = self._bounds(start, end)
+        if start is None:
+            return self.levels["hour"].iloc[:0]
+        parts = self._cover(start, end, LEVELS[LEVELS.index(coarsest):])
+        if not parts:
+            return self.levels["hour"].iloc[:0]
+        return pd.concat(parts).sort_index()
+
+    def rolling_mean(self, column, window="24h", start=None, end=None):
+        """Time-based rolling mean of ``column`` at each hour with a reading in ``[start, end)``.
+
+        The window covers ``window`` of clock time ending at each hour, not a
+        number of rows, so it never reaches across a gap into older readings.
+        Each value is the window's summed readings over its reading count.
+        """
+        hourly = self.select(start, end, coarsest="hour")
+        stats = pd.DataFrame({"sum": hourly["sum"][column], "count": hourly["count"][column]})
+        rolled = stats.rolling(window).sum()
+        present = (stats["count"] > 0).to_numpy()
+        return (rolled["sum"] / rolled["count"])[present].rename(column)
+
+    def hour_profile(self, start=None, end=None):
+        """Statistics by (weekday, hour) over ``[start, end)``."""
+        start, end = self._bounds(start, end)
+        if start is None:
+            return merge_stats(self.profile.iloc[:0], ["weekday", "hour"])
+        lo, hi = _ceil(start, "month"), _floor(end, "month")
+        parts = []
+        if lo < hi:
+            periods = self.profile.index.get_level_values("period")
+            inner = self.profile[(periods >= lo) & (periods < hi)]
+            parts.append(inner.droplevel("period"))
+            edges = [(start, lo), (hi, end)]
+        else:
+            edges = [(start, end)]
+        for edge_start, edge_end in edges:
+            rows = self._slice("hour", edge_start, edge_end)
+            rows = rows.set_axis(pd.MultiIndex.from_arrays(
+                [rows.index.dayofweek, rows.index.hour], names=["weekday", "hour"]
+            ))
+            parts.append(rows)
+        return merge_stats(pd.concat(parts), ["weekday", "hour"])
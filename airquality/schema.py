@@ -0,0 +1,99 @@
+"""Canonical column layout and compact dtypes for the merged frame.
+
+Pollutant and weather readings are stored as float32, calendar fields as
+small integers, and repeated labels (source, station, wind direction) as
+categoricals, so no column of the resident frame holds Python objects.
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+POLLUTANTS = ("pm2.5", "pm10", "no2", "so2", "co", "o3")
+
+CANONICAL = {
+    "datetime": "datetime64[ns]",
+    "aqi": "float32",
+    **{p: "float32" for p in POLLUTANTS},
+    # Meteorology from the UCI Beijing files
+    "temperature": "float32", "pres": "float32", "dewp": "float32", "rain": "float32",
+    "wspm": "float32", "iws": "float32", "is": "float32", "ir": "float32",
+    # Calendar fields the CSVs ship alongside the timestamp
+    "year": "int16", "month": "int8", "day": "int8", "hour": "int8", "no": "int32",
+    # Repeated labels
+    "source": "category", "station": "category", "wd": "category", "cbwd": "category",
+}
+
+
+def _compact_column(col, dtype):
+    if dtype == "category":
+        return col.astype("category")
+    if dtype.startswith("int"):
+        values = pd.to_numeric(col, errors="coerce")
+        if values.isna().any():
+            # float64 holds every integer up to 2**53 exactly; float32 only up to 2**24
+            return values.astype("float64")
+        return values.astype(dtype)
+    if dtype.startswith("float"):
+        return pd.to_numeric(col, errors="coerce").astype(dtype)
+    return col
+
+
+def _guess_dtype(col):
+    """Compact dtype for a column the schema does not declare."""
+    if pd.api.types.is_datetime64_any_dtype(col) or isinstance(col.dtype, pd.CategoricalDtype):
+        return None
+    if pd.api.types.is_bool_dtype(col):
+        return None
+    if pd.api.types.is_numeric_dtype(col):
+        return "float32" if pd.api.types.is_float_dtype(col) else None
+    return "category"
+
+
+def compact(df):
+    """Downcast ``df`` to the canonical dtypes; undeclared columns get a best guess.
+
+    Columns already in their target dtype are shared with ``df``, not copied.
+    """
+    out = df.copy(deep=False)
+    for name in out.columns:
+        if name not in CANONICAL and pd.api.types.is_integer_dtype(out[name]):
+            values = out[name]
+            if not values.hasnans:
+                values = values.astype("int64")
+            out[name] = pd.to_numeric(values, downcast="integer")
+            continue
+        dtype = CANONICAL.get(name) or _guess_dtype(out[name])
+        if dtype is None or dtype == "datetime64[ns]" or out[name].dtype == dtype:
+            continue
+        out[name] = _compact_column(out[name], dtype)
+    return out
+
+
+def memory_bytes(df):
+    """Resident size of ``df`` including string payloads."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def wide_bytes(df):
+    """Size ``df`` would take with pandas' defaults (float64/int64 and object strings)."""
+    total = int(df.index.memory_usage(deep=True))
+    for name in df.columns:
+        col = df[name]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            counts = col.value_counts(sort=False)
+            sizes = np.array([sys.getsizeof(str(c)) for c in counts.index], dtype="int64")
+            total += 8 * len(col) + int((counts.to_numpy() * sizes).sum())
+        elif pd.api.types.is_numeric_dtype(col) or pd.api.types.is_datetime64_any_dtype(col):
+            total += 8 * len(col)
+        else:
+            total += int(col.memory_usage(index=False, deep=True))
+    return total
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
@@ -0,0 +1,167 @@
+"""Station-aware storage for merged sources.
+
+Rows are keyed by (station, datetime). Each station's rows live in their own
+partition, sorted by time with at most one row per timestamp, so merging a
+source only touches the stations it reports for, and two sources whose time
+ranges don't overlap are concatenated without sorting. Rows that carry no
+station (the single-site historical file, the API feeds) belong to a default
+station named after the city.
+
+City-wide values are the hourly mean across stations, accumulated with
+``np.bincount`` on an hourly grid instead of a group-by over the combined
+frame.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .timeindex import sort_by_time
+
+CITY_WIDE = "City-wide mean"
+HOUR_NS = 3_600_000_000_000
+
+
+def _label(df, name):
+    out = df.copy(deep=False)
+    out["station"] = pd.Categorical.from_codes(np.zeros(len(df), dtype="int8"), categories=[name])
+    return out
+
+
+def split_stations(df, default_station):
+    """``{station: rows}`` for one source frame; rows without a station get ``default_station``."""
+    if "station" not in df.columns or df["station"].isna().all():
+        return {default_station: _label(df, default_station)}
+    station = df["station"].astype("category")
+    if station.isna().any():
+        if default_station not in station.cat.categories:
+            station = station.cat.add_categories([default_station])
+        station = station.fillna(default_station)
+    codes = station.cat.codes.to_numpy()
+    # Codes are small integers, so the stable argsort is a linear radix sort
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(station.cat.categories) + 1))
+    parts = {}
+    for i, name in enumerate(station.cat.categories):
+        if bounds[i] < bounds[i + 1]:
+            parts[str(name)] = _label(df.take(order[bounds[i]:bounds[i + 1]]), str(name))
+    return parts
+
+
+def _dedup(df):
+    """Keep the last row of each run of equal timestamps in a time-sorted frame."""
+    times = df["datetime"].to_numpy()
+    keep = np.append(times[1:] != times[:-1], True)
+    return df if keep.all() else df[keep]
+
+
+def _clean(df):
+    if df["datetime"].isna().any():
+        df = df[df["datetime"].notna()]
+    return _dedup(sort_by_time(df))
+
+
+def combine(parts):
+    """One station's partitions in priority order (last wins) merged into a single time-sorted frame."""
+    out = parts[0]
+    for part in parts[1:]:
+        if out.empty or part.empty:
+            out = part if out.empty else out
+            continue
+        if out["datetime"].iloc[-1] < part["datetime"].iloc[0]:
+            out = pd.concat([out, part], ignore_index=True)
+        elif part["datetime"].iloc[-1] < out["datetime"].iloc[0]:
+            out = pd.concat([part, out], ignore_index=True)
+        else:
+            # Overlapping ranges: order by time, then priority, and keep the last row per timestamp
+            both = pd.concat([out, part], ignore_index=True)
+            rank = np.repeat([0, 1], [len(out), len(part)])
+            order = np.lexsort((rank, both["datetime"].to_numpy()))
+            out = _dedup(both.take(order))
+    return out.reset_index(drop=True)
+
+
+class StationStore:
+    """Per-station, time-sorted partitions of every loaded source."""
+
+    def __init__(self, partitions, sources):
+        self.partitions = partitions
+        self.sources = sources
+        self._city = None
+
+    @classmethod
+    def from_frames(cls, frames, default_station):
+        """Merge source frames; when a station reports the same timestamp twice, later frames win."""
+        pieces, sources = {}, []
+        for frame in frames:
+            if "source" in frame.columns:
+                sources.extend(s for s in pd.unique(frame["source"].dropna()) if s not in sources)
+            for station, part in split_stations(frame, default_station).items():
+                pieces.setdefault(station, []).append(_clean(part))
+        partitions = {s: combine(parts) for s, parts in sorted(pieces.items())}
+        return cls({s: p for s, p in partitions.items() if not p.empty}, sources)
+
+    @property
+    def stations(self):
+        return list(self.partitions)
+
+    def __len__(self):
+        return sum(len(p) for p in self.partitions.values())
+
+    def frame(self, station):
+        return self.partitions[station]
+
+    @property
+    def default_view(self):
+        """The city-wide mean, or the station's own name when the file has only one."""
+        return self.stations[0] if len(self.partitions) == 1 else CITY_WIDE
+
+    def views(self):
+        """``{label: frame}`` for the city-wide mean and every station; a lone station is listed once."""
+        if len(self.partitions) == 1:
+            return dict(self.partitions)
+        return {CITY_WIDE: self.city_frame(), **self.partitions}
+
+    def city_frame(self):
+        """Hourly mean of every float column across stations; a lone station is returned as is."""
+        if len(self.partitions) == 1:
+            return next(iter(self.partitions.values()))
+        if self._city is None:
+            self._city = self._aggregate()
+        return self._city
+
+    def _aggregate(self):
+        parts = list(self.partitions.values())
+        times = [p["datetime"].to_numpy("datetime64[ns]").view("int64") for p in parts]
+        start = min(t[0] for t in times) // HOUR_NS * HOUR_NS
+        slot = np.concatenate([(t - start) // HOUR_NS for t in times])
+        size = int(slot.max()) + 1
+        hours = np.flatnonzero(np.bincount(slot, minlength=size))
+
+        frame = {"datetime": (start + hours * HOUR_NS).astype("datetime64[ns]")}
+        columns = []
+        for p in parts:
+            columns.extend(c for c in p.columns if pd.api.types.is_float_dtype(p[c]) and c not in columns)
+        for col in columns:
+            values = np.concatenate([
+                p[col].to_numpy("float64", na_value=np.nan) if col in p.columns else np.full(len(p), np.nan)
+                for p in parts
+            ])
+            present = ~np.isnan(values)
+            sums = np.bincount(slot, weights=np.where(present, values, 0.0), minlength=size)[hours]
+            counts = np.bincount(slot, weights=present, minlength=size)[hours]
+            with np.errstate(invalid="ignore"):
+                frame[col] = (sums / counts).astype("float32")
+
+        if self.sources:
+            # Each hour is attributed to the highest-priority source reporting it
+            ranks = np.concatenate([
+                pd.Categorical(p["source"], categories=self.sources).codes if "source" in p.columns
+                else np.full(len(p), -1, dtype="int8")
+                for p in parts
+            ])
+            best = np.full(size, -1, dtype="int16")
+            for rank in range(len(self.sources)):
+                best[np.bincount(slot[ranks == rank], minlength=size) > 0] = rank
+            frame["source"] = pd.Categorical.from_codes(best[hours], categories=self.sources)
+        frame["station"] = pd.Categorical.from_codes(np.zeros(len(hours), dtype="int8"), categories=[CITY_WIDE])
+        return pd.DataFrame(frame)
@@ -0,0 +1,56 @@
+"""Binary-search time slicing over a frame kept sorted by ``datetime``.
+
+Filtering with ``df['datetime'].dt.date`` builds a Python ``date`` per row on
+every rerun. Once the frame is sorted, any time window is two
+``searchsorted`` calls and an ``iloc`` slice, which shares the parent's
+column buffers instead of copying them.
+"""
+
+import pandas as pd
+
+
+def sort_by_time(df):
+    """Return ``df`` ordered by ``datetime`` (stable); a no-op if already sorted."""
+    if df.empty or df["datetime"].is_monotonic_increasing:
+        return df
+    return df.sort_values("datetime", kind="stable").reset_index(drop=True)
+
+
+def _bound(value, tz):
+    """Coerce a date/datetime bound onto the frame's timezone."""
+    ts = pd.Timestamp(value)
+    if tz is not None and ts.tz is None:
+        return ts.tz_localize(tz, ambiguous=True, nonexistent="shift_forward")
+    if tz is None and ts.tz is not None:
+        return ts.tz_convert("UTC").tz_localize(None)
+    return ts
+
+
+def time_slice(df, start=None, end=None):
+    """Rows with ``start <= datetime < end`` from a time-sorted frame.
+
+    Naive bounds are read as wall-clock times in the frame's timezone.
+    """
+    times = df["datetime"]
+    tz = times.dt.tz
+    lo = 0 if start is None else times.searchsorted(_bound(start, tz), side="left")
+    hi = len(df) if end is None else times.searchsorted(_bound(end, tz), side="left")
+    return df.iloc[lo:hi]
+
+
+def date_slice(df, first_day, last_day):
+    """Rows whose local calendar date falls in ``[first_day, last_day]``."""
+    end = pd.Timestamp(last_day) + pd.Timedelta(days=1)
+    return time_slice(df, pd.Timestamp(first_day), end)
+
+
+def convert_to_timezone(df, target_tz):
+    """Convert the ``datetime`` column to ``target_tz`` (naive values are taken as UTC)."""
+    if "datetime" not in df.columns or df["datetime"].isnull().all():
+        return df
+
+    df = df.copy(deep=False)  # only the datetime column is replaced
+    if df["datetime"].dt.tz is None:
+        df["datetime"] = df["datetime"].dt.tz_localize("UTC")
+    df["datetime"] = df["datetime"].dt.tz_convert(target_tz)
+    return df
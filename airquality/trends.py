@@ -0,0 +1,281 @@
+"""Long-term trends: seasonal decomposition, Theil-Sen slopes, Mann-Kendall tests.
+
+Trends are estimated from monthly (or daily) means, never from raw hours:
+15 years is 180 months per series, so every pairwise statistic stays small
+enough to vectorize across all pollutants and stations at once.
+
+Each series is decomposed additively into trend (a centred moving average
+over one seasonal cycle: 2x12 months or 365 days), seasonal (mean detrended
+value per calendar month or day of year) and residual. Slope and
+significance are computed on the deseasonalized series, so the winter
+heating peaks don't register as a trend:
+
+* the Theil-Sen slope is the median of all pairwise slopes, with Sen's
+  rank-based confidence interval;
+* the Mann-Kendall S statistic counts increasing minus decreasing pairs; its
+  normal approximation (with the tie correction) gives a two-sided p-value.
+
+Statistics for many stations can run in a process pool (``jobs``). Results
+are cached on disk under the SHA-256 of the period means they were computed
+from, so the same data never pays for the pairwise work twice.
+"""
+
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage, stats
+
+from . import CACHE_DIR
+from .features import DAY_NS, HOUR_NS, LocalCalendar
+from .rollups import merge_stats
+
+# Seasonal cycle length, in periods
+PERIODS = {"month": 12, "day": 365}
+# Pairwise slopes held in memory at once, across a batch of series
+MAX_PAIRS = 1 << 23
+TABLE_COLUMNS = ["Station", "Pollutant", "Periods", "First", "Last", "Mean", "Slope /yr", "Slope low",
+                 "Slope high", "Change %/yr", "Kendall S", "Z", "p-value", "Trend"]
+
+
+def _grid(first, size, freq):
+    """``size`` consecutive period starts from the one holding ``first``, and their lengths in hours."""
+    unit = "datetime64[M]" if freq == "month" else "datetime64[D]"
+    edges = (np.datetime64(first).astype(unit) + np.arange(size + 1)).astype("datetime64[ns]")
+    return pd.DatetimeIndex(edges[:-1]), np.diff(edges).astype("int64") / HOUR_NS
+
+
+def period_means(df, columns, freq="month", tz="UTC", min_coverage=0.5):
+    """Local monthly or daily means of ``columns`` on a gap-free grid of periods.
+
+    Returns ``(periods, values)``: period starts (naive local time) and a
+    ``(len(columns), n)`` array. Periods with less than ``min_coverage`` of
+    their hours measured are NaN.
+    """
+    columns = [c for c in columns if c in df.columns]
+    if df.empty or not columns:
+        return pd.DatetimeIndex([]), np.empty((len(columns), 0))
+    wall = LocalCalendar.from_times(df["datetime"]).wall(tz).view("datetime64[ns]")
+    if freq == "month":
+        keys = wall.astype("datetime64[M]").astype("int64")
+    else:
+        keys = wall.view("int64") // DAY_NS
+    keys = keys - keys.min()
+    size = int(keys.max()) + 1
+    periods, hours = _grid(wall.min(), size, freq)
+
+    values = np.full((len(columns), size), np.nan)
+    for i, name in enumerate(columns):
+        x = pd.to_numeric(df[name], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        ok = ~np.isnan(x)
+        counts = np.bincount(keys[ok], minlength=size)
+        sums = np.bincount(keys[ok], x[ok], minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values[i] = np.where(counts >= min_coverage * hours, sums / counts, np.nan)
+    return periods, values
+
+
+def rollup_means(rollups, columns, freq="month", start=None, end=None, min_coverage=0.5):
+    """``period_means`` for a view, from its ``RollupStore`` instead of the hourly rows."""
+    columns = [c for c in columns if c in rollups.columns]
+    rows = rollups.select(start, end, coarsest=freq)
+    if rows.empty or not columns:
+        return pd.DatetimeIndex([]), np.empty((len(columns), 0))
+    totals = merge_stats(rows, pd.Index(rows.index.to_period("M" if freq == "month" else "D").start_time, name="period"))
+    size = len(pd.period_range(totals.index[0], totals.index[-1], freq="M" if freq == "month" else "D"))
+    periods, hours = _grid(totals.index[0], size, freq)
+    totals = totals.reindex(periods)
+    counts = totals["count"][columns].to_numpy(dtype="float64").T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        values = totals["sum"][columns].to_numpy(dtype="float64").T / counts
+    values[~(counts >= min_coverage * hours)] = np.nan
+    return periods, values
+
+
+def _season(periods, freq):
+    if freq == "month":
+        return periods.month.to_numpy() - 1
+    return np.minimum(periods.dayofyear.to_numpy() - 1, PERIODS["day"] - 1)
+
+
+def decompose(values, periods, freq="month"):
+    """Additive decomposition of each row of ``values``: ``(trend, seasonal, resid)`` arrays.
+
+    The trend is NaN where less than half its window is measured (and over
+    the first and last half cycle).
+    """
+    period = PERIODS[freq]
+    values = np.atleast_2d(values)
+    if period % 2:
+        weights = np.full(period, 1.0 / period)
+    else:
+        weights = np.full(period + 1, 1.0 / period)
+        weights[[0, -1]] /= 2
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    weighted = ndimage.correlate1d(filled, weights, axis=1, mode="constant")
+    coverage = ndimage.correlate1d(present.astype("float64"), weights, axis=1, mode="constant")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        trend = weighted / coverage
+    half = len(weights) // 2
+    trend[:, :half] = np.nan
+    trend[:, values.shape[1] - half:] = np.nan
+    trend[coverage < 0.5] = np.nan
+
+    season = _season(periods, freq)
+    onehot = np.zeros((values.shape[1], period))
+    onehot[np.arange(values.shape[1]), season] = 1.0
+    detrended = values - trend
+    ok = ~np.isnan(detrended)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        profile = (np.where(ok, detrended, 0.0) @ onehot) / (ok @ onehot)
+    measured = np.isfinite(profile)
+    profile -= np.where(measured, profile, 0).sum(axis=1, keepdims=True) / np.maximum(measured.sum(axis=1, keepdims=True), 1)
+    seasonal = np.nan_to_num(profile)[:, season]
+    return trend, seasonal, values - trend - seasonal
+
+
+def _tie_term(row):
+    row = row[~np.isnan(row)]
+    _, counts = np.unique(row, return_counts=True)
+    counts = counts[counts > 1]
+    return float(np.sum(counts * (counts - 1) * (2 * counts + 5)))
+
+
+def _pairwise(values, years, confidence):
+    """Theil-Sen slope with CI and Mann-Kendall S, Z and p per row of ``values``."""
+    n_rows, n = values.shape
+    out = {k: np.full(n_rows, np.nan) for k in ("slope", "low", "high", "s", "z", "p")}
+    if n < 2:
+        return out
+    i, j = np.triu_indices(n, 1)
+    dt = years[j] - years[i]
+    z_crit = stats.norm.ppf(0.5 + confidence / 2)
+    batch = max(1, MAX_PAIRS // len(i))
+    for lo in range(0, n_rows, batch):
+        block = values[lo:lo + batch]
+        diff = block[:, j] - block[:, i]
+        s = np.nansum(np.sign(diff), axis=1)
+        slopes = np.sort(diff / dt, axis=1)  # NaN pairs sort last
+        count = (~np.isnan(diff)).sum(axis=1)
+        m = (~np.isnan(block)).sum(axis=1)
+        ties = np.array([_tie_term(row) for row in block])
+        var = (m * (m - 1) * (2 * m + 5) - ties) / 18
+        with np.errstate(invalid="ignore", divide="ignore"):
+            z = np.where(s > 0, s - 1, np.where(s < 0, s + 1, 0)) / np.sqrt(var)
+        # Sen's interval: ranks (N - C) / 2 and (N + C) / 2 of the sorted slopes
+        spread = z_crit * np.sqrt(np.maximum(var, 0))
+        rows = np.arange(len(block))
+
+        def ranked(rank):
+            rank = np.clip(np.round(rank).astype("int64"), 0, np.maximum(count - 1, 0))
+            return np.where(count > 0, slopes[rows, rank], np.nan)
+
+        median = np.where(count > 0, (ranked((count - 1) // 2) + ranked(count // 2)) / 2, np.nan)
+        sl = slice(lo, lo + len(block))
+        out["slope"][sl] = median
+        out["low"][sl] = ranked((count - spread) / 2 - 1)
+        out["high"][sl] = ranked((count + spread) / 2)
+        out["s"][sl] = np.where(m >= 3, s, np.nan)
+        out["z"][sl] = np.where(m >= 3, z, np.nan)
+        out["p"][sl] = np.where(m >= 3, 2 * stats.norm.sf(np.abs(z)), np.nan)
+    return out
+
+
+def series_trends(values, periods, freq="month", confidence=0.95):
+    """Decompose each row of ``values`` and test its deseasonalized series for a trend.
+
+    Returns a dict of arrays (one entry per row): ``slope``/``low``/``high``
+    in units per year and ``intercept``, ``s``, ``z``, ``p``, plus ``n``
+    valid periods, ``mean``, the decomposition's ``trend`` and ``seasonal``
+    rows, and ``years`` (each period's offset from the first).
+    """
+    values = np.atleast_2d(np.asarray(values, dtype="float64"))
+    trend, seasonal, _ = decompose(values, periods, freq)
+    years = ((periods - periods[0]) / pd.Timedelta(days=365.25)).to_numpy() if len(periods) else np.zeros(0)
+    deseasonalized = values - seasonal
+    result = _pairwise(deseasonalized, years, confidence)
+    with np.errstate(invalid="ignore"):
+        # Conover's intercept, so ``intercept + slope * years`` draws the fitted line
+        residual = deseasonalized - result["slope"][:, None] * years
+    result["intercept"] = np.array([np.median(r[~np.isnan(r)]) if (~np.isnan(r)).any() else np.nan for r in residual])
+    result["years"] = years
+    result["n"] = (~np.isnan(values)).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result["mean"] = np.nansum(values, axis=1) / result["n"]
+    result["trend"], result["seasonal"] = trend, seasonal
+    return result
+
+
+def _label(slope, p, alpha):
+    if not np.isfinite(p) or p >= alpha:
+        return "no significant trend"
+    return "↑ increasing" if slope > 0 else "↓ decreasing"
+
+
+def _station_table(station, columns, periods, values, freq, confidence):
+    """Trend rows for one station's period means (runs in worker processes)."""
+    found = series_trends(values, periods, freq, confidence)
+    alpha = 1 - confidence
+    rows = []
+    for k, name in enumerate(columns):
+        valid = np.flatnonzero(~np.isnan(values[k]))
+        if len(valid) < 3:
+            continue
+        mean = found["mean"][k]
+        rows.append([
+            station, name.upper(), int(found["n"][k]), periods[valid[0]], periods[valid[-1]], mean,
+            found["slope"][k], found["low"][k], found["high"][k],
+            found["slope"][k] / mean * 100 if mean else np.nan,
+            found["s"][k], found["z"][k], found["p"][k], _label(found["slope"][k], found["p"][k], alpha),
+        ])
+    return rows
+
+
+def _digest(means, freq, confidence):
+    h = hashlib.sha256(f"{freq}:{confidence}".encode("utf-8"))
+    for station, columns, periods, values in means:
+        h.update(repr((station, columns, len(periods))).encode("utf-8"))
+        h.update(periods.asi8.tobytes() if len(periods) else b"")
+        h.update(np.ascontiguousarray(values).tobytes())
+    return h.hexdigest()[:24]
+
+
+def trend_table(frames, columns, freq="month", tz="UTC", confidence=0.95, jobs=1, cache_dir=None):
+    """One row per station and pollutant: Theil-Sen slope, its CI and the Mann-Kendall test.
+
+    ``frames`` maps station names to hourly frames. Period means are always
+    computed here; the pairwise statistics come from the disk cache when the
+    same means were analyzed before, else run in ``jobs`` worker processes.
+    Pass ``cache_dir=False`` to skip the cache.
+    """
+    if freq not in PERIODS:
+        raise ValueError(f"Unknown trend frequency '{freq}'")
+    means = []
+    for station, df in frames.items():
+        present = [c for c in columns if c in df.columns]
+        periods, values = period_means(df, present, freq, tz)
+        means.append((station, present, periods, values))
+
+    path = None
+    if cache_dir is not False:
+        path = os.path.join(cache_dir or CACHE_DIR, "trends", f"{_digest(means, freq, confidence)}.parquet")
+        if os.path.exists(path):
+            return pd.read_parquet(path)
+
+    args = [(station, cols, periods, values, freq, confidence) for station, cols, periods, values in means]
+    if jobs > 1 and len(args) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(args))) as pool:
+            parts = list(pool.map(_station_table, *zip(*args)))
+    else:
+        parts = [_station_table(*a) for a in args]
+    table = pd.DataFrame([row for part in parts for row in part], columns=TABLE_COLUMNS)
+
+    if path is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        table.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+    return table
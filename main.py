@@ -7,6 +7,30 @@ import streamlit as st
 from datetime import datetime, timedelta
 import numpy as np
 import pytz
+import functools
+import json
+import os
+import tracemalloc
+
+from airquality import openweather
+from airquality.decode import decode_airvisual, decode_openweather, decode_waqi
+from airquality.downsample import DEFAULT_POINTS, downsample
+from airquality.features import MONTH_NAMES, weekday_names
+from airquality.ingest import load_cached_csv
+from airquality.aqi import AQI_RANGES, STANDARDS, category_colors
+from airquality.core import NUMERIC_COLUMNS, Dataset, merge_sources, quality_table, station_frame, summary_table
+from airquality.episodes import AVERAGING, DEFAULT_AVERAGING, LABELS, THRESHOLDS, detect
+from airquality.events import DEFAULT_EVENTS, event_frame, event_impact, event_table, read_events
+from airquality.export import FORMATS, export_columns, export_file, file_name
+from airquality.forecast import MODEL_PATH, ForecastModel
+from airquality.gaps import HourlyGrid, break_points, with_breaks
+from airquality.profiler import Profiler
+from airquality.query import available_engines
+from airquality.render import BACKENDS, DENSITY_ABOVE, WEBGL_ABOVE, binned_density, choose_backend, payload_bytes
+from airquality.schema import format_bytes, memory_bytes, wide_bytes
+from airquality.stations import CITY_WIDE
+from airquality.timeindex import date_slice, time_slice
+from airquality.trends import rollup_means, series_trends, trend_table
 
 # ==== CONFIG & PAGE SETUP ====
 st.set_page_config(page_title="Beijing Air Quality Dashboard", layout="wide", initial_sidebar_state="expanded")
@@ -30,16 +54,6 @@ st.markdown("---")
 CITY = "Beijing"
 LAT, LON = 39.9042, 116.4074
 
-# AQI Categories for interpretation
-AQI_CATEGORIES = {
-    1: {"label": "Good", "color": "#00e400", "range": "0–50"},
-    2: {"label": "Moderate", "color": "#ffff00", "range": "51–100"},
-    3: {"label": "Unhealthy for Sensitive Groups", "color": "#ff7e00", "range": "101–150"},
-    4: {"label": "Unhealthy", "color": "#ff0000", "range": "151–200"},
-    5: {"label": "Very Unhealthy", "color": "#8f3f97", "range": "201–300"},
-    6: {"label": "Hazardous", "color": "#7e0023", "range": ">300"}
-}
-
 # ==== SIDEBAR: API CONFIGURATION ====
 st.sidebar.header("🔌 API Configuration")
 st.sidebar.markdown("""
@@ -101,183 +115,183 @@ selected_timezone = st.sidebar.selectbox(
     help="Convert all timestamps to your preferred timezone"
 )
 
+# ==== SIDEBAR: AQI STANDARD ====
+st.sidebar.header("📏 AQI Standard")
+aqi_standard = st.sidebar.selectbox(
+    "Compute AQI with",
+    list(STANDARDS),
+    format_func=lambda key: STANDARDS[key].label,
+    help="AQI is computed from the pollutant concentrations of every source, so files without an AQI column get one too"
+)
+
+# ==== SIDEBAR: CHART RENDERING ====
+st.sidebar.header("⚙️ Chart Rendering")
+max_plot_points = st.sidebar.slider(
+    "Max points per timeline series",
+    min_value=1000,
+    max_value=10000,
+    value=DEFAULT_POINTS,
+    step=500,
+    help="Timelines are downsampled on the server to about this many points (≈2 per pixel on a wide screen). Narrow the zoom window to see full detail."
+)
+render_backend = st.sidebar.selectbox(
+    "Rendering backend",
+    BACKENDS,
+    help="Auto switches to WebGL, then to a server-side density heatmap, as the point count grows."
+)
+webgl_above = st.sidebar.number_input("Use WebGL above (points)", min_value=0, value=WEBGL_ABOVE, step=5000)
+density_above = st.sidebar.number_input("Use density heatmap above (points)", min_value=0, value=DENSITY_ABOVE, step=50000)
+show_payload = st.sidebar.checkbox("Show chart payload sizes", value=True)
+
+# ==== SIDEBAR: QUERY BACKEND ====
+query_engine = 'pandas'
+query_engines = available_engines()
+if query_engines:
+    st.sidebar.header("🗄️ Query Backend")
+    query_engine = st.sidebar.selectbox(
+        "Aggregate charts with",
+        ['pandas'] + query_engines,
+        format_func={'pandas': 'pandas (in-memory rollups)', 'duckdb': 'DuckDB over Parquet', 'polars': 'Polars over Parquet'}.get,
+        help="DuckDB and Polars run the monthly, yearly, hour × weekday and summary aggregations over a Parquet copy of the data and return only the aggregated rows"
+    )
+
+# ==== SIDEBAR: PERFORMANCE ====
+st.sidebar.header("⏱️ Performance")
+profile_rerun = st.sidebar.checkbox(
+    "Profile each rerun",
+    value=False,
+    help="Times every pipeline stage and chart block and lists them at the top of the sidebar"
+)
+trace_memory = st.sidebar.checkbox(
+    "Trace peak memory (slower)",
+    value=False,
+    disabled=not profile_rerun,
+    help="Measures peak NumPy/pandas allocations per stage with tracemalloc"
+)
+if not (profile_rerun and trace_memory) and tracemalloc.is_tracing():
+    tracemalloc.stop()
+profiler = Profiler(enabled=profile_rerun, memory=profile_rerun and trace_memory)
+perf_panel = st.sidebar.container()
+
 # ==== SIDEBAR: EVENT EDITOR ====
 st.sidebar.header("📌 Major Events Timeline")
 st.sidebar.markdown("*Add markers for significant events (policies, disasters, celebrations)*")
 
-default_events = {
-    "2010-11-16": {
-        "short": "🚨 Severe smog episode",
-        "detail": "Major air pollution event - PM2.5 exceeded 500 µg/m³. Led to public health warnings and increased awareness."
-    },
-    "2013-01-12": {
-        "short": "🌫️ Airpocalypse begins",
-        "detail": "Worst pollution crisis in Beijing's history. PM2.5 reached 900+ µg/m³. Prompted government action on air quality."
-    },
-    "2013-09-10": {
-        "short": "⚖️ Air Pollution Action Plan",
-        "detail": "China's State Council releases comprehensive air pollution prevention and control action plan. Target: 25% PM2.5 reduction by 2017."
-    },
-    "2015-11-30": {
-        "short": "🚨 Red alert issued",
-        "detail": "Beijing's first-ever red alert for air pollution. Schools closed, construction halted, vehicle restrictions implemented."
-    },
-    "2016-12-16": {
-        "short": "🔴 Extended red alert",
-        "detail": "Longest red alert in Beijing history - lasted 9 days. PM2.5 averaged 300+ µg/m³. Emergency measures activated."
-    },
-    "2017-01-01": {
-        "short": "⚖️ Coal ban policy",
-        "detail": "Beijing implements citywide coal-to-gas heating conversion. Banned coal burning in 6 central districts. Major policy shift."
-    },
-    "2018-09-01": {
-        "short": "🌱 Emission standards",
-        "detail": "Stricter vehicle emission standards (China VI) implemented. Heavy truck restrictions in city center. Industrial upgrades mandated."
-    },
-    "2019-10-01": {
-        "short": "🎉 70th National Day",
-        "detail": "Major celebrations with strict pollution controls. Factories shut down, traffic restricted. Showed 'parade blue' sky phenomenon."
-    },
-    "2020-02-01": {
-        "short": "🔒 COVID-19 lockdown",
-        "detail": "Strict lockdown measures begin. Industrial activity ceased, traffic minimal. PM2.5 dropped 30-40% showing pollution sources."
-    },
-    "2020-04-08": {
-        "short": "↗️ Lockdown easing",
-        "detail": "Gradual reopening begins. Factories restart operations. Pollution levels return but remain lower than pre-COVID baseline."
-    },
-    "2021-03-15": {
-        "short": "🌪️ Sandstorm event",
-        "detail": "Massive sandstorm from Mongolia hits Beijing. PM10 exceeded 8000 µg/m³. Worst sandstorm in a decade."
-    },
-    "2022-02-04": {
-        "short": "⛷️ Winter Olympics start",
-        "detail": "Beijing Winter Olympics opening ceremony. Strict pollution controls: factory shutdowns, vehicle bans. 'Olympic blue' achieved."
-    },
-    "2022-02-20": {
-        "short": "🏁 Winter Olympics end",
-        "detail": "Olympics conclude successfully. Environmental measures proved effective. Set new standards for event pollution control."
-    },
-    "2024-10-01": {
-        "short": "🎊 75th National Day",
-        "detail": "Celebration of 75th anniversary of PRC founding. Advanced pollution monitoring and control systems demonstrated progress."
-    },
-}
-
 use_default_events = st.sidebar.checkbox("Use default events", value=True)
 
 if use_default_events:
-    events = default_events.copy()
+    events = DEFAULT_EVENTS.copy()
     st.sidebar.success(f"✓ {len(events)} default events loaded")
 else:
-    num_events = st.sidebar.number_input("Number of custom events", min_value=0, max_value=20, value=3)
+    events_file = st.sidebar.file_uploader(
+        "Import events (CSV or JSON)",
+        type=["csv", "json"],
+        help="CSV with date, event and optional detail columns, or a JSON mapping like the default events"
+    )
+    imported = {}
+    if events_file is not None:
+        try:
+            imported = read_events(events_file, events_file.name)
+        except Exception as e:
+            st.sidebar.error(f"❌ Could not read events: {e}")
+    # Any number of rows can be added, pasted or imported
+    edited_events = st.sidebar.data_editor(
+        pd.DataFrame(
+            [{"Date": d, "Event": info["short"]} for d, info in imported.items()] or [{"Date": "", "Event": ""}] * 3
+        ),
+        num_rows="dynamic",
+        hide_index=True,
+        column_config={
+            "Date": st.column_config.TextColumn("Date", help="YYYY-MM-DD"),
+            "Event": st.column_config.TextColumn("Event")
+        },
+        key=f"event_editor_{getattr(events_file, 'file_id', None)}"
+    )
     events = {}
-    for i in range(num_events):
-        col1, col2 = st.sidebar.columns([1, 2])
-        with col1:
-            date_str = st.text_input(f"Date {i+1}", value="", key=f"date_{i}", placeholder="YYYY-MM-DD")
-        with col2:
-            short_desc = st.text_input(f"Event {i+1}", value="", key=f"desc_{i}", placeholder="Event description")
+    for date_str, short_desc in zip(edited_events["Date"].fillna(""), edited_events["Event"].fillna("")):
+        date_str, short_desc = str(date_str).strip(), str(short_desc).strip()
         if date_str and short_desc:
-            events[date_str] = {"short": short_desc, "detail": short_desc}
+            events[date_str] = {"short": short_desc, "detail": imported.get(date_str, {}).get("detail", short_desc)}
+    st.sidebar.caption(f"{len(events)} custom events")
 
 # ==== HELPER FUNCTIONS ====
 
-def normalize_columns(df):
-    """Standardizes column name variations."""
-    rename_map = {
-        "pm25": "pm2.5", "pm_25": "pm2.5", "pm2_5": "pm2.5", "PM2.5": "pm2.5",
-        "pm_10": "pm10", "PM10": "pm10", "NO2": "no2", "SO2": "so2", "CO": "co", "O3": "o3",
-        "aqi_value": "aqi", "AQI": "aqi", "temp": "temperature", "TEMP": "temperature"
-    }
-    df.columns = df.columns.str.strip().str.lower()
-    return df.rename(columns=rename_map)
-
-def convert_to_timezone(df, target_tz):
-    """Convert datetime column to specified timezone."""
-    if 'datetime' not in df.columns or df['datetime'].isnull().all():
-        return df
-    
-    df = df.copy()
-    # Ensure datetime is timezone-aware (assume UTC if naive)
-    if df['datetime'].dt.tz is None:
-        df['datetime'] = df['datetime'].dt.tz_localize('UTC')
-    
-    # Convert to target timezone
-    df['datetime'] = df['datetime'].dt.tz_convert(target_tz)
-    return df
+def chart_backend(n_points, allow_density=True):
+    """Rendering backend for a chart of n_points under the sidebar settings."""
+    return choose_backend(n_points, render_backend, webgl_above, density_above, allow_density)
+
+def chart_section(name):
+    """Runs a chart block as a fragment, so its own widgets rerun only that block, timed as one span."""
+    def wrap(body):
+        @st.fragment
+        @functools.wraps(body)
+        def run():
+            with profiler.span(name, len(df_filtered)):
+                body()
+        return run
+    return wrap
+
+def show_chart(fig):
+    """Draws a figure, adding its serialized size to the open profiler span."""
+    st.plotly_chart(fig, use_container_width=True)
+    if profiler.enabled:
+        with profiler.span("plotly_json"):
+            size = payload_bytes(fig)
+        profiler.note(payload_bytes=size)
+
+def payload_caption(fig, backend, n_points):
+    """Shows what a figure costs to ship to the browser."""
+    if show_payload:
+        st.caption(f"📦 Payload: {format_bytes(payload_bytes(fig))} · {backend.upper()} · {n_points:,} points")
+
+def zoom_window(key, first, last):
+    """Time window slider for a timeline chart; narrowing it re-queries the data at higher resolution."""
+    lo = pd.Timestamp(first).tz_localize(None).floor('h').to_pydatetime()
+    hi = pd.Timestamp(last).tz_localize(None).floor('h').to_pydatetime()
+    if lo >= hi:
+        return None, None
+    start, end = st.slider(
+        "Zoom window",
+        min_value=lo,
+        max_value=hi,
+        value=(lo, hi),
+        step=timedelta(hours=1),
+        format="YYYY-MM-DD HH:mm",
+        key=key
+    )
+    return pd.Timestamp(start), pd.Timestamp(end) + pd.Timedelta(hours=1)
 
 @st.cache_data(ttl=3600)
 def fetch_openweather_data(lat, lon, api_key, start_date, end_date):
-    """Fetches air quality data from OpenWeather API for a date range with retry and timeout protection."""
+    """Fetches air quality data from OpenWeather API, reusing windows already in the local chunk store."""
     if not api_key or api_key.strip() == "":
         return None
 
     start_time = int(datetime.combine(start_date, datetime.min.time()).timestamp())
     end_time = int(datetime.combine(end_date, datetime.max.time()).timestamp())
 
-    all_records = []
-    chunk_days = 180  # Fetch 6 months per chunk (faster, more reliable)
-    current_start = start_time
-
-    with st.spinner(f"📡 Fetching data from {start_date} to {end_date}..."):
-        while current_start < end_time:
-            current_end = min(current_start + (chunk_days * 86400), end_time)
-            url = f"https://api.openweathermap.org/data/2.5/air_pollution/history?lat={lat}&lon={lon}&start={current_start}&end={current_end}&appid={api_key}"
-
-            success = False
-            for attempt in range(3):  # Retry up to 3 times
-                try:
-                    response = requests.get(url, timeout=60)
-                    response.raise_for_status()
-                    data = response.json()
-
-                    if "list" in data and len(data["list"]) > 0:
-                        for entry in data["list"]:
-                            all_records.append({
-                                "datetime": datetime.utcfromtimestamp(entry["dt"]),
-                                "aqi": entry["main"]["aqi"],
-                                "pm2.5": entry["components"].get("pm2_5"),
-                                "pm10": entry["components"].get("pm10"),
-                                "no2": entry["components"].get("no2"),
-                                "so2": entry["components"].get("so2"),
-                                "co": entry["components"].get("co"),
-                                "o3": entry["components"].get("o3"),
-                                "source": "OpenWeather API"
-                            })
-                    success = True
-                    break  # ✅ success, stop retrying
-
-                except requests.exceptions.ReadTimeout:
-                    st.warning(f"⏳ Timeout while fetching {datetime.utcfromtimestamp(current_start).date()} → retrying ({attempt+1}/3)...")
-                    time.sleep(3)
-                    continue
-                except requests.exceptions.HTTPError as e:
-                    if e.response.status_code == 401:
-                        st.error("🔑 Invalid API key or authentication error.")
-                        return None
-                    elif e.response.status_code == 429:
-                        st.warning("⚠️ Rate limit exceeded. Waiting before retry...")
-                        time.sleep(5)
-                        continue
-                    else:
-                        st.error(f"API Error: {e.response.status_code}")
-                        return None
-                except Exception as e:
-                    st.error(f"Connection error: {str(e)}")
-                    time.sleep(2)
-                    continue
-
-            if not success:
-                st.error(f"❌ Failed to fetch data for {datetime.utcfromtimestamp(current_start).date()} to {datetime.utcfromtimestamp(current_end).date()}")
-            
-            current_start = current_end + 1
+    store = openweather.ChunkStore(lat, lon)
+    pending = store.missing(openweather.windows(start_time, end_time))
+
+    with st.spinner(f"📡 Fetching data from {start_date} to {end_date} ({len(pending)} new chunks)..."):
+        try:
+            entries, failed, timings = openweather.fetch_history(
+                lat, lon, api_key, start_time, end_time, store=store, notify=st.warning
+            )
+        except openweather.AuthError:
+            st.error("🔑 Invalid API key or authentication error.")
+            return None
+
+    for window in failed:
+        st.error(f"❌ Failed to fetch data for {datetime.utcfromtimestamp(window[0]).date()} to {datetime.utcfromtimestamp(window[1]).date()}")
 
-    if not all_records:
+    if not entries:
         st.warning("⚠️ No data received from OpenWeather API. Try a smaller date range or later.")
         return None
 
-    return pd.DataFrame(all_records)
+    df_ow = decode_openweather(entries)
+    df_ow.attrs["fetch_timings"] = timings
+    return df_ow
 
 
 @st.cache_data(ttl=3600)
@@ -298,22 +312,8 @@ def fetch_waqi_data(api_key, city="beijing", days=7):
             st.error(f"WAQI API Error: {data.get('data', 'Unknown error')}")
             return None
         
-        aqi_data = data["data"]
-        
         # Create a single record for current time
-        record = {
-            "datetime": datetime.utcnow(),
-            "aqi": aqi_data.get("aqi"),
-            "pm2.5": aqi_data.get("iaqi", {}).get("pm25", {}).get("v"),
-            "pm10": aqi_data.get("iaqi", {}).get("pm10", {}).get("v"),
-            "no2": aqi_data.get("iaqi", {}).get("no2", {}).get("v"),
-            "so2": aqi_data.get("iaqi", {}).get("so2", {}).get("v"),
-            "co": aqi_data.get("iaqi", {}).get("co", {}).get("v"),
-            "o3": aqi_data.get("iaqi", {}).get("o3", {}).get("v"),
-            "source": "WAQI API"
-        }
-        
-        return pd.DataFrame([record])
+        return decode_waqi(data["data"], int(datetime.now().timestamp()))
     
     except Exception as e:
         st.error(f"WAQI Error: {str(e)}")
@@ -336,17 +336,8 @@ def fetch_airvisual_data(api_key, city="Beijing", state="Beijing", country="Chin
             st.error(f"AirVisual API Error: {data.get('data', 'Unknown error')}")
             return None
         
-        pollution = data["data"]["current"]["pollution"]
-        
-        record = {
-            "datetime": datetime.utcnow(),
-            "aqi": pollution.get("aqius"),  # US AQI
-            "pm2.5": pollution.get("p2", {}).get("conc"),
-            "pm10": pollution.get("p1", {}).get("conc"),
-            "source": "AirVisual API"
-        }
-        
-        return pd.DataFrame([record])
+        # US AQI plus PM concentrations for the current hour
+        return decode_airvisual(data["data"]["current"]["pollution"], int(datetime.now().timestamp()))
     
     except Exception as e:
         st.error(f"AirVisual Error: {str(e)}")
@@ -354,78 +345,136 @@ def fetch_airvisual_data(api_key, city="Beijing", state="Beijing", country="Chin
 
 @st.cache_data
 def load_csv(uploaded_file):
-    """Loads user-uploaded CSV file."""
+    """Loads user-uploaded CSV file through the columnar ingestion cache."""
     if uploaded_file is None:
         return None
     
     try:
-        df = pd.read_csv(uploaded_file)
+        df = load_cached_csv(uploaded_file)
         df["source"] = f"CSV: {uploaded_file.name}"
         return df
     except Exception as e:
         st.error(f"CSV Load Error: {str(e)}")
         return None
 
-def parse_datetime_column(df):
-    """Intelligently parse various datetime formats."""
-    df = df.copy()
-    
-    # Try standard datetime column
-    if "datetime" in df.columns:
-        df["datetime"] = pd.to_datetime(df["datetime"], errors="coerce")
-    elif "date" in df.columns:
-        df["datetime"] = pd.to_datetime(df["date"], errors="coerce")
-    elif "timestamp" in df.columns:
-        df["datetime"] = pd.to_datetime(df["timestamp"], errors="coerce")
-    # Try combining year/month/day/hour columns
-    elif all(col in df.columns for col in ['year', 'month', 'day', 'hour']):
-        df['datetime'] = pd.to_datetime(df[['year', 'month', 'day', 'hour']])
-    elif all(col in df.columns for col in ['year', 'month', 'day']):
-        df['datetime'] = pd.to_datetime(df[['year', 'month', 'day']])
-    
-    return df
-
-def merge_datasets(df_csv, df_api):
-    """Merges CSV and API data, removing duplicates."""
-    frames = []
-    
-    if df_csv is not None and not df_csv.empty:
-        frames.append(df_csv)
-    
-    if df_api is not None and not df_api.empty:
-        frames.append(df_api)
-    
-    if not frames:
-        return pd.DataFrame()  # Return empty DataFrame instead of None
-    
-    df_all = pd.concat(frames, ignore_index=True)
-    
-    # Remove duplicates, keeping the most recent source
-    if 'datetime' in df_all.columns:
-        df_all = df_all.sort_values('datetime').drop_duplicates(subset=['datetime'], keep='last')
-    
-    return df_all
+@st.cache_resource(max_entries=4)
+def prepare_dataset(_df, dataset_key, standard, _profiler=None):
+    """Normalizes to UTC and derives AQI once per dataset and AQI standard, whatever the timezone."""
+    return Dataset.prepare(_df, standard, profiler=_profiler)
+
+@st.cache_resource(max_entries=10)
+def analyze(_dataset, dataset_key, tz, _profiler=None):
+    """Builds the timezone view and aggregates once per dataset and timezone (two datasets × five zones)."""
+    return _dataset.analysis(tz, profiler=_profiler)
+
+@st.cache_resource(max_entries=4)
+def open_queries(_analysis, dataset_key, tz, engine):
+    """Opens the chart aggregations on the chosen backend once per dataset and timezone."""
+    return _analysis.open_queries(engine, dataset_key)
+
+@st.cache_resource(max_entries=8)
+def present_columns(_df, view_key):
+    """Columns with at least one reading in the filtered view."""
+    return [c for c in _df.columns if _df[c].notna().any()]
+
+@st.cache_resource(max_entries=8)
+def pollutant_frame(_df, view_key, pollutant):
+    """Time, source and numeric readings of one pollutant in the filtered view, without gaps."""
+    plot_df = _df[['datetime', pollutant, 'source']] if 'source' in _df.columns else _df[['datetime', pollutant]]
+    plot_df = plot_df.dropna(subset=['datetime', pollutant])
+    plot_df[pollutant] = pd.to_numeric(plot_df[pollutant], errors='coerce')
+    return plot_df.dropna(subset=[pollutant])
+
+@st.cache_resource(max_entries=8)
+def smoothed_series(_rollups, view_key, pollutant, start, end):
+    """24-hour (clock time, not rows) rolling mean of one pollutant over the hourly rollups in [start, end)."""
+    smoothed = _rollups.rolling_mean(pollutant, '24h', start, end)
+    return pd.DataFrame({
+        'datetime': _rollups.localize(smoothed.index),
+        pollutant: smoothed.to_numpy()
+    })
+
+@st.cache_resource(max_entries=8)
+def hourly_grid(_df, tz_key, method, limit):
+    """The whole view on a complete hourly grid per station and source, gaps imputed with ``method``."""
+    return HourlyGrid.from_frame(_df, NUMERIC_COLUMNS, method=method, limit=limit)
+
+@st.cache_resource(max_entries=4)
+def view_episodes(_df, dataset_key, tz, standard):
+    """Episodes above ``standard``'s limits and exceedance hours per year, for every pollutant of the whole view."""
+    return detect(_df, NUMERIC_COLUMNS, standard)
+
+@st.cache_resource(max_entries=8)
+def scatter_frame(_df, view_key, x, y):
+    """Rows of the filtered view where both scatter axes have readings."""
+    return _df[[x, y, 'datetime']].dropna()
+
+@st.cache_resource(max_entries=8)
+def view_trend(_rollups, view_key, pollutant, start, end):
+    """Monthly means of one pollutant in [start, end) with their decomposition and Theil–Sen/Mann–Kendall trend."""
+    periods, values = rollup_means(_rollups, [pollutant], 'month', start, end)
+    return periods, values[0], series_trends(values, periods)
+
+@st.cache_resource(max_entries=4)
+def station_trends(_store, source_key, tz, freq):
+    """Trend table for the city-wide mean and every station; the pairwise statistics are also cached on disk."""
+    frames = _store.views()
+    pollutants = [c for c in NUMERIC_COLUMNS if c != 'aqi']
+    return trend_table(frames, pollutants, freq, tz, jobs=os.cpu_count() or 1)
+
+@st.cache_resource(max_entries=8)
+def event_impacts(_rollups, impact_key, events_json, days, n_boot):
+    """Before/after impact of every event, once per dataset, timezone, event list and window."""
+    return event_impact(_rollups, json.loads(events_json), _rollups.columns, before=days, after=days, n_boot=n_boot)
+
+@st.cache_resource(max_entries=2)
+def saved_forecast_model(path, mtime):
+    """The model trained offline by ``python -m airquality train``, reloaded when the file changes."""
+    return ForecastModel.load(path)
+
+@st.cache_resource(max_entries=2)
+def view_forecast_model(_df, dataset_key, tz):
+    """A model trained on the whole view, for when no saved model fits this dataset's columns."""
+    return ForecastModel.fit(_df)
+
+@st.cache_resource(max_entries=4)
+def merge_datasets(_frames, source_key):
+    """Merges CSV and API data into per-station partitions keyed by (station, datetime)."""
+    # Later frames win when a station reports the same timestamp twice, so API data replaces the CSV
+    return merge_sources(_frames, default_station=CITY)
 
 # ==== DATA LOADING & PROCESSING ====
 
 # Load CSV data
 df_csv = None
 if uploaded_file is not None:
-    df_csv = load_csv(uploaded_file)
+    with profiler.span("load_csv"):
+        df_csv = load_csv(uploaded_file)
+        profiler.note(rows_out=0 if df_csv is None else len(df_csv))
     if df_csv is not None:
-        df_csv = normalize_columns(df_csv)
-        df_csv = parse_datetime_column(df_csv)
         st.sidebar.success(f"✓ Loaded {len(df_csv)} records from CSV")
 
 # Fetch API data from OpenWeather
 df_api = None
 if api_key:
     try:
-        df_api = fetch_openweather_data(LAT, LON, api_key, api_start_date, api_end_date)
+        with profiler.span("fetch_openweather"):
+            df_api = fetch_openweather_data(LAT, LON, api_key, api_start_date, api_end_date)
+            profiler.note(rows_out=0 if df_api is None else len(df_api))
         if df_api is not None and not df_api.empty:
             st.sidebar.success(f"✓ Loaded {len(df_api):,} records from OpenWeather API")
             date_range = (df_api['datetime'].max() - df_api['datetime'].min()).days
             st.sidebar.info(f"📅 API data: {df_api['datetime'].min().date()} to {df_api['datetime'].max().date()} ({date_range} days)")
+            timings = df_api.attrs.get("fetch_timings", [])
+            if timings:
+                with st.sidebar.expander("⏱️ API chunk timings"):
+                    st.dataframe(pd.DataFrame([{
+                        'Chunk start': datetime.utcfromtimestamp(t['window'][0]).date(),
+                        'Seconds': round(t['seconds'], 2),
+                        'Attempts': t['attempts'],
+                        'Records': t['entries'],
+                        'Cached': t['cached']
+                    } for t in timings]), hide_index=True)
         else:
             st.sidebar.warning("⚠️ No data returned from OpenWeather API")
     except Exception as e:
@@ -480,40 +529,82 @@ if df_csv is None and df_api is None:
     
     st.stop()
 
-# Merge datasets
-df = merge_datasets(df_csv, df_api)
+frames = [f for f in (df_csv, df_api) if f is not None and not f.empty]
 
-# Final validation checks - df is now always a DataFrame, never None
-if df.empty:
+# Final validation checks before merging
+if not frames:
     st.error("❌ No data could be loaded or merged. Please check:")
     st.write("- CSV file format and contents")
     st.write("- API key validity (OpenWeather keys can take 2 hours to activate)")
     st.write("- Network connection")
     st.stop()
 
-if "datetime" not in df.columns:
-    st.error("❌ No valid datetime column found.")
-    st.write("**Available columns:**", list(df.columns))
-    st.info("Your CSV should have one of: 'datetime', 'date', 'timestamp', or separate 'year', 'month', 'day', 'hour' columns")
-    st.stop()
-
-# Remove rows with null datetime values
-df_before_clean = len(df)
-df = df.dropna(subset=["datetime"])
+for frame in frames:
+    if "datetime" not in frame.columns:
+        st.error("❌ No valid datetime column found.")
+        st.write("**Available columns:**", list(frame.columns))
+        st.info("Your CSV should have one of: 'datetime', 'date', 'timestamp', or separate 'year', 'month', 'day', 'hour' columns")
+        st.stop()
+
+# Merge datasets; rows with null datetime values are dropped per station
+source_key = (
+    getattr(uploaded_file, 'file_id', uploaded_file.name) if df_csv is not None else None,
+    (api_start_date, api_end_date) if df_api is not None else None,
+)
+with profiler.span("merge", sum(len(f) for f in frames)):
+    store = merge_datasets(frames, source_key)
+    profiler.note(rows_out=len(store))
 
 # Check if we have any data left after cleaning
-if df.empty:
-    st.error(f"❌ All {df_before_clean} records had invalid datetime values.")
+if len(store) == 0:
+    st.error(f"❌ All {sum(len(f) for f in frames)} records had invalid datetime values.")
     st.info("Please check your date/time column format in the CSV file.")
     st.stop()
 
-# Convert to selected timezone
-try:
-    df = convert_to_timezone(df, selected_timezone)
-except Exception as e:
-    st.warning(f"⚠️ Could not convert timezone: {e}. Using original timezone.")
+# ==== SIDEBAR: STATIONS ====
+station_view = store.default_view
+if len(store.stations) > 1:
+    st.sidebar.header("📍 Monitoring Stations")
+    station_view = st.sidebar.selectbox(
+        "Station",
+        [CITY_WIDE] + store.stations,
+        help="The city-wide view is the hourly mean across every station reporting that hour"
+    )
+    st.sidebar.caption(f"{len(store.stations)} stations, {len(store):,} station-hours")
+
+with profiler.span("station_view", len(store)):
+    df = station_frame(store, station_view)
+    profiler.note(rows_out=len(df))
+
+dataset_key = (
+    *source_key,
+    station_view,
+    len(df),
+    aqi_standard,
+)
+
+# The analytics core derives AQI once per dataset, then local calendar fields and every
+# aggregate store once per timezone; charts only read them
+# (on a cache hit the analyze span is near zero and has no child spans)
+with profiler.span("analyze", len(df)):
+    dataset = prepare_dataset(df, dataset_key, aqi_standard, _profiler=profiler)
+    try:
+        analysis = analyze(dataset, dataset_key, selected_timezone, _profiler=profiler)
+    except Exception as e:
+        st.warning(f"⚠️ Could not convert timezone: {e}. Using original timezone.")
+        analysis = analyze(dataset, dataset_key, None, _profiler=profiler)
+df = analysis.df
 
 st.sidebar.success(f"✓ Total records ready: {len(df):,}")
+st.sidebar.caption(
+    f"💾 Memory: {format_bytes(memory_bytes(df))} "
+    f"(vs. {format_bytes(wide_bytes(df))} with default float64/object dtypes)"
+)
+
+# Aggregates for every chart are answered from here instead of rescanning df
+rollups, correlations = analysis.rollups, analysis.correlations
+with profiler.span("open_queries"):
+    queries = open_queries(analysis, dataset_key, selected_timezone, query_engine)
 
 # ==== DATA SUMMARY ====
 col1, col2, col3, col4 = st.columns(4)
@@ -552,10 +643,14 @@ date_range = st.sidebar.date_input(
 
 if isinstance(date_range, tuple) and len(date_range) == 2:
     start_date, end_date = date_range
-    mask = (df['datetime'].dt.date >= start_date) & (df['datetime'].dt.date <= end_date)
-    df_filtered = df[mask]
+    with profiler.span("filter", len(df)):
+        df_filtered = date_slice(df, start_date, end_date)
+        profiler.note(rows_out=len(df_filtered))
+    range_start = pd.Timestamp(start_date)
+    range_end = pd.Timestamp(end_date) + pd.Timedelta(days=1)
 else:
     df_filtered = df
+    range_start, range_end = None, None
 
 if df_filtered.empty:
     st.warning("No data in selected date range. Please adjust your filters.")
@@ -563,111 +658,183 @@ if df_filtered.empty:
 
 # ==== VISUALIZATION SECTION ====
 
+# Every chart section is a fragment: its widgets rerun only that section, which reads the
+# intermediates below (from the last full run) and per-view caches keyed on view_key
+view_key = (dataset_key, selected_timezone, range_start, range_end)
+present = present_columns(df_filtered, view_key)
+numeric_cols = ['pm2.5', 'pm10', 'no2', 'so2', 'o3', 'co', 'aqi']
+available_numeric = [col for col in numeric_cols if col in df_filtered.columns]
+
 st.header("📊 Air Quality Analysis")
 
 # ==== CHART 1: POLLUTANT TIMELINE WITH EVENTS ====
-st.subheader("1️⃣ Pollutant Concentration Timeline")
-
-# Let the user select pollutant
-available_pollutants = ['pm2.5', 'pm10', 'no2', 'so2', 'co', 'o3']
-available_pollutants = [
-    p for p in available_pollutants
-    if p in df_filtered.columns and not df_filtered[p].isnull().all()
-]
-
-if available_pollutants:
-    selected_pollutant = st.selectbox(
-        "Select pollutant to display",
-        available_pollutants,
-        index=available_pollutants.index('pm2.5') if 'pm2.5' in available_pollutants else 0
-    )
-
-    # Toggle view mode
-    view_mode = st.radio(
-        "Display mode:",
-        ["Smoothed 24-Hour Average", "Raw Data"],
-        horizontal=True
-    )
+# Imputation for hours without a reading: (method, limit in hours)
+GAP_FILLS = {
+    "Leave gaps": ("none", None),
+    "Forward fill (up to 3 h)": ("ffill", 3),
+    "Linear (gaps up to 24 h)": ("linear", 24),
+    "Seasonal hour-of-day mean": ("seasonal", None)
+}
+# Lines are broken rather than drawn across longer gaps
+GAP_BREAK = '24h'
+# Limits whose exceedance episodes can be shaded
+EPISODE_LIMITS = {"Off": None, "WHO guideline": "who", "China Grade II": "cn"}
+
+@chart_section("chart1_timeline")
+def pollutant_timeline():
+    st.subheader("1️⃣ Pollutant Concentration Timeline")
+
+    # Let the user select pollutant
+    available_pollutants = ['pm2.5', 'pm10', 'no2', 'so2', 'co', 'o3']
+    available_pollutants = [p for p in available_pollutants if p in present]
+
+    if available_pollutants:
+        selected_pollutant = st.selectbox(
+            "Select pollutant to display",
+            available_pollutants,
+            index=available_pollutants.index('pm2.5') if 'pm2.5' in available_pollutants else 0
+        )
 
-    try:
-        # Prepare plotting DataFrame
-        plot_df = (
-            df_filtered[['datetime', selected_pollutant, 'source']].copy()
-            if 'source' in df_filtered.columns
-            else df_filtered[['datetime', selected_pollutant]].copy()
+        # Toggle view mode
+        view_mode = st.radio(
+            "Display mode:",
+            ["Smoothed 24-Hour Average", "Raw Data"],
+            horizontal=True
+        )
+        gap_fill = st.selectbox(
+            "Missing hours",
+            list(GAP_FILLS),
+            help="How hours without a reading are filled in Raw Data mode; imputed hours are drawn as gray dots"
+        ) if view_mode == "Raw Data" else "Leave gaps"
+        episode_limit = st.radio(
+            "Shade episodes above:",
+            list(EPISODE_LIMITS),
+            index=2,
+            horizontal=True,
+            help="Periods when the 24-hour mean (8-hour for O₃) stays above the limit"
         )
-        plot_df = plot_df.dropna(subset=['datetime', selected_pollutant])
-        plot_df[selected_pollutant] = pd.to_numeric(plot_df[selected_pollutant], errors='coerce')
-        plot_df = plot_df.dropna(subset=[selected_pollutant])
 
-        if plot_df.empty:
-            st.info("No valid numeric data available for the selected pollutant.")
-        else:
-            # Downsample if dataset is huge
-            if len(plot_df) > 200000:
-                st.warning("Large dataset detected — resampling hourly averages for performance.")
-                plot_df = plot_df.set_index('datetime').resample('1H').mean().reset_index()
-
-            # Compute 24-hour rolling average
-            smoothed = plot_df[['datetime', selected_pollutant]].copy()
-            smoothed[selected_pollutant] = (
-                smoothed[selected_pollutant].rolling(window=24, min_periods=1).mean()
-            )
+        try:
+            # Prepare plotting DataFrame
+            plot_df = pollutant_frame(df_filtered, view_key, selected_pollutant)
 
-            # --- Plot ---
-            if view_mode == "Smoothed 24-Hour Average":
-                fig1 = px.line(
-                    smoothed,
-                    x='datetime',
-                    y=selected_pollutant,
-                    title=f"{selected_pollutant.upper()} 24-Hour Average Levels ({selected_timezone})",
-                    labels={
-                        'datetime': 'Date & Time',
-                        selected_pollutant: f"{selected_pollutant.upper()} Concentration (µg/m³)"
-                    },
-                    template='plotly_white'
-                )
-                fig1.update_traces(line=dict(color='red', width=2), name=f"{selected_pollutant.upper()} (24h Avg)")
+            if plot_df.empty:
+                st.info("No valid numeric data available for the selected pollutant.")
             else:
-                # Raw Data only (blue line)
-                fig1 = px.line(
-                    plot_df,
-                    x='datetime',
-                    y=selected_pollutant,
-                    color='source' if 'source' in plot_df.columns else None,
-                    title=f"{selected_pollutant.upper()} Levels Over Time ({selected_timezone})",
-                    labels={
-                        'datetime': 'Date & Time',
-                        selected_pollutant: f"{selected_pollutant.upper()} Concentration (µg/m³)"
-                    },
-                    template='plotly_white'
-                )
-                for trace in fig1.data:
-                    if hasattr(trace, 'mode'):
-                        trace.update(mode='lines', line=dict(width=1), opacity=0.7)
-
-            # --- WHO guideline line ---
-            guidelines = {'pm2.5': 15, 'pm10': 45, 'no2': 25, 'so2': 40, 'o3': 100}
-            if selected_pollutant in guidelines:
-                fig1.add_hline(
-                    y=guidelines[selected_pollutant],
-                    line_dash="dash",
-                    line_color="orange",
-                    annotation_text=f"WHO 24h Guideline ({guidelines[selected_pollutant]} µg/m³)",
-                    annotation_position="right"
-                )
-
-            # --- Event markers ---
-            max_val = plot_df[selected_pollutant].max() if plot_df[selected_pollutant].max() > 0 else 10
-            for date_str, event_info in events.items():
-                try:
-                    event_date = pd.to_datetime(date_str).tz_localize('UTC').tz_convert(selected_timezone)
-                    if plot_df['datetime'].min() <= event_date <= plot_df['datetime'].max():
-                        fig1.add_vline(x=event_date, line_dash="dot", line_color="red", opacity=0.6)
-                        fig1.add_annotation(
+                zoom_start, zoom_end = zoom_window("zoom_timeline", plot_df['datetime'].iloc[0], plot_df['datetime'].iloc[-1])
+                if zoom_start is not None:
+                    plot_df = time_slice(plot_df, zoom_start, zoom_end)
+                else:
+                    zoom_start, zoom_end = range_start, range_end
+                if plot_df.empty:
+                    st.info("No readings of the selected pollutant in the zoom window.")
+                    return
+                grid = hourly_grid(df, (dataset_key, selected_timezone), *GAP_FILLS[gap_fill])
+                grid_rows = [time_slice(rows, zoom_start, zoom_end) for _, rows in grid.groups()]
+
+                # --- Plot ---
+                if view_mode == "Smoothed 24-Hour Average":
+                    # Compute 24-hour rolling average over hourly rollups
+                    smoothed = smoothed_series(rollups, view_key, selected_pollutant, zoom_start, zoom_end)
+                    line_df = with_breaks(
+                        smoothed,
+                        downsample(smoothed['datetime'], smoothed[selected_pollutant], max_plot_points),
+                        break_points(smoothed['datetime'], GAP_BREAK)
+                    )
+                    points_total = len(smoothed)
+                    backend1 = chart_backend(len(line_df), allow_density=False)
+                    fig1 = px.line(
+                        line_df,
+                        render_mode='webgl' if backend1 == 'webgl' else 'svg',
+                        x='datetime',
+                        y=selected_pollutant,
+                        title=f"{selected_pollutant.upper()} 24-Hour Average Levels ({selected_timezone})",
+                        labels={
+                            'datetime': 'Date & Time',
+                            selected_pollutant: f"{selected_pollutant.upper()} Concentration (µg/m³)"
+                        },
+                        template='plotly_white'
+                    )
+                    fig1.update_traces(line=dict(color='red', width=2), name=f"{selected_pollutant.upper()} (24h Avg)")
+                else:
+                    # Readings (and imputed hours) per source from the hourly grid, min/max-downsampled so peaks survive
+                    segments, imputed = [], []
+                    for rows in grid_rows:
+                        rows = rows[rows[selected_pollutant].notna().to_numpy()]
+                        if rows.empty:
+                            continue
+                        segments.append(with_breaks(
+                            rows[[c for c in ('datetime', selected_pollutant, 'source') if c in rows.columns]],
+                            downsample(rows['datetime'], rows[selected_pollutant], max_plot_points),
+                            break_points(rows['datetime'], GAP_BREAK)
+                        ))
+                        imputed.append(rows.loc[grid.imputed(selected_pollutant, rows), ['datetime', selected_pollutant]])
+                    if not segments:
+                        st.info("No readings of the selected pollutant in the zoom window.")
+                        return
+                    line_df = pd.concat(segments, ignore_index=True)
+                    points_total = sum(len(rows) for rows in grid_rows) - sum(
+                        int(grid.missing(selected_pollutant, rows).sum()) for rows in grid_rows
+                    ) + sum(len(part) for part in imputed)
+                    backend1 = chart_backend(len(line_df), allow_density=False)
+                    fig1 = px.line(
+                        line_df,
+                        render_mode='webgl' if backend1 == 'webgl' else 'svg',
+                        x='datetime',
+                        y=selected_pollutant,
+                        color='source' if 'source' in line_df.columns else None,
+                        title=f"{selected_pollutant.upper()} Levels Over Time ({selected_timezone})",
+                        labels={
+                            'datetime': 'Date & Time',
+                            selected_pollutant: f"{selected_pollutant.upper()} Concentration (µg/m³)"
+                        },
+                        template='plotly_white'
+                    )
+                    for trace in fig1.data:
+                        if hasattr(trace, 'mode'):
+                            trace.update(mode='lines', line=dict(width=1), opacity=0.7)
+                    imputed_df = pd.concat(imputed)
+                    if not imputed_df.empty:
+                        step = max(len(imputed_df) // max_plot_points, 1)
+                        fig1.add_trace((go.Scattergl if backend1 == 'webgl' else go.Scatter)(
+                            x=imputed_df['datetime'].iloc[::step],
+                            y=imputed_df[selected_pollutant].iloc[::step],
+                            mode='markers',
+                            marker=dict(size=3, color='gray'),
+                            name=f"Imputed ({gap_fill.lower()})"
+                        ))
+
+                # --- WHO guideline line ---
+                guidelines = {'pm2.5': 15, 'pm10': 45, 'no2': 25, 'so2': 40, 'o3': 100}
+                if selected_pollutant in guidelines:
+                    fig1.add_hline(
+                        y=guidelines[selected_pollutant],
+                        line_dash="dash",
+                        line_color="orange",
+                        annotation_text=f"WHO 24h Guideline ({guidelines[selected_pollutant]} µg/m³)",
+                        annotation_position="right"
+                    )
+
+                # --- Event markers ---
+                max_val = plot_df[selected_pollutant].max() if plot_df[selected_pollutant].max() > 0 else 10
+                # Events are naive local days from event_frame, the same days chart 9 counts;
+                # the chart's x axis is local wall time
+                first_shown, last_shown = plot_df['datetime'].iloc[0], plot_df['datetime'].iloc[-1]
+                marked = event_frame(events)
+                marked = marked[marked['date'].between(first_shown.tz_localize(None), last_shown.tz_localize(None))]
+                shown = list(zip(marked['date'], marked['short'], marked['detail']))
+                # One layout update for every marker; add_vline/add_annotation re-validate the layout per call
+                fig1.update_layout(
+                    shapes=list(fig1.layout.shapes) + [
+                        dict(type='line', xref='x', yref='paper', x0=event_date, x1=event_date, y0=0, y1=1,
+                             line=dict(dash='dot', color='red'), opacity=0.6)
+                        for event_date, _, _ in shown
+                    ],
+                    annotations=list(fig1.layout.annotations) + [
+                        dict(
                             x=event_date,
                             y=max_val * 0.95,
-                            text=event_info["short"].split('-')[0].strip()[:25],
+                            text=short.split('-')[0].strip()[:25],
                             showarrow=True,
                             arrowhead=2,
                             arrowsize=1,
@@ -678,545 +845,817 @@ if available_pollutants:
                             bgcolor="rgba(255,255,255,0.9)",
                             bordercolor="red",
                             borderwidth=1,
-                            hovertext=f"<b>{event_info['short']}</b><br><br>{event_info['detail']}",
+                            hovertext=f"<b>{short}</b><br><br>{detail}",
                             hoverlabel=dict(bgcolor="white", font_size=12, font_family="Arial")
                         )
-                except Exception:
-                    continue
-
-            # --- Y-axis range ---
-            y_min = max(0, float(plot_df[selected_pollutant].min()) * 0.95)
-            y_max = float(plot_df[selected_pollutant].max()) * 1.05 if float(plot_df[selected_pollutant].max()) > 0 else 10
-
-            fig1.update_layout(
-                hovermode='x unified',
-                height=500,
-                showlegend=True,
-                yaxis=dict(range=[y_min, y_max]),
-                legend=dict(bgcolor='rgba(255,255,255,0.7)', bordercolor='gray', borderwidth=1),
-                margin=dict(t=50, b=50, l=60, r=20)
-            )
-
-            st.plotly_chart(fig1, use_container_width=True)
-
-    except Exception as e:
-        st.error(f"Error while creating pollutant chart: {e}")
-else:
-    st.info("No pollutant data available to plot.")
+                        for event_date, short, detail in shown
+                    ]
+                )
 
+                # --- Y-axis range ---
+                y_min = max(0, float(plot_df[selected_pollutant].min()) * 0.95)
+                y_max = float(plot_df[selected_pollutant].max()) * 1.05 if float(plot_df[selected_pollutant].max()) > 0 else 10
+
+                # --- Exceedance episodes, from the precomputed table ---
+                limit = EPISODE_LIMITS[episode_limit]
+                shown_episodes = None
+                if limit and selected_pollutant in THRESHOLDS[limit]:
+                    episodes, exceedance = view_episodes(df, dataset_key, selected_timezone, limit)
+                    episodes = episodes[episodes['Pollutant'] == selected_pollutant.upper()]
+                    shown_episodes = episodes[(episodes['End'] > first_shown) & (episodes['Start'] <= last_shown)]
+                    if not shown_episodes.empty:
+                        # One filled trace for all episodes: a rectangle each, separated by a null point
+                        starts = shown_episodes['Start'].dt.tz_localize(None).to_numpy()
+                        ends = shown_episodes['End'].dt.tz_localize(None).to_numpy()
+                        fig1.add_trace(go.Scatter(
+                            x=np.column_stack([starts, starts, ends, ends, ends]).ravel(),
+                            y=np.tile([y_min, y_max, y_max, y_min, None], len(shown_episodes)),
+                            fill='toself',
+                            fillcolor='rgba(255, 140, 0, 0.15)',
+                            line=dict(width=0),
+                            mode='lines',
+                            hoverinfo='skip',
+                            name=f"Episodes above {THRESHOLDS[limit][selected_pollutant]} µg/m³"
+                        ))
+
+                fig1.update_layout(
+                    hovermode='x unified',
+                    height=500,
+                    showlegend=True,
+                    yaxis=dict(range=[y_min, y_max]),
+                    legend=dict(bgcolor='rgba(255,255,255,0.7)', bordercolor='gray', borderwidth=1),
+                    margin=dict(t=50, b=50, l=60, r=20)
+                )
 
+                show_chart(fig1)
+                shown_points = int(line_df[selected_pollutant].notna().sum())
+                profiler.note(rows_out=shown_points)
+                st.caption(f"Showing {shown_points:,} of {points_total:,} points in the zoom window")
+                hours = sum(len(rows) for rows in grid_rows)
+                missing = sum(int(grid.missing(selected_pollutant, rows).sum()) for rows in grid_rows)
+                if missing:
+                    filled = sum(int(grid.imputed(selected_pollutant, rows).sum()) for rows in grid_rows)
+                    st.caption(
+                        f"🕳️ {missing:,} of {hours:,} hours in view have no {selected_pollutant.upper()} reading"
+                        + (f" ({filled:,} imputed)" if filled else "")
+                        + "; lines break across gaps longer than 24 hours."
+                    )
+                payload_caption(fig1, backend1, len(line_df))
+
+                if shown_episodes is not None:
+                    window = AVERAGING.get(selected_pollutant, DEFAULT_AVERAGING)
+                    st.caption(
+                        f"🚨 {len(shown_episodes):,} episodes in view with the {window}-hour mean above the "
+                        f"{LABELS[limit]} ({THRESHOLDS[limit][selected_pollutant]} µg/m³), "
+                        f"{int(shown_episodes['Hours'].sum()):,} hours in all."
+                    )
+                    with st.expander("🚨 Exceedance episodes"):
+                        col1, col2 = st.columns([3, 2])
+                        with col1:
+                            st.markdown("**Longest episodes in view**")
+                            st.dataframe(
+                                shown_episodes.nlargest(50, 'Hours')
+                                .drop(columns=['Station', 'Pollutant', 'Standard'])
+                                .round({'Peak': 1, 'Mean': 1}),
+                                use_container_width=True,
+                                hide_index=True
+                            )
+                        with col2:
+                            st.markdown("**Exceedance hours per year**")
+                            yearly = exceedance[exceedance['Pollutant'] == selected_pollutant.upper()]
+                            st.dataframe(
+                                yearly.drop(columns=['Station', 'Pollutant', 'Standard']).round({'Share %': 1}),
+                                use_container_width=True,
+                                hide_index=True
+                            )
+
+        except Exception as e:
+            st.error(f"Error while creating pollutant chart: {e}")
+    else:
+        st.info("No pollutant data available to plot.")
 
+pollutant_timeline()
 
 # ==== CHART 2: MULTI-POLLUTANT COMPARISON ====
-st.subheader("2️⃣ Multi-Pollutant Comparison")
-
-pollutants = ['pm2.5', 'pm10', 'no2', 'so2', 'o3', 'co']
-available_pollutants = [p for p in pollutants if p in df_filtered.columns and not df_filtered[p].isnull().all()]
-
-if len(available_pollutants) >= 2:
-    selected_pollutants = st.multiselect(
-        "Select pollutants to compare",
-        available_pollutants,
-        default=available_pollutants[:min(3, len(available_pollutants))]
-    )
+@chart_section("chart2_comparison")
+def pollutant_comparison():
+    st.subheader("2️⃣ Multi-Pollutant Comparison")
+
+    pollutants = ['pm2.5', 'pm10', 'no2', 'so2', 'o3', 'co']
+    available_pollutants = [p for p in pollutants if p in present]
+
+    if len(available_pollutants) >= 2:
+        selected_pollutants = st.multiselect(
+            "Select pollutants to compare",
+            available_pollutants,
+            default=available_pollutants[:min(3, len(available_pollutants))]
+        )
     
-    if selected_pollutants:
-        fig2 = go.Figure()
+        if selected_pollutants:
+            fig2 = go.Figure()
+        
+            zoom_start, zoom_end = zoom_window("zoom_comparison", df_filtered['datetime'].iloc[0], df_filtered['datetime'].iloc[-1])
+            df_zoom = time_slice(df_filtered, zoom_start, zoom_end) if zoom_start is not None else df_filtered
+            backend2 = chart_backend(min(len(df_zoom), max_plot_points) * len(selected_pollutants), allow_density=False)
+            trace_type = go.Scattergl if backend2 == 'webgl' else go.Scatter
+            points2 = 0
         
-        for pollutant in selected_pollutants:
-            # Normalize to 0-100 scale for comparison
-            normalized = (df_filtered[pollutant] - df_filtered[pollutant].min()) / (df_filtered[pollutant].max() - df_filtered[pollutant].min()) * 100
+            for pollutant in selected_pollutants:
+                # LTTB keeps each line's shape with a few thousand points; only those are sent
+                keep = downsample(df_zoom['datetime'], df_zoom[pollutant], max_plot_points, method='lttb')
+                values = df_zoom[pollutant].iloc[keep]
             
-            fig2.add_trace(go.Scatter(
-                x=df_filtered['datetime'],
-                y=normalized,
-                name=pollutant.upper(),
-                mode='lines',
-                hovertemplate=f'<b>{pollutant.upper()}</b><br>Value: %{{customdata:.2f}}<br>Date: %{{x}}<extra></extra>',
-                customdata=df_filtered[pollutant]
-            ))
+                # Normalize to 0-100 scale for comparison
+                low, high = df_filtered[pollutant].min(), df_filtered[pollutant].max()
+                normalized = (values - low) / (high - low) * 100
+                points2 += len(keep)
+            
+                fig2.add_trace(trace_type(
+                    x=df_zoom['datetime'].iloc[keep],
+                    y=normalized,
+                    name=pollutant.upper(),
+                    mode='lines',
+                    hovertemplate=f'<b>{pollutant.upper()}</b><br>Value: %{{customdata:.2f}}<br>Date: %{{x}}<extra></extra>',
+                    customdata=values
+                ))
         
-        fig2.update_layout(
-            title="Normalized Pollutant Levels (0-100 scale)",
-            xaxis_title="Date & Time",
-            yaxis_title="Normalized Level (%)",
-            hovermode='x unified',
-            template='plotly_white',
-            height=450
-        )
+            fig2.update_layout(
+                title="Normalized Pollutant Levels (0-100 scale)",
+                xaxis_title="Date & Time",
+                yaxis_title="Normalized Level (%)",
+                hovermode='x unified',
+                template='plotly_white',
+                height=450
+            )
         
-        st.plotly_chart(fig2, use_container_width=True)
+            show_chart(fig2)
+            profiler.note(rows_out=points2)
+            payload_caption(fig2, backend2, points2)
         
-        with st.expander("ℹ️ Understanding this comparison"):
-            st.markdown("""
-            This chart **normalizes** all pollutants to a 0-100 scale so you can compare their trends.
+            with st.expander("ℹ️ Understanding this comparison"):
+                st.markdown("""
+                This chart **normalizes** all pollutants to a 0-100 scale so you can compare their trends.
             
-            - **0%** = Lowest value observed
-            - **100%** = Highest value observed
-            - Hover to see actual concentrations
+                - **0%** = Lowest value observed
+                - **100%** = Highest value observed
+                - Hover to see actual concentrations
             
-            **Common Pollutants:**
-            - **PM2.5/PM10**: Particulate matter from vehicles, industry
-            - **NO2**: Nitrogen dioxide from vehicle emissions
-            - **SO2**: Sulfur dioxide from coal/oil burning
-            - **O3**: Ground-level ozone (smog)
-            - **CO**: Carbon monoxide from incomplete combustion
-            """)
-else:
-    st.info("Not enough pollutant data available for comparison.")
+                **Common Pollutants:**
+                - **PM2.5/PM10**: Particulate matter from vehicles, industry
+                - **NO2**: Nitrogen dioxide from vehicle emissions
+                - **SO2**: Sulfur dioxide from coal/oil burning
+                - **O3**: Ground-level ozone (smog)
+                - **CO**: Carbon monoxide from incomplete combustion
+                """)
+    else:
+        st.info("Not enough pollutant data available for comparison.")
 
-# ==== CHART 3: AQI DISTRIBUTION ====
-st.subheader("3️⃣ Air Quality Index (AQI) Distribution")
+pollutant_comparison()
 
-if 'aqi' in df_filtered.columns and not df_filtered['aqi'].isnull().all():
-    # Create AQI category labels
-    df_filtered_aqi = df_filtered.dropna(subset=['aqi']).copy()
-    df_filtered_aqi['aqi_category'] = df_filtered_aqi['aqi'].apply(
-        lambda x: AQI_CATEGORIES.get(int(x), {}).get('label', 'Unknown')
-    )
-    
-        #  Build AQI distribution dynamically from your current AQI_CATEGORIES
-    df_filtered_aqi = df_filtered.dropna(subset=['aqi']).copy()
-    df_filtered_aqi['aqi_level'] = df_filtered_aqi['aqi'].astype(int).clip(1, len(AQI_CATEGORIES))
-    df_filtered_aqi['aqi_category'] = df_filtered_aqi['aqi_level'].map(lambda x: AQI_CATEGORIES[x]["label"])
-    df_filtered_aqi['aqi_color'] = df_filtered_aqi['aqi_level'].map(lambda x: AQI_CATEGORIES[x]["color"])
-
-    category_order = [AQI_CATEGORIES[i]["label"] for i in AQI_CATEGORIES]
-    color_map = {AQI_CATEGORIES[i]["label"]: AQI_CATEGORIES[i]["color"] for i in AQI_CATEGORIES}
-
-    fig3 = px.histogram(
-        df_filtered_aqi,
-        x='aqi_category',
-        title="Distribution of AQI Categories",
-        color='aqi_category',
-        color_discrete_map=color_map,
-        category_orders={'aqi_category': category_order}
-    )
+# ==== CHART 3: AQI DISTRIBUTION ====
+@chart_section("chart3_aqi")
+def aqi_distribution():
+    st.subheader("3️⃣ Air Quality Index (AQI) Distribution")
+
+    if 'aqi' in df_filtered.columns and not df_filtered['aqi'].isnull().all():
+        # Categories were assigned once per dataset by the vectorized AQI engine
+        df_filtered_aqi = df_filtered[['aqi_category']].dropna()
+
+        color_map = category_colors(aqi_standard)
+        category_order = list(color_map)
+
+        fig3 = px.histogram(
+            df_filtered_aqi,
+            x='aqi_category',
+            title="Distribution of AQI Categories",
+            color='aqi_category',
+            color_discrete_map=color_map,
+            category_orders={'aqi_category': category_order}
+        )
 
-    fig3.update_layout(
-        xaxis_title="AQI Category",
-        yaxis_title="Number of Records",
-        showlegend=False,
-        height=400
-    )
+        fig3.update_layout(
+            xaxis_title="AQI Category",
+            yaxis_title="Number of Records",
+            showlegend=False,
+            height=400
+        )
 
-    st.plotly_chart(fig3, use_container_width=True)
+        show_chart(fig3)
 
     
-    # AQI breakdown table
-    col1, col2 = st.columns(2)
+        # AQI breakdown table
+        col1, col2 = st.columns(2)
     
-    with col1:
-        aqi_counts = df_filtered_aqi['aqi_category'].value_counts()
-        st.write("**Category Breakdown:**")
-        for category in ["Good", "Fair", "Moderate", "Poor", "Very Poor"]:
-            if category in aqi_counts:
-                percentage = (aqi_counts[category] / len(df_filtered_aqi)) * 100
-                st.write(f"• {category}: {aqi_counts[category]} days ({percentage:.1f}%)")
+        with col1:
+            aqi_counts = df_filtered_aqi['aqi_category'].value_counts()
+            st.write("**Category Breakdown:**")
+            for category in category_order:
+                if aqi_counts.get(category, 0):
+                    percentage = (aqi_counts[category] / len(df_filtered_aqi)) * 100
+                    st.write(f"• {category}: {aqi_counts[category]:,} records ({percentage:.1f}%)")
     
-    with col2:
-        with st.expander("ℹ️ AQI Scale Reference"):
-            st.markdown("""
-            | AQI | Category | Health Impact |
-            |-----|----------|---------------|
-            | 1 (0-50) | Good | Minimal impact |
-            | 2 (51-100) | Fair | Acceptable for most |
-            | 3 (101-150) | Moderate | Sensitive groups affected |
-            | 4 (151-200) | Poor | Everyone may experience effects |
-            | 5 (201+) | Very Poor | Health alert |
-            """)
-else:
-    st.info("AQI data not available in the selected dataset.")
+        with col2:
+            with st.expander("ℹ️ AQI Scale Reference"):
+                st.markdown(
+                    f"**{STANDARDS[aqi_standard].label}** (computed from hourly concentrations)\n\n"
+                    "| AQI | Category |\n|-----|----------|\n"
+                    + "\n".join(f"| {r} | {c} |" for r, c in zip(AQI_RANGES, category_order))
+                )
+    else:
+        st.info("AQI data not available in the selected dataset.")
 
-# ==== CHART 4: SEASONAL PATTERNS ====
-st.subheader("4️⃣ Seasonal & Monthly Patterns")
+aqi_distribution()
 
-if 'pm2.5' in df_filtered.columns:
-    df_seasonal = df_filtered.copy()
-    df_seasonal['month'] = df_seasonal['datetime'].dt.month
-    df_seasonal['month_name'] = df_seasonal['datetime'].dt.strftime('%B')
-    df_seasonal['year'] = df_seasonal['datetime'].dt.year
-    
-    monthly_avg = df_seasonal.groupby('month_name')['pm2.5'].mean().reindex([
-        'January', 'February', 'March', 'April', 'May', 'June',
-        'July', 'August', 'September', 'October', 'November', 'December'
-    ])
-    
-    fig4 = go.Figure()
-    
-    fig4.add_trace(go.Bar(
-        x=monthly_avg.index,
-        y=monthly_avg.values,
-        marker_color='lightblue',
-        name='Average PM2.5'
-    ))
-    
-    fig4.update_layout(
-        title="Average PM2.5 by Month",
-        xaxis_title="Month",
-        yaxis_title="PM2.5 (µg/m³)",
-        template='plotly_white',
-        height=400
-    )
+# ==== CHART 4: SEASONAL PATTERNS ====
+@chart_section("chart4_monthly")
+def seasonal_patterns():
+    st.subheader("4️⃣ Seasonal & Monthly Patterns")
+
+    if 'pm2.5' in df_filtered.columns:
+        monthly_avg = queries.grouped_means('pm2.5', ['month'], range_start, range_end).reindex(range(1, 13))
+        monthly_avg.index = MONTH_NAMES
+    
+        fig4 = go.Figure()
+    
+        fig4.add_trace(go.Bar(
+            x=monthly_avg.index,
+            y=monthly_avg.values,
+            marker_color='lightblue',
+            name='Average PM2.5'
+        ))
+    
+        fig4.update_layout(
+            title="Average PM2.5 by Month",
+            xaxis_title="Month",
+            yaxis_title="PM2.5 (µg/m³)",
+            template='plotly_white',
+            height=400
+        )
     
-    st.plotly_chart(fig4, use_container_width=True)
+        show_chart(fig4)
     
-    with st.expander("ℹ️ Interpreting seasonal patterns"):
-        st.markdown("""
-        **Why seasonal variations matter:**
-        - **Winter (Dec-Feb)**: Higher pollution due to heating, coal burning, and temperature inversions
-        - **Spring (Mar-May)**: Moderate levels, occasional dust storms
-        - **Summer (Jun-Aug)**: Lower pollution but higher ozone due to heat
-        - **Autumn (Sep-Nov)**: Variable, harvest burning can spike pollution
+        with st.expander("ℹ️ Interpreting seasonal patterns"):
+            st.markdown("""
+            **Why seasonal variations matter:**
+            - **Winter (Dec-Feb)**: Higher pollution due to heating, coal burning, and temperature inversions
+            - **Spring (Mar-May)**: Moderate levels, occasional dust storms
+            - **Summer (Jun-Aug)**: Lower pollution but higher ozone due to heat
+            - **Autumn (Sep-Nov)**: Variable, harvest burning can spike pollution
         
-        **Beijing specifics**: Winter typically shows 2-3x higher PM2.5 than summer.
-        """)
+            **Beijing specifics**: Winter typically shows 2-3x higher PM2.5 than summer.
+            """)
 
-# ==== CHART 5: HEATMAP (HOUR x DAY) ====
-st.subheader("5️⃣ Pollution Heatmap: Hour of Day vs. Day of Week")
+seasonal_patterns()
 
-if 'pm2.5' in df_filtered.columns and len(df_filtered) > 100:
-    df_heatmap = df_filtered.copy()
-    df_heatmap['hour'] = df_heatmap['datetime'].dt.hour
-    df_heatmap['day_of_week'] = df_heatmap['datetime'].dt.day_name()
-    
-    heatmap_data = df_heatmap.pivot_table(
-        values='pm2.5',
-        index='day_of_week',
-        columns='hour',
-        aggfunc='mean'
-    )
-    
-    # Reorder days
-    day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    heatmap_data = heatmap_data.reindex([d for d in day_order if d in heatmap_data.index])
-    
-    fig5 = go.Figure(data=go.Heatmap(
-        z=heatmap_data.values,
-        x=heatmap_data.columns,
-        y=heatmap_data.index,
-        colorscale='YlOrRd',
-        hovertemplate='Day: %{y}<br>Hour: %{x}:00<br>PM2.5: %{z:.1f} µg/m³<extra></extra>'
-    ))
-    
-    fig5.update_layout(
-        title="Average PM2.5 by Day of Week and Hour",
-        xaxis_title="Hour of Day",
-        yaxis_title="Day of Week",
-        height=400
-    )
+# ==== CHART 5: HEATMAP (HOUR x DAY) ====
+@chart_section("chart5_heatmap")
+def hour_weekday_heatmap():
+    st.subheader("5️⃣ Pollution Heatmap: Hour of Day vs. Day of Week")
+
+    if 'pm2.5' in df_filtered.columns and len(df_filtered) > 100:
+        heatmap_data = queries.grouped_means('pm2.5', ['weekday', 'hour'], range_start, range_end).unstack('hour')
+        heatmap_data = heatmap_data.dropna(how='all').dropna(axis=1, how='all')
+    
+        # Label days (weekday 0 = Monday)
+        heatmap_data.index = weekday_names(heatmap_data.index)
+    
+        fig5 = go.Figure(data=go.Heatmap(
+            z=heatmap_data.values,
+            x=heatmap_data.columns,
+            y=heatmap_data.index,
+            colorscale='YlOrRd',
+            hovertemplate='Day: %{y}<br>Hour: %{x}:00<br>PM2.5: %{z:.1f} µg/m³<extra></extra>'
+        ))
+    
+        fig5.update_layout(
+            title="Average PM2.5 by Day of Week and Hour",
+            xaxis_title="Hour of Day",
+            yaxis_title="Day of Week",
+            height=400
+        )
     
-    st.plotly_chart(fig5, use_container_width=True)
+        show_chart(fig5)
     
-    with st.expander("ℹ️ How to use this heatmap"):
-        st.markdown("""
-        **Darker colors = Higher pollution levels**
+        with st.expander("ℹ️ How to use this heatmap"):
+            st.markdown("""
+            **Darker colors = Higher pollution levels**
         
-        This shows patterns in pollution by:
-        - **Weekday**: Are weekends cleaner than weekdays?
-        - **Hour**: When is pollution highest during the day?
+            This shows patterns in pollution by:
+            - **Weekday**: Are weekends cleaner than weekdays?
+            - **Hour**: When is pollution highest during the day?
         
-        **Common patterns:**
-        - Morning rush hour (7-9 AM): Traffic emissions spike
-        - Evening rush hour (5-7 PM): Another traffic peak
-        - Weekends: Often lower due to reduced industrial activity
-        """)
-
-# ==== CHART 6: CORRELATION MATRIX ====
-st.subheader("6️⃣ Pollutant Correlation Analysis")
+            **Common patterns:**
+            - Morning rush hour (7-9 AM): Traffic emissions spike
+            - Evening rush hour (5-7 PM): Another traffic peak
+            - Weekends: Often lower due to reduced industrial activity
+            """)
 
-numeric_cols = ['pm2.5', 'pm10', 'no2', 'so2', 'o3', 'co', 'aqi']
-available_numeric = [col for col in numeric_cols if col in df_filtered.columns]
+hour_weekday_heatmap()
 
-if len(available_numeric) >= 3:
-    corr_matrix = df_filtered[available_numeric].corr()
-    
-    fig6 = go.Figure(data=go.Heatmap(
-        z=corr_matrix.values,
-        x=[c.upper() for c in corr_matrix.columns],
-        y=[c.upper() for c in corr_matrix.index],
-        colorscale='RdBu',
-        zmid=0,
-        text=corr_matrix.values.round(2),
-        texttemplate='%{text}',
-        textfont={"size": 10},
-        hovertemplate='%{x} vs %{y}<br>Correlation: %{z:.2f}<extra></extra>'
-    ))
-    
-    fig6.update_layout(
-        title="Correlation Between Pollutants",
-        height=500,
-        xaxis_title="",
-        yaxis_title=""
-    )
+# ==== CHART 6: CORRELATION MATRIX ====
+@chart_section("chart6_correlation")
+def correlation_matrix():
+    st.subheader("6️⃣ Pollutant Correlation Analysis")
+
+    if len(available_numeric) >= 3:
+        corr_matrix = correlations.pearson(range_start, range_end).loc[available_numeric, available_numeric]
+    
+        fig6 = go.Figure(data=go.Heatmap(
+            z=corr_matrix.values,
+            x=[c.upper() for c in corr_matrix.columns],
+            y=[c.upper() for c in corr_matrix.index],
+            colorscale='RdBu',
+            zmid=0,
+            text=corr_matrix.values.round(2),
+            texttemplate='%{text}',
+            textfont={"size": 10},
+            hovertemplate='%{x} vs %{y}<br>Correlation: %{z:.2f}<extra></extra>'
+        ))
+    
+        fig6.update_layout(
+            title="Correlation Between Pollutants",
+            height=500,
+            xaxis_title="",
+            yaxis_title=""
+        )
     
-    st.plotly_chart(fig6, use_container_width=True)
+        show_chart(fig6)
     
-    with st.expander("ℹ️ Understanding correlations"):
-        st.markdown("""
-        **Correlation values range from -1 to +1:**
-        - **+1**: Perfect positive correlation (both increase together)
-        - **0**: No correlation
-        - **-1**: Perfect negative correlation (one increases, other decreases)
+        with st.expander("ℹ️ Understanding correlations"):
+            st.markdown("""
+            **Correlation values range from -1 to +1:**
+            - **+1**: Perfect positive correlation (both increase together)
+            - **0**: No correlation
+            - **-1**: Perfect negative correlation (one increases, other decreases)
         
-        **What to look for:**
-        - PM2.5 and PM10 are usually highly correlated (both are particulate matter)
-        - NO2 and CO often correlate (both from traffic)
-        - O3 may negatively correlate with others (forms through different chemistry)
+            **What to look for:**
+            - PM2.5 and PM10 are usually highly correlated (both are particulate matter)
+            - NO2 and CO often correlate (both from traffic)
+            - O3 may negatively correlate with others (forms through different chemistry)
         
-        **Strong correlations (>0.7)** suggest pollutants share common sources.
-        """)
-else:
-    st.info("Not enough pollutant data for correlation analysis.")
+            **Strong correlations (>0.7)** suggest pollutants share common sources.
+            """)
+    else:
+        st.info("Not enough pollutant data for correlation analysis.")
+
+correlation_matrix()
 
 # ==== CHART 7: POLLUTANT SCATTERPLOT ====
-st.subheader("7️⃣ Pollutant Relationship Scatterplot")
+@chart_section("chart7_scatter")
+def pollutant_scatter():
+    st.subheader("7️⃣ Pollutant Relationship Scatterplot")
 
-if len(available_numeric) >= 2:
-    col1, col2, col3 = st.columns([2, 2, 1])
-    
-    with col1:
-        x_pollutant = st.selectbox(
-            "X-axis pollutant",
-            available_numeric,
-            index=0,
-            key="scatter_x"
-        )
+    if len(available_numeric) >= 2:
+        col1, col2, col3 = st.columns([2, 2, 1])
     
-    with col2:
-        y_pollutant = st.selectbox(
-            "Y-axis pollutant",
-            available_numeric,
-            index=min(1, len(available_numeric)-1),
-            key="scatter_y"
-        )
-    
-    with col3:
-        color_by = st.selectbox(
-            "Color by",
-            ["None", "AQI Category", "Year", "Month", "Source"],
-            key="scatter_color"
-        )
+        with col1:
+            x_pollutant = st.selectbox(
+                "X-axis pollutant",
+                available_numeric,
+                index=0,
+                key="scatter_x"
+            )
     
-    # Prepare data for scatterplot
-    scatter_df = df_filtered[[x_pollutant, y_pollutant, 'datetime']].dropna()
+        with col2:
+            y_pollutant = st.selectbox(
+                "Y-axis pollutant",
+                available_numeric,
+                index=min(1, len(available_numeric)-1),
+                key="scatter_y"
+            )
     
-    if not scatter_df.empty and x_pollutant != y_pollutant:
-        # Add color dimension
-        color_col = None
-        if color_by == "AQI Category" and 'aqi' in df_filtered.columns:
-            scatter_df = scatter_df.join(df_filtered['aqi'])
-            scatter_df['aqi_category'] = scatter_df['aqi'].apply(
-                lambda x: AQI_CATEGORIES.get(int(x), {}).get('label', 'Unknown') if pd.notna(x) else 'Unknown'
+        with col3:
+            color_by = st.selectbox(
+                "Color by",
+                ["None", "AQI Category", "Year", "Month", "Source"],
+                key="scatter_color"
             )
-            color_col = 'aqi_category'
-        elif color_by == "Year":
-            scatter_df['year'] = scatter_df['datetime'].dt.year
-            color_col = 'year'
-        elif color_by == "Month":
-            scatter_df['month'] = scatter_df['datetime'].dt.month_name()
-            color_col = 'month'
-        elif color_by == "Source" and 'source' in df_filtered.columns:
-            scatter_df = scatter_df.join(df_filtered['source'])
-            color_col = 'source'
+    
+        # Prepare data for scatterplot
+        scatter_df = scatter_frame(df_filtered, view_key, x_pollutant, y_pollutant)
+        calendar = df_filtered[['local_year', 'local_month_name']]
+    
+        if not scatter_df.empty and x_pollutant != y_pollutant:
+            # Add color dimension
+            color_col = None
+            if color_by == "AQI Category" and 'aqi' in df_filtered.columns:
+                scatter_df = scatter_df.join(df_filtered['aqi_category'])
+                scatter_df['aqi_category'] = scatter_df['aqi_category'].cat.add_categories('Unknown').fillna('Unknown')
+                color_col = 'aqi_category'
+            elif color_by == "Year":
+                scatter_df = scatter_df.join(calendar['local_year'].rename('year'))
+                color_col = 'year'
+            elif color_by == "Month":
+                scatter_df = scatter_df.join(calendar['local_month_name'].rename('month'))
+                color_col = 'month'
+            elif color_by == "Source" and 'source' in df_filtered.columns:
+                scatter_df = scatter_df.join(df_filtered['source'])
+                color_col = 'source'
         
-        # Create scatterplot
-        fig7 = px.scatter(
-            scatter_df,
-            x=x_pollutant,
-            y=y_pollutant,
-            color=color_col,
-            title=f"Relationship between {x_pollutant.upper()} and {y_pollutant.upper()}",
-            labels={
-                x_pollutant: f"{x_pollutant.upper()} Concentration",
-                y_pollutant: f"{y_pollutant.upper()} Concentration"
-            },
-            opacity=0.6,
-            template='plotly_white',
-            hover_data={'datetime': '|%Y-%m-%d %H:%M'}
-        )
+            # Create scatterplot; large clouds go to WebGL or a server-side density heatmap
+            backend7 = chart_backend(len(scatter_df))
+            if backend7 == 'density':
+                x_centers, y_centers, counts = binned_density(scatter_df[x_pollutant], scatter_df[y_pollutant])
+                fig7 = go.Figure(go.Heatmap(
+                    x=x_centers,
+                    y=y_centers,
+                    z=np.log10(counts),
+                    colorscale='Viridis',
+                    colorbar=dict(title='log₁₀ points'),
+                    hovertemplate=f'{x_pollutant.upper()}: %{{x:.1f}}<br>{y_pollutant.upper()}: %{{y:.1f}}<br>log₁₀ points: %{{z:.2f}}<extra></extra>'
+                ))
+                fig7.update_layout(
+                    title=f"Relationship between {x_pollutant.upper()} and {y_pollutant.upper()} (point density)",
+                    xaxis_title=f"{x_pollutant.upper()} Concentration",
+                    yaxis_title=f"{y_pollutant.upper()} Concentration",
+                    template='plotly_white'
+                )
+            else:
+                fig7 = px.scatter(
+                    scatter_df,
+                    x=x_pollutant,
+                    y=y_pollutant,
+                    color=color_col,
+                    color_discrete_map=category_colors(aqi_standard) if color_col == 'aqi_category' else None,
+                    title=f"Relationship between {x_pollutant.upper()} and {y_pollutant.upper()}",
+                    labels={
+                        x_pollutant: f"{x_pollutant.upper()} Concentration",
+                        y_pollutant: f"{y_pollutant.upper()} Concentration"
+                    },
+                    opacity=0.6,
+                    template='plotly_white',
+                    hover_data={'datetime': '|%Y-%m-%d %H:%M'},
+                    render_mode='webgl' if backend7 == 'webgl' else 'svg'
+                )
         
-        # Add trendline
-        if len(scatter_df) > 10:
-            from scipy import stats
-            slope, intercept, r_value, p_value, std_err = stats.linregress(
-                scatter_df[x_pollutant], 
-                scatter_df[y_pollutant]
-            )
-            line_x = np.array([scatter_df[x_pollutant].min(), scatter_df[x_pollutant].max()])
-            line_y = slope * line_x + intercept
+            # Trendline and correlation come from the per-day sufficient statistics
+            slope, intercept, r_value, _ = correlations.linregress(x_pollutant, y_pollutant, range_start, range_end)
+        
+            # Add trendline
+            if len(scatter_df) > 10 and pd.notna(slope):
+                line_x = np.array([scatter_df[x_pollutant].min(), scatter_df[x_pollutant].max()])
+                line_y = slope * line_x + intercept
             
-            fig7.add_trace(go.Scatter(
-                x=line_x,
-                y=line_y,
-                mode='lines',
-                name=f'Trendline (R²={r_value**2:.3f})',
-                line=dict(color='red', dash='dash', width=2)
-            ))
+                fig7.add_trace(go.Scatter(
+                    x=line_x,
+                    y=line_y,
+                    mode='lines',
+                    name=f'Trendline (R²={r_value**2:.3f})',
+                    line=dict(color='red', dash='dash', width=2)
+                ))
         
-        fig7.update_layout(
-            height=500,
-            hovermode='closest'
-        )
+            fig7.update_layout(
+                height=500,
+                hovermode='closest'
+            )
         
-        st.plotly_chart(fig7, use_container_width=True)
+            show_chart(fig7)
+            profiler.note(rows_out=len(scatter_df))
+            if backend7 == 'density' and color_col:
+                st.caption("Density view shows point counts; switch the rendering backend to see the color grouping.")
+            payload_caption(fig7, backend7, len(scatter_df))
         
-        # Calculate and display correlation
-        correlation = scatter_df[[x_pollutant, y_pollutant]].corr().iloc[0, 1]
+            # Calculate and display correlation
+            correlation = r_value
         
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.metric("Correlation Coefficient", f"{correlation:.3f}")
-        with col2:
-            relationship = "Strong" if abs(correlation) > 0.7 else "Moderate" if abs(correlation) > 0.4 else "Weak"
-            st.metric("Relationship Strength", relationship)
-        with col3:
-            st.metric("Data Points", f"{len(scatter_df):,}")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Correlation Coefficient", f"{correlation:.3f}")
+            with col2:
+                relationship = "Strong" if abs(correlation) > 0.7 else "Moderate" if abs(correlation) > 0.4 else "Weak"
+                st.metric("Relationship Strength", relationship)
+            with col3:
+                st.metric("Data Points", f"{len(scatter_df):,}")
         
-        with st.expander("ℹ️ Understanding the scatterplot"):
-            st.markdown("""
-            **How to interpret:**
-            - **Each dot** represents a single measurement
-            - **Upward trend**: Positive correlation (both increase together)
-            - **Downward trend**: Negative correlation (one increases, other decreases)
-            - **Scattered pattern**: Weak or no correlation
+            with st.expander("ℹ️ Understanding the scatterplot"):
+                st.markdown("""
+                **How to interpret:**
+                - **Each dot** represents a single measurement
+                - **Upward trend**: Positive correlation (both increase together)
+                - **Downward trend**: Negative correlation (one increases, other decreases)
+                - **Scattered pattern**: Weak or no correlation
             
-            **Correlation strength:**
-            - **0.7 to 1.0**: Strong positive relationship
-            - **0.4 to 0.7**: Moderate positive relationship
-            - **0 to 0.4**: Weak relationship
-            - **Negative values**: Inverse relationship
+                **Correlation strength:**
+                - **0.7 to 1.0**: Strong positive relationship
+                - **0.4 to 0.7**: Moderate positive relationship
+                - **0 to 0.4**: Weak relationship
+                - **Negative values**: Inverse relationship
             
-            **Common patterns:**
-            - PM2.5 vs PM10: Usually strong positive (both particulate matter)
-            - NO2 vs CO: Moderate positive (both from traffic)
-            - O3 vs NO2: Often negative (O3 forms when NO2 breaks down)
+                **Common patterns:**
+                - PM2.5 vs PM10: Usually strong positive (both particulate matter)
+                - NO2 vs CO: Moderate positive (both from traffic)
+                - O3 vs NO2: Often negative (O3 forms when NO2 breaks down)
             
-            **Red dashed line** = Linear regression trendline with R² value
-            """)
+                **Red dashed line** = Linear regression trendline with R² value
+                """)
+        else:
+            st.info("Please select two different pollutants with available data.")
     else:
-        st.info("Please select two different pollutants with available data.")
-else:
-    st.info("Not enough pollutant data available for scatterplot analysis.")
+        st.info("Not enough pollutant data available for scatterplot analysis.")
+
+pollutant_scatter()
 
 # ==== CHART 8: YEAR-OVER-YEAR COMPARISON ====
-st.subheader("8️⃣ Year-over-Year Trend Analysis")
+@chart_section("chart8_year_over_year")
+def year_over_year():
+    st.subheader("8️⃣ Year-over-Year Trend Analysis")
 
-if 'pm2.5' in df_filtered.columns:
-    df_yearly = df_filtered.copy()
-    df_yearly['year'] = df_yearly['datetime'].dt.year
-    df_yearly['month'] = df_yearly['datetime'].dt.month
+    if 'pm2.5' in df_filtered.columns:
+        yearly_monthly = queries.grouped_means('pm2.5', ['year', 'month'], range_start, range_end)
     
-    years_available = sorted(df_yearly['year'].unique())
+        years_available = sorted(yearly_monthly.index.get_level_values('year').unique())
     
-    if len(years_available) >= 2:
-        yearly_monthly = df_yearly.groupby(['year', 'month'])['pm2.5'].mean().reset_index()
+        if len(years_available) >= 2:
+            yearly_monthly = yearly_monthly.reset_index()
         
-        fig7 = px.line(
-            yearly_monthly,
-            x='month',
-            y='pm2.5',
-            color='year',
-            title="PM2.5 Trends: Year-over-Year Comparison",
-            labels={'month': 'Month', 'pm2.5': 'PM2.5 (µg/m³)', 'year': 'Year'},
-            markers=True
-        )
+            fig7 = px.line(
+                yearly_monthly,
+                x='month',
+                y='pm2.5',
+                color='year',
+                title="PM2.5 Trends: Year-over-Year Comparison",
+                labels={'month': 'Month', 'pm2.5': 'PM2.5 (µg/m³)', 'year': 'Year'},
+                markers=True
+            )
         
-        fig7.update_xaxes(
-            tickmode='array',
-            tickvals=list(range(1, 13)),
-            ticktext=['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-        )
+            fig7.update_xaxes(
+                tickmode='array',
+                tickvals=list(range(1, 13)),
+                ticktext=['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+            )
         
-        fig7.update_layout(
-            height=450,
-            hovermode='x unified',
-            template='plotly_white'
-        )
+            fig7.update_layout(
+                height=450,
+                hovermode='x unified',
+                template='plotly_white'
+            )
         
-        st.plotly_chart(fig7, use_container_width=True)
+            show_chart(fig7)
         
-        # Calculate year-over-year improvement
-        yearly_avg = df_yearly.groupby('year')['pm2.5'].mean()
+            # Calculate year-over-year improvement
+            yearly_avg = queries.grouped_means('pm2.5', ['year'], range_start, range_end)
         
-        col1, col2, col3 = st.columns(3)
+            col1, col2, col3, col4 = st.columns(4)
+            periods, monthly, trend = view_trend(rollups, view_key, 'pm2.5', range_start, range_end)
         
-        if len(yearly_avg) >= 2:
-            first_year = yearly_avg.index[0]
-            last_year = yearly_avg.index[-1]
-            improvement = ((yearly_avg[first_year] - yearly_avg[last_year]) / yearly_avg[first_year]) * 100
+            if len(yearly_avg) >= 2:
+                first_year = yearly_avg.index[0]
+                last_year = yearly_avg.index[-1]
+                improvement = ((yearly_avg[first_year] - yearly_avg[last_year]) / yearly_avg[first_year]) * 100
             
-            with col1:
-                st.metric(f"Avg PM2.5 ({first_year})", f"{yearly_avg[first_year]:.1f} µg/m³")
-            with col2:
-                st.metric(f"Avg PM2.5 ({last_year})", f"{yearly_avg[last_year]:.1f} µg/m³")
-            with col3:
-                st.metric("Overall Change", f"{improvement:+.1f}%", delta_color="inverse")
+                with col1:
+                    st.metric(f"Avg PM2.5 ({first_year})", f"{yearly_avg[first_year]:.1f} µg/m³")
+                with col2:
+                    st.metric(f"Avg PM2.5 ({last_year})", f"{yearly_avg[last_year]:.1f} µg/m³")
+                with col3:
+                    st.metric("Overall Change", f"{improvement:+.1f}%", delta_color="inverse")
+                with col4:
+                    if np.isfinite(trend['slope'][0]):
+                        st.metric(
+                            "Trend (Theil–Sen)",
+                            f"{trend['slope'][0]:+.1f} µg/m³/yr",
+                            f"{'significant' if trend['p'][0] < 0.05 else 'not significant'} (p = {trend['p'][0]:.3f})",
+                            delta_color="off",
+                            help=f"Median slope of the deseasonalized monthly means; "
+                                 f"95% CI {trend['low'][0]:+.1f} to {trend['high'][0]:+.1f} µg/m³/yr, Mann–Kendall test"
+                        )
+
+            # ---- Seasonal decomposition of the monthly means ----
+            if np.isfinite(trend['slope'][0]):
+                fig8 = go.Figure()
+                fig8.add_trace(go.Scatter(x=periods, y=monthly, mode='lines+markers', name='Monthly mean',
+                                          line=dict(color='lightgray'), marker=dict(size=4, color='gray')))
+                fig8.add_trace(go.Scatter(x=periods, y=monthly - trend['seasonal'][0], mode='lines', name='Deseasonalized',
+                                          line=dict(color='steelblue', width=1)))
+                fig8.add_trace(go.Scatter(x=periods, y=trend['trend'][0], mode='lines', name='12-month moving average',
+                                          line=dict(color='navy', width=3)))
+                fig8.add_trace(go.Scatter(x=periods, y=trend['intercept'][0] + trend['slope'][0] * trend['years'],
+                                          mode='lines', name=f"Theil–Sen ({trend['slope'][0]:+.1f}/yr)",
+                                          line=dict(color='red', dash='dash', width=2)))
+                fig8.update_layout(
+                    title="PM2.5 Long-Term Trend: Seasonal Decomposition",
+                    xaxis_title="Month",
+                    yaxis_title="PM2.5 (µg/m³)",
+                    height=400,
+                    hovermode='x unified',
+                    template='plotly_white'
+                )
+                show_chart(fig8)
+
+            with st.expander("📉 Trends by station and pollutant"):
+                trend_freq = st.radio("Aggregate", ["month", "day"], horizontal=True, format_func=str.title, key="trend_freq")
+                table = station_trends(store, source_key, str(df['datetime'].dt.tz or 'UTC'), trend_freq)
+                st.dataframe(
+                    table.drop(columns=['Kendall S']).round({'Mean': 1, 'Slope /yr': 2, 'Slope low': 2, 'Slope high': 2,
+                                                              'Change %/yr': 1, 'Z': 2, 'p-value': 4}),
+                    use_container_width=True,
+                    hide_index=True
+                )
+                st.caption("Theil–Sen slopes and Mann–Kendall tests on deseasonalized means over the whole dataset; "
+                           "trends are significant at p < 0.05.")
         
-        with st.expander("ℹ️ Analyzing long-term trends"):
-            st.markdown("""
-            **This chart helps answer:**
-            - Is air quality improving over the years?
-            - Are seasonal patterns changing?
-            - Were policy interventions effective?
+            with st.expander("ℹ️ Analyzing long-term trends"):
+                st.markdown("""
+                **This chart helps answer:**
+                - Is air quality improving over the years?
+                - Are seasonal patterns changing?
+                - Were policy interventions effective?
             
-            **Beijing's improvements:**
-            - 2013-2017: Aggressive coal-to-gas conversion
-            - 2017-2020: ~35% reduction in PM2.5
-            - 2020: COVID lockdowns showed temporary improvements
-            """)
-    else:
-        st.info("Need data from multiple years for year-over-year comparison.")
+                **Beijing's improvements:**
+                - 2013-2017: Aggressive coal-to-gas conversion
+                - 2017-2020: ~35% reduction in PM2.5
+                - 2020: COVID lockdowns showed temporary improvements
+                """)
+        else:
+            st.info("Need data from multiple years for year-over-year comparison.")
+
+year_over_year()
 
 # ==== EVENT TIMELINE VISUALIZATION ====
-st.subheader("9️⃣ Major Events Timeline")
+@chart_section("chart9_events")
+def event_timeline():
+    st.subheader("9️⃣ Major Events Timeline")
 
-if events:
-    timeline_data = []
+    if events:
+        timeline_df = event_table(rollups, events)
     
-    for date_str, event_info in sorted(events.items()):
-        try:
-            event_date = pd.to_datetime(date_str)
-            
-            # Find PM2.5 near this date if available
-            pm25_value = None
-            if 'pm2.5' in df.columns:
-                nearby_data = df[
-                    (df['datetime'].dt.date >= event_date.date() - timedelta(days=3)) &
-                    (df['datetime'].dt.date <= event_date.date() + timedelta(days=3))
-                ]
-                if not nearby_data.empty:
-                    pm25_value = nearby_data['pm2.5'].mean()
-            
-            timeline_data.append({
-                'Date': date_str,
-                'Event': event_info["short"],
-                'Description': event_info["detail"],
-                'Avg PM2.5 (±3 days)': f"{pm25_value:.1f}" if pm25_value else "N/A"
-            })
-        except Exception:
-            continue
-    
-    if timeline_data:
-        timeline_df = pd.DataFrame(timeline_data)
-        st.dataframe(timeline_df, use_container_width=True, hide_index=True)
+        if not timeline_df.empty:
+            st.dataframe(timeline_df, use_container_width=True, hide_index=True)
         
-        with st.expander("ℹ️ Event impact analysis"):
-            st.markdown("""
-            **How to interpret:**
-            - Compare PM2.5 levels before/after major events
-            - Policy events (e.g., coal ban) should show gradual improvement
-            - Temporary events (Olympics, lockdowns) show short-term effects
+            with st.expander("ℹ️ Event impact analysis"):
+                st.markdown("""
+                **How to interpret:**
+                - Compare PM2.5 levels before/after major events
+                - Policy events (e.g., coal ban) should show gradual improvement
+                - Temporary events (Olympics, lockdowns) show short-term effects
             
-            **Expected patterns:**
-            - **Lockdowns/restrictions**: 20-40% PM2.5 reduction
-            - **Policy changes**: Gradual improvement over months
-            - **Weather events**: Sudden spikes or drops
-            """)
-else:
-    st.info("No events configured. Add events in the sidebar to see their impact!")
+                **Expected patterns:**
+                - **Lockdowns/restrictions**: 20-40% PM2.5 reduction
+                - **Policy changes**: Gradual improvement over months
+                - **Weather events**: Sudden spikes or drops
+                """)
+
+        # ---- Before/after impact with bootstrap confidence intervals ----
+        st.markdown("**Event impact: before vs. after**")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            impact_pollutant = st.selectbox(
+                "Pollutant",
+                [c for c in available_numeric if c in rollups.columns],
+                key="impact_pollutant"
+            )
+        with col2:
+            impact_days = st.slider("Days before / after", min_value=1, max_value=30, value=7, key="impact_days")
+        with col3:
+            impact_boot = st.select_slider("Bootstrap resamples", options=[200, 500, 1000, 2000], value=1000, key="impact_boot")
+
+        impact = event_impacts(
+            rollups, (dataset_key, selected_timezone), json.dumps(events, sort_keys=True), impact_days, impact_boot
+        )
+        impact = impact[impact['Pollutant'] == str(impact_pollutant).upper()].dropna(subset=['Change'])
+        if impact.empty:
+            st.info("No event has data on both sides of it.")
+        else:
+            impact_dates = pd.to_datetime(impact['Date'], format='mixed')
+            fig9 = go.Figure(go.Scatter(
+                x=impact_dates,
+                y=impact['Change'],
+                mode='markers',
+                marker=dict(color=np.where(impact['Significant'], 'crimson', 'gray'), size=9),
+                error_y=dict(
+                    type='data',
+                    symmetric=False,
+                    array=impact['CI high'] - impact['Change'],
+                    arrayminus=impact['Change'] - impact['CI low']
+                ),
+                customdata=impact[['Event', 'Before', 'After']],
+                hovertemplate='<b>%{customdata[0]}</b><br>Before: %{customdata[1]:.1f}<br>After: %{customdata[2]:.1f}<br>Change: %{y:+.1f}<extra></extra>'
+            ))
+            fig9.add_hline(y=0, line_color='black', line_width=1)
+            fig9.update_layout(
+                title=f"Change in {str(impact_pollutant).upper()} after each event ({impact_days} days after vs. before, 95% CI)",
+                xaxis_title="Event date",
+                yaxis_title="After − before",
+                template='plotly_white',
+                height=400
+            )
+            show_chart(fig9)
+            profiler.note(rows_out=len(impact))
+            st.caption(f"{int(impact['Significant'].sum())} of {len(impact)} events show a change whose 95% interval excludes zero (red).")
+            st.dataframe(
+                impact.drop(columns=['Pollutant']).round(2),
+                use_container_width=True,
+                hide_index=True
+            )
+    else:
+        st.info("No events configured. Add events in the sidebar to see their impact!")
+
+event_timeline()
+
+# ==== PM2.5 FORECAST ====
+@chart_section("forecast")
+def pm25_forecast():
+    st.subheader("🔟 PM2.5 Forecast")
+
+    if 'pm2.5' not in df_filtered.columns or df_filtered['pm2.5'].isna().all():
+        st.info("Forecasts need PM2.5 readings in the selected range.")
+        return
+
+    model = None
+    if os.path.exists(MODEL_PATH):
+        try:
+            model = saved_forecast_model(MODEL_PATH, os.path.getmtime(MODEL_PATH))
+        except Exception as e:
+            st.warning(f"Could not load the saved forecast model: {str(e)}")
+        if model is not None and model.missing_inputs(df):
+            model = None
+    model_source = "saved model"
+    if model is None:
+        model = view_forecast_model(df, dataset_key, selected_timezone)
+        model_source = "model trained on this dataset"
+
+    forecast_hours = st.select_slider(
+        "Forecast horizon (hours)",
+        options=[h for h in (24, 36, 48, 60, 72) if h <= model.horizon],
+        value=min(72, model.horizon),
+        key="forecast_hours"
+    )
+    # Forecast from the last reading in the selected range, so past ranges can be checked against what happened
+    origin = df_filtered['datetime'].iloc[np.flatnonzero(df_filtered['pm2.5'].notna().to_numpy())[-1]]
+    try:
+        forecast, filled = model.predict(df, origin)
+    except ValueError as e:
+        st.warning(str(e))
+        return
+    forecast = forecast.iloc[:forecast_hours]
+    profiler.note(rows_out=len(forecast))
+
+    observed = pollutant_frame(
+        time_slice(df, origin - pd.Timedelta(days=7), origin + pd.Timedelta(hours=forecast_hours + 1)),
+        (view_key, origin, forecast_hours), 'pm2.5'
+    )
+    actual = observed[observed['datetime'] > origin]
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Next 24 h mean", f"{forecast['forecast'].iloc[:24].mean():.1f} µg/m³")
+    with col2:
+        peak = forecast['forecast'].idxmax()
+        st.metric("Forecast peak", f"{forecast['forecast'].iloc[peak]:.1f} µg/m³",
+                  forecast['datetime'].iloc[peak].strftime('%a %H:%M'), delta_color="off")
+    with col3:
+        if not actual.empty:
+            matched = forecast.merge(actual, on='datetime')
+            st.metric("Error vs. observed (MAE)", f"{(matched['forecast'] - matched['pm2.5']).abs().mean():.1f} µg/m³",
+                      f"{len(matched)} hours observed", delta_color="off")
+        else:
+            st.metric("Origin", origin.strftime('%Y-%m-%d %H:%M'))
+
+    fig10 = go.Figure()
+    fig10.add_trace(go.Scatter(x=forecast['datetime'], y=forecast['high'], mode='lines', line=dict(width=0),
+                               showlegend=False, hoverinfo='skip'))
+    fig10.add_trace(go.Scatter(x=forecast['datetime'], y=forecast['low'], mode='lines', line=dict(width=0),
+                               fill='tonexty', fillcolor='rgba(220, 20, 60, 0.15)', name='80% interval'))
+    fig10.add_trace(go.Scatter(x=observed['datetime'], y=observed['pm2.5'], mode='lines', name='Observed',
+                               line=dict(color='gray', width=1.5)))
+    fig10.add_trace(go.Scatter(x=forecast['datetime'], y=forecast['forecast'], mode='lines', name='Forecast',
+                               line=dict(color='crimson', width=2.5, dash='dash')))
+    fig10.add_vline(x=origin, line_dash='dot', line_color='black')
+    fig10.update_layout(
+        title=f"PM2.5 forecast for the next {forecast_hours} hours from {origin.strftime('%Y-%m-%d %H:%M')}",
+        xaxis_title="Date",
+        yaxis_title="PM2.5 (µg/m³)",
+        height=450,
+        hovermode='x unified',
+        template='plotly_white'
+    )
+    show_chart(fig10)
+    st.caption(
+        f"Ridge regression on lagged PM2.5 and weather ({model_source}, {model.meta['rows']:,} hours, "
+        f"{model.meta['first'][:10]} to {model.meta['last'][:10]})."
+        + (f" Missing at the origin, replaced by their average: {', '.join(filled)}." if filled else "")
+    )
+
+    with st.expander("ℹ️ About the forecast model"):
+        st.markdown(f"""
+        **How it works:**
+        - One linear model per hour ahead, fitted on PM2.5 over the previous 2 days and its daily and 3-day means
+        - Weather at the origin (dew point, temperature, pressure, wind, precipitation) and its 24-hour change
+        - Hour of day and season, so the model learns the daily cycle and winter heating
+        - The shaded band spans the 10th to 90th percentile of past errors at each lead time
+
+        **Train it offline** on a dataset with meteorology, and check its accuracy against persistence:
+        ```
+        python -m airquality train data/beijing_historical.csv --backtest
+        ```
+        The dashboard loads `{MODEL_PATH}` when its weather columns match the data, else trains on the loaded dataset.
+        """)
+        st.dataframe(model.coefficients().round(3), use_container_width=True)
+
+pm25_forecast()
 
 # ==== STATISTICAL SUMMARY TABLE ====
+profiler.section("summary_tables", len(df_filtered))
 st.header("📈 Statistical Summary")
 
 col1, col2 = st.columns(2)
@@ -1224,59 +1663,74 @@ col1, col2 = st.columns(2)
 with col1:
     st.subheader("Overall Statistics")
     
-    summary_stats = df_filtered[available_numeric].describe().T
-    summary_stats = summary_stats[['mean', 'std', 'min', '25%', '50%', '75%', 'max']]
-    summary_stats.columns = ['Mean', 'Std Dev', 'Min', '25th %ile', 'Median', '75th %ile', 'Max']
-    summary_stats = summary_stats.round(2)
+    # Moments, quartiles and completeness come back from the query backend as one small table
+    range_stats = queries.describe(available_numeric, range_start, range_end)
+    summary_stats = summary_table(range_stats)
     
     st.dataframe(summary_stats, use_container_width=True)
 
 with col2:
     st.subheader("Data Quality Report")
     
-    quality_data = []
-    for col in available_numeric:
-        total = len(df_filtered)
-        missing = df_filtered[col].isnull().sum()
-        completeness = ((total - missing) / total) * 100
-        
-        quality_data.append({
-            'Pollutant': col.upper(),
-            'Records': total - missing,
-            'Missing': missing,
-            'Completeness': f"{completeness:.1f}%"
-        })
-    
-    quality_df = pd.DataFrame(quality_data)
+    quality_df = quality_table(range_stats)
     st.dataframe(quality_df, use_container_width=True, hide_index=True)
 
 
 
-# ==== DOWNLOAD SECTION ====
-st.header("💾 Export Data")
+profiler.end_section()
 
-col1, col2 = st.columns(2)
+# ==== DOWNLOAD SECTION ====
+@chart_section("export")
+def export_data():
+    st.header("💾 Export Data")
 
-with col1:
-    # Download filtered data
-    csv_filtered = df_filtered.to_csv(index=False)
-    st.download_button(
-        label="📥 Download Filtered Data (CSV)",
-        data=csv_filtered,
-        file_name=f"beijing_air_quality_filtered_{datetime.now().strftime('%Y%m%d')}.csv",
-        mime="text/csv"
-    )
+    col1, col2 = st.columns(2)
 
-with col2:
-    # Download summary statistics
-    if available_numeric:
-        summary_csv = summary_stats.to_csv()
-        st.download_button(
-            label="📊 Download Statistics (CSV)",
-            data=summary_csv,
-            file_name=f"beijing_statistics_{datetime.now().strftime('%Y%m%d')}.csv",
-            mime="text/csv"
+    with col1:
+        # Nothing is written until a download is clicked; the export then streams in chunks
+        all_columns = export_columns(df_filtered)
+        export_cols = st.multiselect("Columns", all_columns, default=all_columns, key="export_columns")
+        export_range = st.date_input(
+            "Date range",
+            value=(start_date, end_date) if range_start is not None else (min_date, max_date),
+            min_value=min_date,
+            max_value=max_date,
+            key="export_range"
+        )
+        export_format = st.selectbox(
+            "Format",
+            list(FORMATS),
+            index=list(FORMATS).index("csv.gz"),
+            format_func=lambda fmt: FORMATS[fmt][0],
+            key="export_format"
         )
+        if isinstance(export_range, tuple) and len(export_range) == 2 and export_cols:
+            export_start = pd.Timestamp(export_range[0])
+            export_end = pd.Timestamp(export_range[1]) + pd.Timedelta(days=1)
+            st.download_button(
+                label=f"📥 Download Data ({FORMATS[export_format][0]})",
+                data=functools.partial(
+                    export_file, df, export_format, [c for c in all_columns if c in export_cols], export_start, export_end
+                ),
+                file_name=file_name(f"beijing_air_quality_{datetime.now().strftime('%Y%m%d')}", export_format),
+                mime=FORMATS[export_format][2],
+                on_click="ignore"
+            )
+        else:
+            st.info("Pick at least one column and both ends of the date range.")
+
+    with col2:
+        # Download summary statistics
+        if available_numeric:
+            st.download_button(
+                label="📊 Download Statistics (CSV)",
+                data=summary_stats.to_csv,
+                file_name=f"beijing_statistics_{datetime.now().strftime('%Y%m%d')}.csv",
+                mime="text/csv",
+                on_click="ignore"
+            )
+
+export_data()
 
 # ==== METHODOLOGY & REFERENCES ====
 st.header("📚 Methodology & Data Sources")
@@ -1400,6 +1854,38 @@ st.markdown("""
     time=datetime.now(pytz.timezone(selected_timezone)).strftime("%Y-%m-%d %H:%M:%S %Z")
 ), unsafe_allow_html=True)
 
+# ==== SIDEBAR: PERFORMANCE PANEL ====
+if profiler.enabled:
+    rerun_id = datetime.now().isoformat(timespec="seconds")
+    profiler.log(rerun=rerun_id)
+    timings = profiler.table()
+    with perf_panel.expander("⏱️ Stage timings", expanded=True):
+        top = timings[timings['depth'] == 0]
+        st.caption(f"Rerun total: {top['seconds'].sum():.2f}s · slowest: {top.loc[top['seconds'].idxmax(), 'span'] if len(top) else '-'}")
+        st.dataframe(pd.DataFrame({
+            'Stage': ['· ' * d + name for d, name in zip(timings['depth'], timings['span'])],
+            'ms': (timings['seconds'] * 1000).round(1),
+            'Peak': [format_bytes(b) if pd.notna(b) else '' for b in timings['peak_bytes']],
+            'Rows in': timings['rows_in'].astype('Int64'),
+            'Rows out': timings['rows_out'].astype('Int64'),
+            'Payload': [format_bytes(b) if pd.notna(b) else '' for b in timings['payload_bytes']]
+        }), hide_index=True)
+        st.download_button(
+            "📥 Chrome trace (JSON)",
+            data=json.dumps(profiler.chrome_trace()),
+            file_name=f"dashboard_trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json",
+            on_click="ignore",
+            help="Open in chrome://tracing or ui.perfetto.dev"
+        )
+        st.download_button(
+            "📥 Span log (JSON lines)",
+            data=profiler.json_lines(rerun=rerun_id),
+            file_name=f"dashboard_spans_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl",
+            mime="application/x-ndjson",
+            on_click="ignore"
+        )
+
 # ==== SIDEBAR: ABOUT ====
 with st.sidebar:
     st.divider()